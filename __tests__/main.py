@@ -1,11 +1,40 @@
 import unittest
+from unittest import mock
 from mcp.server.fastmcp import FastMCP
 import subprocess
 from typing import Dict, Any, Optional
 import sys
+import asyncio
+import base64
+import contextlib
 import json
+import os
+import signal
+import socket
+import tempfile
+import threading
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+from mcp.types import BlobResourceContents, CallToolRequest, CallToolResult, EmbeddedResource, ImageContent, TextContent  # noqa: E402
+from starlette.testclient import TestClient  # noqa: E402
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+from http_transport import HTTPTransport  # noqa: E402
+from dispatch import CONTROL_LANE, TOOLS_LANE, AdmissionControl, Lane, Overloaded, lane_for  # noqa: E402
+from executors import SHARED_MEMORY_THRESHOLD, BlockingPool, ProcessPool  # noqa: E402
+from file_cache import FileCache  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from plugins import LazyTool, ToolSpec, discover_tools  # noqa: E402
+from prefork import WorkerTransport, merge_snapshots, session_owner  # noqa: E402
+from mcp_server import MCPServer, ToolCall, dump_call_result  # noqa: E402
+from jsonrpc import encode_message  # noqa: E402
+from line_index import LineIndex, LineIndexCache  # noqa: E402
+from registry import ToolRegistry, compile_quick_check  # noqa: E402
+from tools import Greeting, ListDirectoryTool, MCPTool, ReadFileTool, ReadFilesTool, WriteFileTool, ToolCancelled, ToolContext, ToolTimeout, current_context, use_context  # noqa: E402
+from writer import MessageWriter  # noqa: E402
+
 
 def close_server(server):
     if server.stdin:
@@ -72,6 +101,37 @@ def send(
     return test_response, gold_response
 
 
+def start_server(*args: str):
+    return subprocess.Popen(
+        [sys.executable, "src/mcp_server.py", *args],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+
+def write_messages(server, *messages: Any) -> None:
+    if not server.stdin:
+        raise Exception("Server.stdin is None")
+    for msg in messages:
+        server.stdin.write(json.dumps(msg) + "\n")
+    server.stdin.flush()
+
+
+def read_message(server) -> Dict[str, Any]:
+    if not server.stdout:
+        raise Exception("Server.stdout is None")
+    return json.loads(server.stdout.readline())
+
+
+def request(method: str, id: int, params: Optional[Dict[str, Any]] = None):
+    msg: Dict[str, Any] = {"jsonrpc": "2.0", "id": id, "method": method}
+    if params:
+        msg["params"] = params
+    return msg
+
+
 class TestInitialize(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -193,5 +253,1708 @@ class TestToolCall(unittest.TestCase):
         self.assertEqual(message, expected)
 
 
+class TestConcurrentDispatch(unittest.TestCase):
+    def setUp(self):
+        self.server = start_server()
+        self.addCleanup(close_server, self.server)
+
+    def test_all_requests_answered(self):
+        write_messages(
+            self.server,
+            *[
+                request("tools/call", i, {"name": "list_directory", "arguments": {"directory_path": "src"}})
+                for i in range(1, 6)
+            ],
+            request("ping", 6),
+        )
+        responses = {}
+        for _ in range(6):
+            response = read_message(self.server)
+            responses[response["id"]] = response
+        self.assertEqual(set(responses), {1, 2, 3, 4, 5, 6})
+        self.assertEqual(responses[6]["result"], {})
+
+    def test_slow_call_does_not_block_ping(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fifo = os.path.join(tmp, "slow")
+            os.mkfifo(fifo)
+            write_messages(
+                self.server,
+                request("tools/call", 1, {"name": "read_file", "arguments": {"file_path": fifo}}),
+                request("ping", 2),
+            )
+            self.assertEqual(read_message(self.server)["id"], 2)
+
+            with open(fifo, "w") as writer:
+                writer.write("done")
+            response = read_message(self.server)
+            self.assertEqual(response["id"], 1)
+            self.assertEqual(response["result"]["content"][0]["text"], "done")
+
+    def test_cancelled_call_gets_no_response(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fifo = os.path.join(tmp, "slow")
+            os.mkfifo(fifo)
+            write_messages(
+                self.server,
+                request("tools/call", 1, {"name": "read_file", "arguments": {"file_path": fifo}}),
+            )
+            time.sleep(0.2)  # let the read start and block on the fifo
+            write_messages(
+                self.server,
+                {"jsonrpc": "2.0", "method": "notifications/cancelled", "params": {"requestId": 1, "reason": "gave up"}},
+                request("ping", 2),
+            )
+            self.assertEqual(read_message(self.server)["id"], 2)
+
+            # O_RDWR doesn't wait for a reader, in case the call never started
+            writer = os.open(fifo, os.O_RDWR)
+            os.write(writer, b"done")
+            os.close(writer)
+            write_messages(self.server, request("ping", 3))
+            self.assertEqual(read_message(self.server)["id"], 3)
+
+    def test_queued_call_can_be_cancelled(self):
+        server = start_server("--max-concurrency", "1")
+        self.addCleanup(close_server, server)
+        with tempfile.TemporaryDirectory() as tmp:
+            fifo = os.path.join(tmp, "slow")
+            os.mkfifo(fifo)
+            write_messages(
+                server,
+                request("tools/call", 1, {"name": "read_file", "arguments": {"file_path": fifo}}),
+                request("tools/call", 2, {"name": "greeting", "arguments": {"name": "Ada"}}),
+            )
+            time.sleep(0.2)  # let the read take the only slot
+            write_messages(
+                server,
+                {"jsonrpc": "2.0", "method": "notifications/cancelled", "params": {"requestId": 2}},
+                request("ping", 3),
+            )
+            self.assertEqual(read_message(server)["id"], 3)
+
+            writer = os.open(fifo, os.O_RDWR)
+            os.write(writer, b"done")
+            os.close(writer)
+            self.assertEqual(read_message(server)["id"], 1)
+            write_messages(server, request("ping", 4))
+            self.assertEqual(read_message(server)["id"], 4)
+
+    def test_progress_notifications(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as file:
+            file.write("x" * 100)
+            file.flush()
+            write_messages(
+                self.server,
+                request("tools/call", 1, {
+                    "name": "read_file",
+                    "arguments": {"file_path": file.name},
+                    "_meta": {"progressToken": "read-1"},
+                }),
+            )
+            progress = read_message(self.server)
+            self.assertEqual(progress["method"], "notifications/progress")
+            self.assertEqual(progress["params"], {"progressToken": "read-1", "progress": 100, "total": 100})
+            self.assertEqual(read_message(self.server)["id"], 1)
+
+    def test_client_deadline(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fifo = os.path.join(tmp, "stalled")
+            os.mkfifo(fifo)
+            write_messages(
+                self.server,
+                request("tools/call", 1, {
+                    "name": "read_file",
+                    "arguments": {"file_path": fifo},
+                    "_meta": {"timeoutMs": 200},
+                }),
+            )
+            error = read_message(self.server)["error"]
+            self.assertEqual(error["code"], -32001)
+            self.assertEqual(error["data"], {"tool": "read_file", "timeout": 0.2})
+
+            writer = os.open(fifo, os.O_RDWR)
+            os.close(writer)
+
+    def test_unknown_notification_gets_no_response(self):
+        write_messages(self.server, {"jsonrpc": "2.0", "method": "notifications/unknown"}, request("ping", 4))
+        self.assertEqual(read_message(self.server)["id"], 4)
+
+    def test_batch(self):
+        write_messages(
+            self.server,
+            [
+                request("ping", 1),
+                {"jsonrpc": "2.0", "method": "notifications/initialized"},
+                request("tools/call", 2, {"name": "greeting", "arguments": {"name": "Ada"}}),
+                "junk",
+            ],
+        )
+        responses = read_message(self.server)
+        self.assertEqual([response["id"] for response in responses], [1, 2, None])
+        self.assertEqual(responses[1]["result"]["content"][0]["text"], "Hello from the MCP Server Ada!")
+        self.assertEqual(responses[2]["error"]["code"], -32600)
+
+    def test_empty_batch(self):
+        write_messages(self.server, [])
+        self.assertEqual(read_message(self.server)["error"]["code"], -32600)
+
+    def test_notification_only_batch_gets_no_reply(self):
+        write_messages(
+            self.server,
+            [{"jsonrpc": "2.0", "method": "notifications/initialized"}],
+            request("ping", 7),
+        )
+        self.assertEqual(read_message(self.server)["id"], 7)
+
+    def test_parse_error(self):
+        self.server.stdin.write("{not json\n")
+        self.server.stdin.flush()
+        response = read_message(self.server)
+        self.assertEqual(response["error"]["code"], -32700)
+        self.assertIsNone(response["id"])
+
+
+class CountingTool(MCPTool):
+    def __init__(self):
+        super().__init__(
+            name="counter",
+            title="Counter",
+            description="Counts its calls.",
+            input_schema={"type": "object", "properties": {}},
+        )
+        self.calls = 0
+
+    def call(self, arguments):
+        self.calls += 1
+        return {"message": str(self.calls)}
+
+
+class TestToolRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = ToolRegistry()
+        self.registry.register(Greeting())
+
+    def test_dispatch_by_name(self):
+        result = self.registry.call("greeting", {"name": "Ada"})
+        self.assertFalse(result.isError)
+        self.assertEqual(result.content[0].text, "Hello from the MCP Server Ada!")
+
+    def test_unknown_tool(self):
+        result = self.registry.call("missing", {})
+        self.assertTrue(result.isError)
+        self.assertEqual(result.content[0].text, "Tool 'missing' not found")
+
+    def test_tool_error_becomes_error_result(self):
+        result = self.registry.call("greeting", {})
+        self.assertTrue(result.isError)
+        self.assertIn("Missing 'name'", result.content[0].text)
+
+    def test_tool_instance_is_reused(self):
+        tool = CountingTool()
+        self.registry.register(tool)
+        self.registry.call("counter", {})
+        result = self.registry.call("counter", {})
+        self.assertEqual(result.content[0].text, "2")
+        self.assertIs(self.registry.get("counter"), tool)
+
+    def test_custom_formatter(self):
+        self.registry.register(
+            CountingTool(),
+            formatter=lambda response: CallToolResult(
+                content=[TextContent(type="text", text=f"count={response['message']}")]
+            ),
+        )
+        self.assertEqual(self.registry.call("counter", {}).content[0].text, "count=1")
+        # A custom formatter is always used, even when plain results are asked for
+        self.assertEqual(self.registry.call("counter", {}, plain=True).content[0].text, "count=2")
+
+    def test_duplicate_registration_rejected(self):
+        with self.assertRaises(ValueError):
+            self.registry.register(Greeting())
+
+    def test_unregister(self):
+        self.registry.unregister("greeting")
+        self.assertNotIn("greeting", self.registry)
+        self.assertEqual(self.registry.list_tools(), [])
+
+
+class SchemaTool(CountingTool):
+    def __init__(self, input_schema):
+        super().__init__()
+        self.input_schema = input_schema
+
+
+class TestArgumentValidation(unittest.TestCase):
+    SCHEMA = {
+        "type": "object",
+        "properties": {"path": {"type": "string"}, "count": {"type": "integer"}},
+        "required": ["path"],
+        "additionalProperties": False,
+    }
+
+    def setUp(self):
+        self.registry = ToolRegistry()
+        self.tool = SchemaTool(self.SCHEMA)
+        self.registry.register(self.tool)
+
+    def test_bad_arguments_never_reach_the_tool(self):
+        result = self.registry.call("counter", {"path": 1})
+        self.assertTrue(result.isError)
+        self.assertEqual(self.tool.calls, 0)
+        self.assertFalse(self.registry.call("counter", {"path": "a", "count": 2}).isError)
+        self.assertEqual(self.tool.calls, 1)
+
+    def test_errors_are_structured(self):
+        result = self.registry.call("counter", {"count": True, "extra": 1})
+        errors = result.structuredContent["errors"]
+        self.assertEqual(
+            [(error["path"], error["keyword"]) for error in errors],
+            [("$.path", "required"), ("$", "additionalProperties"), ("$.count", "type")],
+        )
+        self.assertIn("Missing 'path' argument", result.content[0].text)
+
+    def test_quick_check_agrees_with_validator(self):
+        check = compile_quick_check(self.SCHEMA)
+        for arguments in ({"path": "a"}, {"path": "a", "count": 1}, {"path": "a", "count": True},
+                          {"path": "a", "count": 1.0}, {"path": "a", "other": 1}, {}):
+            valid = self.registry.check_arguments("counter", arguments) is None
+            if check(arguments):
+                self.assertTrue(valid, arguments)
+
+    def test_integral_floats_are_not_integers(self):
+        result = self.registry.call("counter", {"path": "a", "count": 1.0})
+        self.assertTrue(result.isError)
+        self.assertEqual(result.structuredContent["errors"][0]["keyword"], "type")
+        self.assertEqual(self.tool.calls, 0)
+
+        server = MCPServer()
+        for arguments in ({"offset": 1.0}, {"length": 2.0}, {"start_line": 1.0}):
+            result = server.registry.call("read_file", {"file_path": "README.md", **arguments})
+            self.assertTrue(result.isError, arguments)
+            self.assertIn("is not of type 'integer'", result.content[0].text)
+
+    def test_other_schemas_use_full_validator(self):
+        schema = {"type": "object", "properties": {"mode": {"enum": ["a", "b"]}}}
+        self.assertIsNone(compile_quick_check(schema))
+        registry = ToolRegistry()
+        registry.register(SchemaTool(schema))
+        self.assertTrue(registry.call("counter", {"mode": "c"}).isError)
+        self.assertFalse(registry.call("counter", {"mode": "a"}).isError)
+
+    def test_invalid_schema_is_refused(self):
+        with self.assertRaises(ValueError):
+            ToolRegistry().register(SchemaTool({"type": "nonsense"}))
+
+    def test_quick_check_applies_bounds(self):
+        check = compile_quick_check({"type": "object", "properties": {"n": {"type": "integer", "minimum": 1}}})
+        self.assertTrue(check({"n": 1}))
+        self.assertFalse(check({"n": 0}))
+
+
+class TestRangedReads(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "lines.txt")
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.writelines(f"line {number} \u00e9\n" for number in range(1, 101))
+        with open(self.path, encoding="utf-8") as f:
+            self.lines = f.readlines()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read_all(self, tool, arguments):
+        pieces = []
+        while True:
+            response = tool.call(arguments)
+            pieces.append(response["content"])
+            if not response["next_cursor"]:
+                return pieces
+            arguments = {"file_path": self.path, "cursor": response["next_cursor"]}
+
+    def test_byte_range(self):
+        response = ReadFileTool().call({"file_path": self.path, "offset": 5, "length": 4})
+        self.assertEqual(response["content"], "1 \u00e9")
+        self.assertEqual((response["offset"], response["end"]), (5, 9))
+        self.assertFalse(response["truncated"])
+
+    def test_line_range(self):
+        response = ReadFileTool().call({"file_path": self.path, "start_line": 10, "end_line": 12})
+        self.assertEqual(response["content"], "".join(self.lines[9:12]))
+        self.assertEqual(ReadFileTool().call({"file_path": self.path, "start_line": 500})["content"], "")
+
+    def test_capped_read_continues_with_cursor(self):
+        tool = ReadFileTool(max_bytes=25)
+        pieces = self.read_all(tool, {"file_path": self.path, "start_line": 5, "end_line": 30})
+        self.assertEqual("".join(pieces), "".join(self.lines[4:30]))
+        self.assertGreater(len(pieces), 1)
+        # Line reads are cut on line boundaries
+        self.assertTrue(all(piece.endswith("\n") for piece in pieces))
+
+        # Byte reads never split a character
+        pieces = self.read_all(ReadFileTool(max_bytes=9), {"file_path": self.path, "length": 200})
+        with open(self.path, "rb") as f:
+            self.assertEqual("".join(pieces), f.read(200).decode())
+
+    def test_truncated_result_mentions_cursor(self):
+        tool = ReadFileTool(max_bytes=10)
+        result = tool.format_result(tool.call({"file_path": self.path}))
+        self.assertEqual(result.content[0].text, "line 1 \u00e9\n")
+        self.assertIn("cursor", result.content[1].text)
+
+    def test_cursor_rejected_after_file_changes(self):
+        tool = ReadFileTool(max_bytes=10)
+        cursor = tool.call({"file_path": self.path})["next_cursor"]
+        with open(self.path, "a") as f:
+            f.write("more\n")
+        with self.assertRaisesRegex(ValueError, "changed"):
+            tool.call({"file_path": self.path, "cursor": cursor})
+        with self.assertRaisesRegex(ValueError, "Invalid cursor"):
+            tool.call({"file_path": self.path, "cursor": "nonsense"})
+
+    def test_line_index_matches_file(self):
+        with mock.patch("line_index.INDEX_CHUNK_SIZE", 7), open(self.path, "rb") as f:
+            index = LineIndex.build(f, os.path.getsize(self.path), ToolContext())
+        self.assertEqual(len(index), len(self.lines) + 1)
+        self.assertEqual(list(index.starts[:4]), [0, 10, 20, 30])
+        self.assertEqual(index.line_start(101), os.path.getsize(self.path))
+        self.assertEqual(index.line_start(500), os.path.getsize(self.path))
+
+    def test_line_index_is_reused_until_file_changes(self):
+        cache = LineIndexCache(max_entries=1)
+        tool = ReadFileTool(line_indexes=cache)
+        with mock.patch.object(LineIndex, "scan", autospec=True, side_effect=LineIndex.scan) as scan:
+            tool.call({"file_path": self.path, "start_line": 50, "end_line": 50})
+            self.assertEqual(tool.call({"file_path": self.path, "start_line": 90})["content"], "".join(self.lines[89:]))
+            self.assertEqual(scan.call_count, 1)
+
+            with open(self.path, "a") as f:
+                f.write("line 101\n")
+            self.assertEqual(tool.call({"file_path": self.path, "start_line": 101})["content"], "line 101\n")
+            self.assertEqual(scan.call_count, 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_line_index_stops_at_the_furthest_line_read(self):
+        cache = LineIndexCache()
+        tool = ReadFileTool(line_indexes=cache)
+        size = os.path.getsize(self.path)
+        with mock.patch("line_index.INDEX_CHUNK_SIZE", 25):
+            self.assertEqual(tool.call({"file_path": self.path, "start_line": 1, "end_line": 2})["content"], "".join(self.lines[:2]))
+            # Lines are 10 bytes, so the first chunk holds the start of line 3
+            self.assertEqual(cache.nbytes, 3 * 8)
+            self.assertEqual(tool.call({"file_path": self.path, "start_line": 30, "end_line": 30})["content"], self.lines[29])
+            self.assertLess(cache.nbytes, size)
+            self.assertEqual(tool.call({"file_path": self.path, "start_line": 100})["content"], self.lines[99])
+        self.assertEqual(cache.nbytes, (len(self.lines) + 1) * 8)
+
+    def test_line_index_cache_has_a_memory_budget(self):
+        cache = LineIndexCache(max_bytes=50 * 8)
+        tool = ReadFileTool(line_indexes=cache)
+        with mock.patch("line_index.INDEX_CHUNK_SIZE", 25):
+            tool.call({"file_path": self.path, "start_line": 1, "end_line": 2})
+            self.assertEqual(len(cache), 1)
+            # The whole file's index is over budget, so it isn't kept
+            self.assertEqual(tool.call({"file_path": self.path, "start_line": 100})["content"], self.lines[99])
+        self.assertEqual(len(cache), 0)
+
+    def test_modes_are_exclusive(self):
+        with self.assertRaisesRegex(ValueError, "only one"):
+            ReadFileTool().call({"file_path": self.path, "offset": 1, "start_line": 2})
+        server = MCPServer()
+        response = asyncio.run(
+            server.handle_request(
+                request("tools/call", 1, {"name": "read_file", "arguments": {"file_path": self.path, "offset": -1}})
+            )
+        )
+        self.assertTrue(response["result"]["isError"])
+
+
+class TestBinaryReads(unittest.TestCase):
+    DATA = b"\x89PNG\r\n\x1a\n\x00\x00" + bytes(range(256)) * 4
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "image.png")
+        with open(self.path, "wb") as f:
+            f.write(self.DATA)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_binary_file_is_returned_as_blob(self):
+        tool = ReadFileTool()
+        response = tool.call({"file_path": self.path})
+        self.assertIsNone(response["content"])
+        self.assertEqual(base64.b64decode(response["blob"]), self.DATA)
+
+        resource = tool.format_result(response).content[0]
+        self.assertIsInstance(resource, EmbeddedResource)
+        self.assertIsInstance(resource.resource, BlobResourceContents)
+        self.assertEqual(resource.resource.mimeType, "image/png")
+        self.assertTrue(str(resource.resource.uri).startswith("file://"))
+
+    def test_binary_pieces_reassemble(self):
+        tool = ReadFileTool(max_bytes=100)
+        arguments = {"file_path": self.path, "offset": 10}
+        data = b""
+        while True:
+            response = tool.call(arguments)
+            data += base64.b64decode(response["blob"])
+            if not response["next_cursor"]:
+                break
+            arguments = {"file_path": self.path, "cursor": response["next_cursor"]}
+        self.assertEqual(data, self.DATA[10:])
+
+    def test_text_window_starts_on_a_character(self):
+        path = os.path.join(self.dir.name, "text.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\u00e9t\u00e9")
+        response = ReadFileTool().call({"file_path": path, "offset": 1})
+        self.assertEqual((response["content"], response["offset"]), ("t\u00e9", 2))
+
+    def test_text_window_ending_inside_a_character_stays_text(self):
+        path = os.path.join(self.dir.name, "text.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("h\u00e9llo")
+        response = ReadFileTool().call({"file_path": path, "offset": 0, "length": 2})
+        self.assertIsNone(response["blob"])
+        self.assertEqual((response["content"], response["end"]), ("h", 1))
+        self.assertFalse(response["truncated"])
+
+    def test_cap_smaller_than_a_character_still_moves_on(self):
+        path = os.path.join(self.dir.name, "emoji.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\U0001f600" * 3)
+        tool = ReadFileTool(max_bytes=3)
+        pieces = []
+        response = tool.call({"file_path": path})
+        while True:
+            pieces.append(response["content"])
+            if not response["next_cursor"]:
+                break
+            self.assertLess(len(pieces), 4)
+            response = tool.call({"file_path": path, "cursor": response["next_cursor"]})
+        self.assertEqual(pieces, ["\U0001f600"] * 3)
+
+    def test_blob_result_through_server(self):
+        server = MCPServer()
+        response = asyncio.run(
+            server.handle_request(
+                request("tools/call", 1, {"name": "read_file", "arguments": {"file_path": self.path}})
+            )
+        )
+        content = json.loads(encode_message(response))["result"]["content"][0]
+        self.assertEqual(content["type"], "resource")
+        self.assertEqual(base64.b64decode(content["resource"]["blob"]), self.DATA)
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.metrics = Metrics()
+        self.cache = FileCache(self.metrics, max_bytes=300, max_file_bytes=200)
+        self.read = ReadFileTool(file_cache=self.cache)
+        self.write = WriteFileTool(file_cache=self.cache)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name, content):
+        path = os.path.join(self.dir.name, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def counts(self):
+        snapshot = self.metrics.snapshot()
+        return tuple(int(snapshot.get(f"file_cache_{name}", 0)) for name in ("hits", "misses", "evictions"))
+
+    def test_repeated_reads_hit(self):
+        path = self.path("a.txt", "one\ntwo\nthree\n")
+        self.assertEqual(self.read.call({"file_path": path})["content"], "one\ntwo\nthree\n")
+        with mock.patch("builtins.open", side_effect=AssertionError("read from disk")):
+            self.assertEqual(self.read.call({"file_path": path})["content"], "one\ntwo\nthree\n")
+            self.assertEqual(self.read.call({"file_path": path, "start_line": 2, "end_line": 2})["content"], "two\n")
+        self.assertEqual(self.counts(), (2, 1, 0))
+
+    def test_change_on_disk_is_noticed(self):
+        path = self.path("a.txt", "old")
+        self.read.call({"file_path": path})
+        with open(path, "w") as f:
+            f.write("newer")
+        self.assertEqual(self.read.call({"file_path": path})["content"], "newer")
+        self.assertEqual(self.counts(), (0, 2, 0))
+
+    def test_write_invalidates(self):
+        path = self.path("a.txt", "old")
+        self.read.call({"file_path": path})
+        self.write.call({"file_path": path, "content": "new"})
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.read.call({"file_path": path})["content"], "new")
+        self.assertEqual(self.metrics.snapshot()["file_cache_invalidations"], 1)
+
+    def test_budget_evicts_least_recently_used(self):
+        first = self.path("first.txt", "a" * 60)
+        second = self.path("second.txt", "b" * 60)
+        for path in (first, second, first):
+            self.read.call({"file_path": path})
+        # Text files are charged for their bytes and decoded text
+        self.read.call({"file_path": self.path("third.txt", "c" * 40)})
+        self.assertEqual(self.counts(), (1, 3, 1))
+        self.assertEqual(self.metrics.snapshot()["file_cache_bytes"], 200)
+        self.assertIsNone(self.cache.lookup(second))
+        self.assertIsNotNone(self.cache.lookup(first))
+
+    def test_large_files_are_not_cached(self):
+        self.read.call({"file_path": self.path("big.txt", "x" * 500)})
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestReadFiles(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for number, size in enumerate((10, 300, 20)):
+            path = os.path.join(self.dir.name, f"file{number}.txt")
+            with open(path, "w") as f:
+                f.write(str(number) * size)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_results_in_request_order_with_errors(self):
+        missing = os.path.join(self.dir.name, "missing.txt")
+        tool = ReadFilesTool(max_workers=2)
+        response = tool.call({"files": [self.paths[2], missing, {"file_path": self.paths[1], "offset": 295}]})
+        files = response["files"]
+        self.assertEqual([entry["file_path"] for entry in files], [self.paths[2], missing, self.paths[1]])
+        self.assertEqual(files[0]["content"], "2" * 20)
+        self.assertIn("No such file", files[1]["error"])
+        self.assertEqual(files[2]["content"], "1" * 5)
+
+        content = tool.format_result(response).content
+        self.assertEqual(len(content), 3)
+        self.assertIsInstance(content[0], EmbeddedResource)
+        self.assertEqual(content[0].resource.text, "2" * 20)
+        self.assertIsInstance(content[1], TextContent)
+
+    def test_cap_shares_spare_bytes(self):
+        tool = ReadFilesTool(max_bytes=120)
+        response = tool.call({"files": self.paths})
+        used = [entry["end"] - entry["offset"] for entry in response["files"]]
+        # Each file gets 40 bytes; the big one also gets the 50 the others left
+        self.assertEqual(used, [10, 90, 20])
+        big = response["files"][1]
+        self.assertTrue(big["truncated"])
+
+        continued = ReadFileTool().call({"file_path": self.paths[1], "cursor": big["next_cursor"]})
+        self.assertEqual(big["content"] + continued["content"], "1" * 300)
+        note = tool.format_result(response).content[-1].text
+        self.assertIn("capped at 120 bytes", note)
+        self.assertIn(big["next_cursor"], note)
+
+    def test_spare_bytes_continue_the_first_read(self):
+        tool = ReadFilesTool(max_bytes=120)
+        reads = []
+        read = tool.reader.read
+
+        def recording_read(arguments, max_bytes, context):
+            reads.append((arguments, max_bytes))
+            return read(arguments, max_bytes, context)
+
+        with mock.patch.object(tool.reader, "read", recording_read):
+            response = tool.call({"files": self.paths})
+        self.assertEqual(response["files"][1]["content"], "1" * 90)
+        self.assertEqual(len(reads), 4)
+        # Only the 50 spare bytes are read again, from where the first read stopped
+        arguments, max_bytes = reads[-1]
+        self.assertIn("cursor", arguments)
+        self.assertEqual(max_bytes, 50)
+
+    def test_close_stops_the_read_pool(self):
+        metrics = Metrics()
+        tool = ReadFilesTool(max_workers=3, metrics=metrics)
+        tool.call({"files": self.paths})
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["read_pool_size"], 3)
+        self.assertEqual(snapshot["read_pool_queued"], 0)
+        self.assertEqual(snapshot["read_pool_active"], 0)
+        self.assertEqual(snapshot["read_pool_tasks"], 3)
+
+        executor = tool._executor
+        tool.close()
+        self.assertIsNone(tool._executor)
+        with self.assertRaises(RuntimeError):
+            executor.submit(print)
+
+    def test_server_close_stops_the_read_pool(self):
+        server = MCPServer(read_threads=2)
+        asyncio.run(
+            server.handle_request(
+                request("tools/call", 1, {"name": "read_files", "arguments": {"files": self.paths}})
+            )
+        )
+        tool = server.registry.get("read_files").resolve()
+        self.assertIsNotNone(tool._executor)
+        server.close()
+        self.assertIsNone(tool._executor)
+
+    def test_cancellation_stops_the_batch(self):
+        context = ToolContext()
+        context.cancel()
+        with use_context(context), self.assertRaises(ToolCancelled):
+            ReadFilesTool().call({"files": self.paths})
+
+    def test_through_server(self):
+        server = MCPServer()
+        response = asyncio.run(
+            server.handle_request(
+                request("tools/call", 1, {"name": "read_files", "arguments": {"files": self.paths[:1]}})
+            )
+        )
+        content = json.loads(encode_message(response))["result"]["content"]
+        self.assertEqual(content[0]["resource"]["text"], "0" * 10)
+        self.assertTrue(content[0]["resource"]["uri"].startswith("file://"))
+
+
+PLUGIN_MANIFEST = """
+TOOLS = [
+    {
+        "name": "shout",
+        "title": "Shout",
+        "description": "Upper-cases its input.",
+        "input_schema": {"type": "object", "properties": {"text": {"type": "string"}}, "required": ["text"]},
+        "target": "%(impl)s:ShoutTool",
+        "blocking": True,
+    },
+    {"name": "broken"},
+]
+"""
+
+PLUGIN_IMPL = """
+from tools import MCPTool
+
+
+class ShoutTool(MCPTool):
+    def __init__(self):
+        super().__init__("shout", "Shout", "Upper-cases its input.", {})
+
+    def call(self, arguments):
+        return {"message": arguments["text"].upper()}
+"""
+
+
+class TestPluginTools(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = tmp.name
+        sys.path.insert(0, self.path)
+        self.addCleanup(sys.path.remove, self.path)
+
+        # Unique names so every test imports its pack afresh
+        suffix = self.id().rsplit(".", 1)[-1]
+        self.manifest, self.impl = f"manifest_{suffix}", f"impl_{suffix}"
+        with open(os.path.join(self.path, f"{self.manifest}.py"), "w") as f:
+            f.write(PLUGIN_MANIFEST % {"impl": self.impl})
+        with open(os.path.join(self.path, f"{self.impl}.py"), "w") as f:
+            f.write(PLUGIN_IMPL)
+
+    def test_implementation_is_imported_on_first_call(self):
+        tools = discover_tools([self.manifest], group=None)
+        self.assertEqual([tool.name for tool in tools], ["shout"])
+        self.assertTrue(tools[0].blocking)
+
+        registry = ToolRegistry()
+        registry.register(tools[0])
+        self.assertEqual(registry.list_tools()[0].title, "Shout")
+        self.assertNotIn(self.impl, sys.modules)
+
+        result = registry.call("shout", {"text": "hi"})
+        self.assertEqual(result.content[0].text, "HI")
+        self.assertIn(self.impl, sys.modules)
+
+    def test_entry_points(self):
+        dist_info = os.path.join(self.path, "shout_pack-1.0.dist-info")
+        os.mkdir(dist_info)
+        with open(os.path.join(dist_info, "METADATA"), "w") as f:
+            f.write("Metadata-Version: 2.1\nName: shout-pack\nVersion: 1.0\n")
+        with open(os.path.join(dist_info, "entry_points.txt"), "w") as f:
+            f.write(f"[mcp_server.tools]\nshout = {self.manifest}:TOOLS\n")
+
+        self.assertIn("shout", [tool.name for tool in discover_tools()])
+
+    def test_missing_implementation_is_an_error_result(self):
+        tool = LazyTool(ToolSpec("ghost", "Ghost", "", {"type": "object"}, target="no_such_module:Ghost"))
+        registry = ToolRegistry()
+        registry.register(tool)
+        result = registry.call("ghost", {})
+        self.assertTrue(result.isError)
+        self.assertIn("could not be loaded", result.content[0].text)
+
+    def plugin(self, name: str, prelude: str = "", **flags) -> LazyTool:
+        with open(os.path.join(self.path, f"{name}.py"), "w") as f:
+            f.write(prelude + PLUGIN_IMPL)
+        return LazyTool(ToolSpec("shout", "Shout", "", {"type": "object"}, target=f"{name}:ShoutTool", **flags))
+
+    def test_slow_import_does_not_block_the_loop(self):
+        server = MCPServer()
+        server.registry.register(self.plugin(f"{self.impl}_slow", "import time\ntime.sleep(0.5)\n"))
+
+        async def run():
+            call = asyncio.create_task(
+                server.handle_request(request("tools/call", 1, {"name": "shout", "arguments": {"text": "hi"}}))
+            )
+            await asyncio.sleep(0.05)
+            started = time.monotonic()
+            await server.handle_request(request("ping", 2))
+            waited = time.monotonic() - started
+            return waited, await call
+
+        waited, response = asyncio.run(run())
+        self.assertLess(waited, 0.3)
+        self.assertEqual(response["result"]["content"][0]["text"], "HI")
+
+    def test_cpu_bound_plugins_load_only_in_workers(self):
+        server = MCPServer(tool_processes=1)
+        self.addCleanup(server.process_pool.shutdown)
+        name = f"{self.impl}_cpu"
+        server.registry.register(self.plugin(name, cpu_bound=True))
+        response = asyncio.run(
+            server.handle_request(request("tools/call", 1, {"name": "shout", "arguments": {"text": "hi"}}))
+        )
+        self.assertEqual(response["result"]["content"][0]["text"], "HI")
+        self.assertNotIn(name, sys.modules)
+
+    def test_missing_manifest_is_skipped(self):
+        self.assertEqual(discover_tools(["no_such_manifest"], group=None), [])
+
+
+class TestToolCancellation(unittest.TestCase):
+    def test_directory_walk_stops_when_cancelled(self):
+        context = ToolContext()
+        context.cancel()
+        with use_context(context), self.assertRaises(ToolCancelled):
+            ListDirectoryTool().call({"directory_path": "src"})
+
+    def test_progress_is_rate_limited(self):
+        sent = []
+        context = ToolContext(progress_token=7, on_progress=sent.append, progress_interval=60)
+        for done in range(1, 11):
+            context.report_progress(done, 10)
+        self.assertEqual(sent, [
+            {"progressToken": 7, "progress": 1, "total": 10},
+            {"progressToken": 7, "progress": 10, "total": 10},
+        ])
+
+    def test_progress_needs_token(self):
+        sent = []
+        ToolContext(on_progress=sent.append).report_progress(1)
+        self.assertEqual(sent, [])
+
+    def test_direct_calls_are_never_cancelled(self):
+        response = ListDirectoryTool().call({"directory_path": "src"})
+        self.assertIn("tools.py", response["files"])
+
+    def test_malformed_cancellation_gets_no_reply(self):
+        server = MCPServer()
+        for params in (None, {}, {"reason": "bored"}):
+            notification = {"jsonrpc": "2.0", "method": "notifications/cancelled"}
+            if params is not None:
+                notification["params"] = params
+            self.assertIsNone(asyncio.run(server.handle_request(notification)))
+
+
+class SlowTool(CountingTool):
+    timeout = 5
+
+
+class TestToolTimeouts(unittest.TestCase):
+    def call_timeout(self, server, meta=None):
+        params = {"name": "counter", "arguments": {}}
+        if meta:
+            params["_meta"] = meta
+        return server.call_timeout(ToolCall.from_request(CallToolRequest(method="tools/call", params=params)))
+
+    def test_shortest_limit_wins(self):
+        server = MCPServer(tool_timeout=10)
+        server.registry.register(SlowTool())
+        self.assertEqual(self.call_timeout(server), 5)
+        self.assertEqual(self.call_timeout(server, {"timeoutMs": 1500}), 1.5)
+
+    def test_no_limit_by_default(self):
+        server = MCPServer()
+        server.registry.register(CountingTool())
+        self.assertIsNone(self.call_timeout(server))
+
+    def test_expired_context_stops_tool(self):
+        context = ToolContext(timeout=0)
+        with use_context(context), self.assertRaises(ToolTimeout):
+            ListDirectoryTool().call({"directory_path": "src"})
+
+
+class TestAdmissionControl(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+        self.admission = AdmissionControl(self.metrics, max_in_flight=1, max_queued=1, max_buffered_bytes=100)
+
+    def test_queue_limit(self):
+        async def run():
+            running = self.admission.admit(10)
+            await running.__aenter__()
+            self.admission.admit(10)
+            with self.assertRaises(Overloaded):
+                self.admission.admit(10)
+            await running.__aexit__(None, None, None)
+
+        asyncio.run(run())
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot["requests_admitted"], 2)
+        self.assertEqual(snapshot["requests_rejected_queue_full"], 1)
+        self.assertEqual(snapshot["requests_in_flight"], 0)
+        self.assertEqual(snapshot["requests_queued"], 1)
+
+    def test_byte_budget(self):
+        self.admission.admit(60)
+        with self.assertRaises(Overloaded):
+            self.admission.admit(60)
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot["requests_rejected"], 1)
+        self.assertEqual(snapshot["requests_rejected_bytes"], 1)
+        self.assertEqual(snapshot["request_bytes_buffered"], 60)
+
+    def test_budget_returned_after_request(self):
+        async def run():
+            async with self.admission.admit(100):
+                pass
+            self.admission.admit(100)
+
+        asyncio.run(run())
+
+
+class TestScheduler(unittest.TestCase):
+    def test_lane_for(self):
+        self.assertEqual(lane_for(request("ping", 1)), CONTROL_LANE)
+        self.assertEqual(lane_for(request("tools/list", 1)), CONTROL_LANE)
+        self.assertEqual(lane_for(request("tools/call", 1, {"name": "greeting"})), TOOLS_LANE)
+        self.assertEqual(lane_for([request("ping", 1), request("tools/call", 2)]), TOOLS_LANE)
+
+    def test_clients_take_turns(self):
+        async def run():
+            lane = Lane("tools", capacity=1, max_queued=10)
+            order = []
+
+            async def job(key, label):
+                await lane.acquire(key)
+                order.append(label)
+                await asyncio.sleep(0)
+                lane.release()
+
+            await lane.acquire("busy")
+            tasks = [asyncio.create_task(job("a", f"a{i}")) for i in range(3)]
+            tasks.append(asyncio.create_task(job("b", "b0")))
+            await asyncio.sleep(0)
+            lane.release()
+            await asyncio.gather(*tasks)
+            return order
+
+        self.assertEqual(asyncio.run(run()), ["a0", "b0", "a1", "a2"])
+
+    def test_control_lane_bypasses_tool_backlog(self):
+        async def run():
+            metrics = Metrics()
+            admission = AdmissionControl(metrics, max_in_flight=1, max_queued=0)
+            async with admission.admit(10, TOOLS_LANE, "a"):
+                with self.assertRaises(Overloaded):
+                    admission.admit(10, TOOLS_LANE, "a")
+                async with admission.admit(10, CONTROL_LANE, "a"):
+                    snapshot = metrics.snapshot()
+            return snapshot
+
+        snapshot = asyncio.run(run())
+        self.assertEqual(snapshot["lane_tools_in_flight"], 1)
+        self.assertEqual(snapshot["lane_control_in_flight"], 1)
+        self.assertEqual(snapshot["lane_tools_rejected"], 1)
+
+
+class ConcurrencyTool(CountingTool):
+    blocking = True
+
+    def __init__(self):
+        super().__init__()
+        self.running = 0
+        self.most_running = 0
+        self.lock = threading.Lock()
+
+    def call(self, arguments):
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        return super().call(arguments)
+
+
+class TestBatchAdmission(unittest.TestCase):
+    def test_batch_cannot_exceed_max_concurrency(self):
+        tool = ConcurrencyTool()
+        registry = ToolRegistry()
+        registry.register(tool)
+        server = MCPServer(registry=registry, max_concurrent_requests=2, max_queued_requests=1)
+        batch = [request("tools/call", i, {"name": "counter", "arguments": {}}) for i in range(40)]
+        batch.append(request("ping", 40))
+
+        replies = asyncio.run(server.handle_batch(batch, size=4000))
+        self.assertEqual([reply["id"] for reply in replies], list(range(41)))
+        rejected = [reply for reply in replies if "error" in reply]
+        self.assertEqual(len(rejected), 37)
+        self.assertTrue(all(reply["error"]["code"] == -32002 for reply in rejected))
+        self.assertEqual(tool.calls, 3)
+        self.assertLessEqual(tool.most_running, 2)
+        self.assertIn("result", replies[40])
+        self.assertEqual(server.metrics.snapshot()["request_bytes_buffered"], 0)
+
+    def test_batch_over_stdio_is_admitted_per_member(self):
+        server = start_server("--max-concurrency", "1", "--max-queued", "0")
+        try:
+            write_messages(
+                server,
+                [request("tools/call", i, {"name": "greeting", "arguments": {"name": "Ada"}}) for i in range(5)],
+            )
+            replies = read_message(server)
+            self.assertEqual(sum("error" in reply for reply in replies), 4)
+        finally:
+            close_server(server)
+
+
+class ThreadNameTool(CountingTool):
+    def __init__(self, name: str, blocking: bool):
+        super().__init__()
+        self.name = name
+        self.blocking = blocking
+
+    def call(self, arguments):
+        return {"message": threading.current_thread().name}
+
+
+class TestBlockingPool(unittest.TestCase):
+    def test_only_blocking_tools_leave_the_event_loop(self):
+        server = MCPServer()
+        server.registry.register(ThreadNameTool("inline", blocking=False))
+        server.registry.register(ThreadNameTool("offloaded", blocking=True))
+
+        def thread_of(name):
+            response = asyncio.run(server.handle_request(request("tools/call", 1, {"name": name})))
+            return response["result"]["content"][0]["text"]
+
+        self.assertEqual(thread_of("inline"), threading.current_thread().name)
+        self.assertTrue(thread_of("offloaded").startswith("mcp-tool"))
+        self.assertEqual(server.metrics.snapshot()["tool_pool_tasks"], 1)
+
+    def test_context_reaches_worker(self):
+        async def run():
+            pool = BlockingPool(Metrics(), max_workers=1)
+            context = ToolContext()
+            with use_context(context):
+                seen = await pool.run(current_context)
+            pool.shutdown()
+            return context, seen
+
+        context, seen = asyncio.run(run())
+        self.assertIs(seen, context)
+
+    def test_queue_depth_and_wait_time(self):
+        async def run():
+            metrics = Metrics()
+            pool = BlockingPool(metrics, max_workers=1)
+            release = threading.Event()
+            first = asyncio.ensure_future(pool.run(release.wait))
+            second = asyncio.ensure_future(pool.run(lambda: None))
+            await asyncio.sleep(0.05)
+            busy = metrics.snapshot()
+            release.set()
+            await asyncio.gather(first, second)
+            pool.shutdown()
+            return busy, metrics.snapshot()
+
+        busy, done = asyncio.run(run())
+        self.assertEqual((busy["tool_pool_active"], busy["tool_pool_queued"]), (1, 1))
+        self.assertEqual((done["tool_pool_active"], done["tool_pool_queued"]), (0, 0))
+        self.assertGreater(done["tool_pool_wait_seconds"], 0)
+
+
+class ProcessTool(CountingTool):
+    cpu_bound = True
+
+    def __init__(self):
+        super().__init__()
+        self.name = "process"
+
+    def call(self, arguments):
+        action = arguments.get("action")
+        if action == "crash":
+            os._exit(1)
+        if action == "reject":
+            raise ValueError("rejected")
+        if action == "echo":
+            return {"message": arguments["data"][::-1]}
+        if action == "slow":
+            time.sleep(0.5)
+            return {"message": "x" * 2 * SHARED_MEMORY_THRESHOLD}
+        return {"message": str(os.getpid())}
+
+
+class TestProcessPool(unittest.TestCase):
+    def setUp(self):
+        self.server = MCPServer(tool_processes=1, tool_process_tasks=2)
+        self.server.registry.register(ProcessTool())
+
+    def tearDown(self):
+        self.server.process_pool.shutdown()
+
+    def call(self, **arguments) -> CallToolResult:
+        async def run():
+            return await self.server.handle_request(
+                request("tools/call", 1, {"name": "process", "arguments": arguments})
+            )
+
+        return asyncio.run(run())["result"]
+
+    def test_runs_in_another_process(self):
+        self.server.start_workers()
+        pid = int(self.call()["content"][0]["text"])
+        self.assertNotEqual(pid, os.getpid())
+
+    def test_large_payloads_use_shared_memory(self):
+        data = "ab" * SHARED_MEMORY_THRESHOLD
+        result = self.call(action="echo", data=data)
+        self.assertEqual(result["content"][0]["text"], data[::-1])
+
+    def test_tool_errors_are_results(self):
+        result = self.call(action="reject")
+        self.assertTrue(result["isError"])
+        self.assertEqual(result["content"][0]["text"], "rejected")
+
+    def test_crashed_pool_is_replaced(self):
+        broken = self.server.process_pool._executor
+        result = self.call(action="crash")
+        self.assertTrue(result["isError"])
+        # The replacement is started straight away
+        replacement = self.server.process_pool._executor
+        self.assertIsNot(replacement, broken)
+        self.assertTrue(replacement._processes)
+        self.assertFalse(self.call().get("isError"))
+        self.assertEqual(self.server.metrics.snapshot()["process_pool_restarts"], 1)
+
+    def test_crash_replaces_the_pool_once(self):
+        self.server = MCPServer(tool_processes=1)
+        self.server.registry.register(ProcessTool())
+
+        async def run():
+            calls = [
+                self.server.handle_request(
+                    request("tools/call", i, {"name": "process", "arguments": {"action": action}})
+                )
+                for i, action in enumerate(["crash", "pid", "pid", "pid"])
+            ]
+            return await asyncio.gather(*calls)
+
+        for response in asyncio.run(run()):
+            self.assertTrue(response["result"]["isError"])
+        self.assertEqual(self.server.metrics.snapshot()["process_pool_restarts"], 1)
+        self.assertFalse(self.call().get("isError"))
+
+    def test_abandoned_results_free_their_shared_memory(self):
+        def segments():
+            return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")}
+
+        self.server.start_workers()
+        before = segments()
+
+        async def run():
+            return await self.server.handle_request(
+                request("tools/call", 1, {"name": "process", "arguments": {"action": "slow"}, "_meta": {"timeoutMs": 100}})
+            )
+
+        self.assertEqual(asyncio.run(run())["error"]["code"], -32001)
+        time.sleep(1)
+        self.assertEqual(segments(), before)
+
+    def test_workers_are_recycled(self):
+        pids = [self.call()["content"][0]["text"] for _ in range(3)]
+        self.assertEqual(pids[0], pids[1])
+        self.assertNotEqual(pids[1], pids[2])
+        self.assertEqual(self.server.metrics.snapshot()["process_pool_recycles"], 1)
+
+    def test_rejects_bad_task_limit(self):
+        with self.assertRaises(ValueError):
+            ProcessPool(Metrics(), max_tasks_per_worker=0)
+
+
+class TestFastPath(unittest.TestCase):
+    def call(self, server, params) -> Dict[str, Any]:
+        return asyncio.run(server.handle_request(request("tools/call", 1, params)))
+
+    def test_matches_strict_validation(self):
+        params = {"name": "greeting", "arguments": {"name": "Ada"}, "_meta": {"progressToken": "t"}}
+        self.assertEqual(self.call(MCPServer(), params), self.call(MCPServer(strict_validation=True), params))
+
+    def test_bad_params_are_rejected(self):
+        for params in ({"arguments": {}}, {"name": "greeting", "arguments": []}, {"name": "greeting", "_meta": {"progressToken": 1.5}}):
+            for server in (MCPServer(), MCPServer(strict_validation=True)):
+                self.assertEqual(self.call(server, params)["error"]["code"], -32602)
+
+    def test_reads_request_meta(self):
+        call = ToolCall.from_params({"name": "greeting", "_meta": {"progressToken": 7, "timeoutMs": 250}})
+        self.assertEqual((call.name, call.arguments, call.progress_token, call.timeout_ms), ("greeting", None, 7, 250))
+
+    def test_plain_text_results_skip_the_models(self):
+        server = MCPServer()
+        plain = server.registry.call("greeting", {"name": "Ada"}, plain=True)
+        self.assertIsInstance(plain, dict)
+        self.assertEqual(plain, server.registry.call("greeting", {"name": "Ada"}).model_dump(exclude_none=True))
+        with mock.patch("mcp_server.dump_call_result", side_effect=AssertionError):
+            result = self.call(server, {"name": "greeting", "arguments": {"name": "Ada"}})
+        self.assertEqual(result["result"], plain)
+
+    def test_other_results_keep_the_models(self):
+        self.assertIsNone(ReadFileTool().format_text({"content": "x"}))
+        server = MCPServer()
+        errors = server.registry.call("greeting", {}, plain=True)
+        self.assertIsInstance(errors, CallToolResult)
+        self.assertTrue(errors.isError)
+
+    def test_dump_call_result(self):
+        text = CallToolResult(content=[TextContent(type="text", text="hi")], isError=True)
+        image = CallToolResult(content=[ImageContent(type="image", data="AA==", mimeType="image/png")])
+        for result in (text, image):
+            self.assertEqual(dump_call_result(result), result.model_dump(exclude_none=True))
+
+
+class TestToolsListCache(unittest.TestCase):
+    def setUp(self):
+        self.server = MCPServer()
+        self.sent = []
+        self.server.default_session.write_message = self.sent.append
+
+    def list_tools(self) -> Dict[str, Any]:
+        response = asyncio.run(self.server.handle_request(request("tools/list", 1)))
+        return json.loads(encode_message(response))
+
+    def test_result_is_reused(self):
+        first = asyncio.run(self.server.handle_request(request("tools/list", 1)))
+        second = asyncio.run(self.server.handle_request(request("tools/list", 2)))
+        self.assertIs(first["result"], second["result"])
+        self.assertEqual(json.loads(encode_message(second))["id"], 2)
+
+    def test_matches_model_dump(self):
+        expected = self.server.handle_list_tools().model_dump(exclude_none=True)
+        self.assertEqual(self.list_tools()["result"], expected)
+
+    def test_registry_change_rebuilds_and_notifies(self):
+        asyncio.run(
+            self.server.handle_request(
+                request("initialize", 1, {
+                    "protocolVersion": "2024-11-05",
+                    "capabilities": {},
+                    "clientInfo": {"name": "test", "version": "1"},
+                })
+            )
+        )
+        self.list_tools()
+        self.server.registry.register(CountingTool())
+
+        self.assertEqual(self.sent, [{"jsonrpc": "2.0", "method": "notifications/tools/list_changed"}])
+        names = [tool["name"] for tool in self.list_tools()["result"]["tools"]]
+        self.assertIn("counter", names)
+
+    def test_no_notification_before_initialize(self):
+        self.server.registry.register(CountingTool())
+        self.assertEqual(self.sent, [])
+
+
+class TestToolsListPagination(unittest.TestCase):
+    def setUp(self):
+        self.server = MCPServer(tools_page_size=2)
+
+    def list_tools(self, cursor: Optional[str] = None) -> Dict[str, Any]:
+        params = {"cursor": cursor} if cursor is not None else None
+        response = asyncio.run(self.server.handle_request(request("tools/list", 1, params)))
+        return json.loads(encode_message(response))
+
+    def walk(self):
+        names, cursor = [], None
+        while True:
+            result = self.list_tools(cursor)["result"]
+            self.assertLessEqual(len(result["tools"]), 2)
+            names.extend(tool["name"] for tool in result["tools"])
+            cursor = result.get("nextCursor")
+            if cursor is None:
+                return names
+
+    def test_pages_cover_every_tool_once(self):
+        expected = sorted(tool.name for tool in self.server.registry.list_tools())
+        self.assertEqual(self.walk(), expected)
+
+    def test_cursor_survives_tool_removal(self):
+        cursor = self.list_tools()["result"]["nextCursor"]
+        self.server.registry.unregister("list_directory")
+        names = [tool["name"] for tool in self.list_tools(cursor)["result"]["tools"]]
+        self.assertEqual(names, ["read_file", "read_files"])
+
+    def test_invalid_cursor(self):
+        response = self.list_tools("!!!")
+        self.assertEqual(response["error"]["code"], -32602)
+
+    def test_malformed_params(self):
+        for params in ([1], "cursor", {"cursor": 5}, {"cursor": ["a"]}):
+            message = {"jsonrpc": "2.0", "id": 1, "method": "tools/list", "params": params}
+            response = asyncio.run(self.server.handle_request(message))
+            self.assertEqual(response["error"]["code"], -32602, params)
+
+    def test_unpaginated_by_default(self):
+        server = MCPServer()
+        result = asyncio.run(server.handle_request(request("tools/list", 1)))
+        self.assertNotIn("nextCursor", json.loads(result["result"].data))
+
+
+class TestMessageWriter(unittest.TestCase):
+    def test_ready_messages_are_coalesced(self):
+        chunks = []
+
+        async def sink(data: bytes) -> None:
+            chunks.append(data)
+
+        async def run():
+            writer = MessageWriter(sink)
+            writer.start()
+            for i in range(3):
+                await writer.write(b"%d" % i)
+            await writer.close()
+
+        asyncio.run(run())
+        self.assertEqual(chunks, [b"0\n1\n2\n"])
+
+    def test_full_buffer_applies_backpressure(self):
+        async def run():
+            release = asyncio.Event()
+            chunks = []
+
+            async def sink(data: bytes) -> None:
+                await release.wait()
+                chunks.append(data)
+
+            writer = MessageWriter(sink, max_pending=2)
+            writer.start()
+            await writer.write(b"a")
+            await asyncio.sleep(0)  # the writer task takes "a" and blocks in the sink
+            await writer.write(b"b")
+            await writer.write(b"c")
+            blocked = asyncio.create_task(writer.write(b"d"))
+            await asyncio.sleep(0.01)
+            self.assertFalse(blocked.done())
+
+            release.set()
+            await blocked
+            await writer.close()
+            return chunks
+
+        self.assertEqual(b"".join(asyncio.run(run())), b"a\nb\nc\nd\n")
+
+
+INITIALIZE_PARAMS = {
+    "protocolVersion": "2024-11-05",
+    "capabilities": {},
+    "clientInfo": {"name": "test", "version": "1"},
+}
+
+
+class TestHTTPTransport(unittest.TestCase):
+    def setUp(self):
+        self.server = MCPServer()
+        self.transport = HTTPTransport(self.server)
+        self.client = TestClient(self.transport.create_app())
+        response = self.client.post("/mcp", json=request("initialize", 1, INITIALIZE_PARAMS))
+        self.assertEqual(response.status_code, 200)
+        self.session_id = response.headers["mcp-session-id"]
+        self.headers = {"Mcp-Session-Id": self.session_id}
+
+    def test_initialize_creates_session(self):
+        session = self.transport.sessions[self.session_id]
+        self.assertTrue(session.initialized)
+        self.assertEqual(session.client_info.name, "test")
+
+    def test_tool_call(self):
+        response = self.client.post(
+            "/mcp",
+            json=request("tools/call", 2, {"name": "greeting", "arguments": {"name": "Ada"}}),
+            headers=self.headers,
+        )
+        self.assertEqual(response.json()["result"]["content"][0]["text"], "Hello from the MCP Server Ada!")
+
+    def test_batch(self):
+        response = self.client.post("/mcp", json=[request("ping", 2), request("ping", 3)], headers=self.headers)
+        self.assertEqual([reply["id"] for reply in response.json()], [2, 3])
+
+    def test_notification_accepted(self):
+        response = self.client.post(
+            "/mcp",
+            json={"jsonrpc": "2.0", "method": "notifications/initialized"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 202)
+
+    def test_missing_session(self):
+        self.assertEqual(self.client.post("/mcp", json=request("ping", 2)).status_code, 400)
+
+    def test_unknown_session(self):
+        response = self.client.post("/mcp", json=request("ping", 2), headers={"Mcp-Session-Id": "nope"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_delete_ends_session(self):
+        self.assertEqual(self.client.delete("/mcp", headers=self.headers).status_code, 204)
+        response = self.client.post("/mcp", json=request("ping", 2), headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_metrics_endpoint(self):
+        self.client.post("/mcp", json=request("ping", 2), headers=self.headers)
+        metrics = self.client.get("/metrics").json()
+        self.assertEqual(metrics["requests_admitted"], 2)
+        self.assertEqual(metrics["requests_in_flight"], 0)
+
+    def test_foreign_origin_is_refused(self):
+        ping = request("ping", 2)
+        response = self.client.post("/mcp", json=ping, headers={**self.headers, "Origin": "http://evil.example"})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.server.metrics.snapshot()["http_origin_rejected"], 1)
+        for origin in ("http://localhost:5173", "http://127.0.0.1", "null"):
+            response = self.client.post("/mcp", json=ping, headers={**self.headers, "Origin": origin})
+            self.assertEqual(response.status_code, 403 if origin == "null" else 200, origin)
+
+    def test_allowed_origins_are_configurable(self):
+        transport = HTTPTransport(self.server, allowed_origins=["https://app.example.com"])
+        self.assertTrue(transport.origin_allowed("https://app.example.com"))
+        self.assertTrue(transport.origin_allowed("https://app.example.com:8443"))
+        self.assertTrue(transport.origin_allowed(None))
+        self.assertFalse(transport.origin_allowed("http://localhost"))
+        self.assertFalse(transport.origin_allowed("https://app.example.com.evil.example"))
+
+    def test_requests_finished_while_draining_are_counted(self):
+        self.server.draining = True
+        self.client.post("/mcp", json=request("ping", 2), headers=self.headers)
+        self.assertEqual(self.server.metrics.snapshot()["shutdown_drained_requests"], 1)
+
+    def test_progress_needs_an_open_event_stream(self):
+        session = self.transport.sessions[self.session_id]
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as file:
+            file.write("x" * 100)
+            file.flush()
+            params = {"name": "read_file", "arguments": {"file_path": file.name}, "_meta": {"progressToken": "p"}}
+            response = self.client.post("/mcp", json=request("tools/call", 2, params), headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(session.outbox._queue.empty())
+
+            session.outbox.listeners += 1
+            self.client.post("/mcp", json=request("tools/call", 3, params), headers=self.headers)
+            progress = json.loads(asyncio.run(session.outbox.get()))
+            self.assertEqual(progress["params"]["progressToken"], "p")
+
+    def test_list_changed_queued_for_event_stream(self):
+        self.server.registry.register(CountingTool())
+        session = self.transport.sessions[self.session_id]
+        data = asyncio.run(session.outbox.get())
+        self.assertEqual(json.loads(data)["method"], "notifications/tools/list_changed")
+
+    def initialize(self) -> str:
+        response = self.client.post("/mcp", json=request("initialize", 1, INITIALIZE_PARAMS))
+        return response.headers["mcp-session-id"]
+
+    def test_idle_sessions_expire(self):
+        self.transport.session_ttl = 60
+        session = self.transport.sessions[self.session_id]
+        with mock.patch("http_transport.time.monotonic", return_value=time.monotonic() + 61):
+            fresh = self.initialize()
+        self.assertEqual(list(self.transport.sessions), [fresh])
+        self.assertNotIn(session, self.server.sessions)
+        self.assertEqual(self.client.post("/mcp", json=request("ping", 2), headers=self.headers).status_code, 404)
+        self.assertEqual(self.server.metrics.snapshot()["http_sessions_expired"], 1)
+
+    def test_sessions_with_open_streams_stay(self):
+        self.transport.session_ttl = 60
+        self.transport._streams[self.session_id] = 1
+        with mock.patch("http_transport.time.monotonic", return_value=time.monotonic() + 61):
+            self.initialize()
+        self.assertIn(self.session_id, self.transport.sessions)
+
+    def test_session_count_is_bounded(self):
+        self.transport.max_sessions = 2
+        second = self.initialize()
+        self.client.post("/mcp", json=request("ping", 2), headers=self.headers)
+        third = self.initialize()
+        # The second session was used least recently
+        self.assertEqual(list(self.transport.sessions), [self.session_id, third])
+        self.assertNotIn(second, self.transport.sessions)
+        self.assertEqual(self.server.metrics.snapshot()["http_sessions_evicted"], 1)
+
+
+class TestLoadShedding(unittest.TestCase):
+    def test_requests_beyond_capacity_are_rejected(self):
+        server = start_server("--max-concurrency", "1", "--max-queued", "0")
+        self.addCleanup(close_server, server)
+        with tempfile.TemporaryDirectory() as tmp:
+            fifo = os.path.join(tmp, "slow")
+            os.mkfifo(fifo)
+            write_messages(
+                server,
+                request("tools/call", 1, {"name": "read_file", "arguments": {"file_path": fifo}}),
+                request("tools/call", 2, {"name": "greeting", "arguments": {"name": "Ada"}}),
+            )
+            response = read_message(server)
+            self.assertEqual(response["id"], 2)
+            self.assertEqual(response["error"]["code"], -32002)
+
+            write_messages(server, request("ping", 3))
+            self.assertEqual(read_message(server), {"jsonrpc": "2.0", "id": 3, "result": {}})
+
+            writer = os.open(fifo, os.O_RDWR)
+            os.write(writer, b"done")
+            os.close(writer)
+            self.assertEqual(read_message(server)["id"], 1)
+
+
+class TestGracefulShutdown(unittest.TestCase):
+    def start_slow_call(self, *args: str):
+        server = start_server(*args)
+        self.addCleanup(close_server, server)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        fifo = os.path.join(tmp.name, "slow")
+        os.mkfifo(fifo)
+        write_messages(server, request("ping", 0))
+        read_message(server)  # signal handlers are in place once it answers
+        write_messages(
+            server,
+            request("tools/call", 1, {"name": "read_file", "arguments": {"file_path": fifo}}),
+        )
+        time.sleep(0.2)  # let the read start and block on the fifo
+        return server, fifo
+
+    def test_sigterm_lets_running_calls_finish(self):
+        server, fifo = self.start_slow_call()
+        server.send_signal(signal.SIGTERM)
+        time.sleep(0.2)
+        write_messages(server, request("ping", 2))
+
+        with open(fifo, "w") as writer:
+            writer.write("done")
+        response = read_message(server)
+        self.assertEqual(response["id"], 1)
+        self.assertEqual(response["result"]["content"][0]["text"], "done")
+        self.assertEqual(server.wait(timeout=10), 0)
+        # Nothing is read once shutdown starts, so the ping goes unanswered
+        self.assertEqual(server.stdout.readline(), "")
+
+    def test_calls_past_the_grace_period_are_dropped(self):
+        server, _ = self.start_slow_call("--shutdown-grace", "0.5")
+        server.send_signal(signal.SIGTERM)
+        self.assertEqual(server.wait(timeout=10), 0)
+        self.assertEqual(server.stdout.readline(), "")
+        self.assertIn("1 dropped", server.stderr.read())
+
+    def test_http_shutdown_counts_dropped_calls(self):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        server = start_server("--transport", "http", "--port", str(port), "--shutdown-grace", "0.5")
+        self.addCleanup(close_server, server)
+        url = f"http://127.0.0.1:{port}/mcp"
+        for _ in range(100):
+            try:
+                response = httpx.post(url, json=request("initialize", 1, INITIALIZE_PARAMS))
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        else:
+            self.fail("server did not start")
+        headers = {"Mcp-Session-Id": response.headers["mcp-session-id"]}
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        fifo = os.path.join(tmp.name, "slow")
+        os.mkfifo(fifo)
+        call = request("tools/call", 2, {"name": "read_file", "arguments": {"file_path": fifo}})
+        def post_call():
+            with contextlib.suppress(httpx.TransportError):
+                httpx.post(url, json=call, headers=headers, timeout=10)
+
+        caller = threading.Thread(target=post_call)
+        caller.start()
+        time.sleep(0.5)  # let the read start and block on the fifo
+
+        server.send_signal(signal.SIGTERM)
+        # Unblock the abandoned read so its worker thread can exit
+        writer = os.open(fifo, os.O_RDWR)
+        self.addCleanup(os.close, writer)
+        self.assertEqual(server.wait(timeout=10), 0)
+        caller.join(timeout=10)
+        self.assertIn("1 dropped", server.stderr.read())
+
+    def test_eof_waits_for_running_calls(self):
+        server, fifo = self.start_slow_call()
+        server.stdin.close()
+        with open(fifo, "w") as writer:
+            writer.write("done")
+        self.assertEqual(read_message(server)["id"], 1)
+        self.assertEqual(server.wait(timeout=10), 0)
+
+
+class TestUnixSocketTransport(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "mcp.sock")
+        self.server = start_server("--transport", "unix", "--socket-path", self.path)
+        self.addCleanup(close_server, self.server)
+        for _ in range(100):
+            if os.path.exists(self.path):
+                break
+            time.sleep(0.05)
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        self.addCleanup(sock.close)
+        return sock, sock.makefile("rwb")
+
+    def exchange(self, stream, msg) -> Dict[str, Any]:
+        stream.write(json.dumps(msg).encode() + b"\n")
+        stream.flush()
+        return json.loads(stream.readline())
+
+    def test_clients_have_separate_sessions(self):
+        _, first = self.connect()
+        _, second = self.connect()
+        for stream, name in ((first, "first"), (second, "second")):
+            params = dict(INITIALIZE_PARAMS, clientInfo={"name": name, "version": "1"})
+            response = self.exchange(stream, request("initialize", 1, params))
+            self.assertIn("result", response)
+
+        response = self.exchange(second, request("tools/call", 2, {"name": "greeting", "arguments": {"name": "B"}}))
+        self.assertEqual(response["result"]["content"][0]["text"], "Hello from the MCP Server B!")
+        self.assertEqual(self.exchange(first, request("ping", 3)), {"jsonrpc": "2.0", "id": 3, "result": {}})
+
+    def test_second_server_refuses_a_live_socket(self):
+        second = start_server("--transport", "unix", "--socket-path", self.path)
+        self.addCleanup(close_server, second)
+        self.assertEqual(second.wait(timeout=30), 1)
+        self.assertIn("Address already in use", second.stderr.read())
+
+        _, stream = self.connect()
+        self.assertEqual(self.exchange(stream, request("ping", 1)), {"jsonrpc": "2.0", "id": 1, "result": {}})
+
+    def test_stale_socket_is_replaced(self):
+        close_server(self.server)
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+        self.server = start_server("--transport", "unix", "--socket-path", self.path)
+        self.addCleanup(close_server, self.server)
+        for _ in range(100):
+            try:
+                _, stream = self.connect()
+                break
+            except (ConnectionRefusedError, FileNotFoundError):
+                time.sleep(0.05)
+        self.assertEqual(self.exchange(stream, request("ping", 1)), {"jsonrpc": "2.0", "id": 1, "result": {}})
+
+    def test_disconnect_leaves_server_running(self):
+        sock, stream = self.connect()
+        self.exchange(stream, request("ping", 1))
+        sock.close()
+        _, stream = self.connect()
+        self.assertEqual(self.exchange(stream, request("ping", 2))["id"], 2)
+
+
+class TestPreforkWorkers(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        sockets = [os.path.join(tmp.name, f"worker-{index}.sock") for index in range(2)]
+
+        # Worker 1 serves its private socket from a thread
+        other = WorkerTransport(MCPServer(), 1, sockets)
+        uds_server = uvicorn.Server(uvicorn.Config(other.create_app(), uds=sockets[1], log_level="warning"))
+        thread = threading.Thread(target=uds_server.run)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(setattr, uds_server, "should_exit", True)
+        while not uds_server.started:
+            time.sleep(0.01)
+
+        self.worker_client = httpx.Client(transport=httpx.HTTPTransport(uds=sockets[1]), base_url="http://worker")
+        self.addCleanup(self.worker_client.close)
+        self.client = TestClient(WorkerTransport(MCPServer(), 0, sockets).create_app())
+        self.addCleanup(self.client.close)
+
+    def initialize(self, client) -> str:
+        response = client.post("/mcp", json=request("initialize", 1, INITIALIZE_PARAMS))
+        return response.headers["mcp-session-id"]
+
+    def test_session_ids_name_their_worker(self):
+        self.assertEqual(session_owner(self.initialize(self.client)), 0)
+        self.assertEqual(session_owner(self.initialize(self.worker_client)), 1)
+        self.assertIsNone(session_owner("abc"))
+
+    def test_requests_are_forwarded_to_the_owner(self):
+        session_id = self.initialize(self.worker_client)
+        response = self.client.post("/mcp", json=request("ping", 2), headers={"Mcp-Session-Id": session_id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["id"], 2)
+        self.assertEqual(response.headers["mcp-session-id"], session_id)
+
+        response = self.client.post("/mcp", json=request("ping", 3), headers={"Mcp-Session-Id": "1-unknown"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_metrics_cover_every_worker(self):
+        self.initialize(self.worker_client)
+        snapshot = self.client.get("/metrics").json()
+        self.assertEqual(set(snapshot["workers"]), {"0", "1"})
+        self.assertEqual(snapshot["requests_admitted"], snapshot["workers"]["1"]["requests_admitted"])
+
+    def test_merge_snapshots(self):
+        self.assertEqual(merge_snapshots([{"a": 1, "b": 2}, {"a": 3}]), {"a": 4, "b": 2})
+
+
+class TestPreforkSupervisor(unittest.TestCase):
+    def test_serves_restarts_and_stops(self):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        server = start_server("--transport", "http", "--port", str(port), "--workers", "2")
+        self.addCleanup(close_server, server)
+        url = f"http://127.0.0.1:{port}"
+
+        def initialize():
+            for _ in range(100):
+                try:
+                    return httpx.post(f"{url}/mcp", json=request("initialize", 1, INITIALIZE_PARAMS))
+                except httpx.TransportError:
+                    time.sleep(0.1)
+            self.fail("server did not start")
+
+        self.assertEqual(initialize().status_code, 200)
+        self.assertEqual(len(httpx.get(f"{url}/metrics").json()["workers"]), 2)
+
+        server.send_signal(signal.SIGHUP)
+        time.sleep(1)
+        self.assertEqual(initialize().status_code, 200)
+
+        server.send_signal(signal.SIGTERM)
+        self.assertEqual(server.wait(timeout=30), 0)
+
+
 if __name__ == "__main__":
     unittest.main()
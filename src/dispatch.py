@@ -0,0 +1,233 @@
+"""
+Admission control and scheduling for requests entering the server.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Hashable
+
+from metrics import Metrics
+
+# Lanes requests are scheduled in. Control-plane messages (handshake, ping,
+# tools/list, notifications) have their own slots so they never wait behind
+# tool calls.
+CONTROL_LANE = "control"
+TOOLS_LANE = "tools"
+
+
+def lane_for(message: Any) -> str:
+    """
+    Pick the scheduling lane for a decoded message or batch
+
+    Args:
+        message: Decoded JSON value sent by the client
+
+    Returns:
+        TOOLS_LANE if the message contains a tool call, else CONTROL_LANE
+    """
+    if isinstance(message, list):
+        members = message
+    else:
+        members = [message]
+    for member in members:
+        if isinstance(member, dict) and member.get("method") == "tools/call":
+            return TOOLS_LANE
+    return CONTROL_LANE
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is turned away because the server is at capacity.
+    """
+
+
+class Lane:
+    """
+    A pool of execution slots shared fairly between clients.
+
+    Waiting requests are grouped by client and the clients take turns, so
+    one client with a deep backlog cannot starve the others.
+
+    Only used from the event loop thread.
+    """
+
+    def __init__(self, name: str, capacity: int, max_queued: int):
+        if capacity < 1:
+            raise ValueError(f"{name} lane capacity must be at least 1")
+        if max_queued < 0:
+            raise ValueError(f"{name} lane max_queued must not be negative")
+
+        self.name = name
+        self.capacity = capacity
+        self.max_queued = max_queued
+        # Requests let in and not yet finished, running or not
+        self.admitted = 0
+        self.in_flight = 0
+        self._waiters: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+
+    @property
+    def queued(self) -> int:
+        return self.admitted - self.in_flight
+
+    @property
+    def full(self) -> bool:
+        return self.admitted >= self.capacity + self.max_queued
+
+    async def acquire(self, key: Hashable) -> None:
+        """
+        Wait for a slot.
+
+        Args:
+            key: Client the request belongs to, used for fair turns
+        """
+        if self.in_flight < self.capacity and not self._waiters:
+            self.in_flight += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled
+                self.release()
+            else:
+                queue = self._waiters.get(key)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._waiters[key]
+            raise
+
+    def release(self) -> None:
+        """
+        Give a slot back and hand it to the next client in turn.
+        """
+        self.in_flight -= 1
+        while self.in_flight < self.capacity and self._waiters:
+            key, queue = next(iter(self._waiters.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._waiters.move_to_end(key)
+            else:
+                del self._waiters[key]
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+
+class AdmissionTicket:
+    """
+    A request that has been let in and may run once its lane has a slot.
+
+    Use as an async context manager: entering waits for an execution slot,
+    leaving gives back the slot and the request's share of the byte budget.
+    """
+
+    def __init__(
+        self, admission: "AdmissionControl", lane: Lane, key: Hashable, size: int
+    ):
+        self._admission = admission
+        self._lane = lane
+        self._key = key
+        self._size = size
+        self._admitted_at = time.monotonic()
+
+    async def __aenter__(self) -> "AdmissionTicket":
+        try:
+            await self._lane.acquire(self._key)
+        except BaseException:
+            self._finish()
+            raise
+
+        metrics = self._admission.metrics
+        metrics.increment(f"lane_{self._lane.name}_started")
+        metrics.increment(
+            f"lane_{self._lane.name}_wait_seconds", time.monotonic() - self._admitted_at
+        )
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._lane.release()
+        self._finish()
+
+    def _finish(self) -> None:
+        self._lane.admitted -= 1
+        self._admission.buffered_bytes -= self._size
+
+
+class AdmissionControl:
+    """
+    Bounds how much work the server accepts and in what order it runs.
+
+    Tool calls run at most `max_in_flight` at once, with at most
+    `max_queued` more waiting; control-plane messages get their own
+    `control_slots` and queue. Together, waiting and running requests may
+    hold no more than `max_buffered_bytes` of raw payload. Anything beyond
+    that is rejected straight away, so overload shows up as fast errors
+    instead of unbounded memory growth.
+
+    Only used from the event loop thread.
+    """
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        max_in_flight: int = 16,
+        max_queued: int = 64,
+        max_buffered_bytes: int = 256 * 1024 * 1024,
+        control_slots: int = 4,
+    ):
+        self.metrics = metrics
+        self.max_buffered_bytes = max_buffered_bytes
+        self.buffered_bytes = 0
+        self.lanes = {
+            CONTROL_LANE: Lane(CONTROL_LANE, control_slots, max_queued),
+            TOOLS_LANE: Lane(TOOLS_LANE, max_in_flight, max_queued),
+        }
+
+        lanes = self.lanes.values()
+        metrics.gauge("requests_in_flight", lambda: sum(lane.in_flight for lane in lanes))
+        metrics.gauge("requests_queued", lambda: sum(lane.queued for lane in lanes))
+        metrics.gauge("request_bytes_buffered", lambda: self.buffered_bytes)
+        for lane in lanes:
+            metrics.gauge(f"lane_{lane.name}_in_flight", lambda lane=lane: lane.in_flight)
+            metrics.gauge(f"lane_{lane.name}_queued", lambda lane=lane: lane.queued)
+
+    def admit(
+        self, size: int, lane: str = TOOLS_LANE, key: Hashable = None
+    ) -> AdmissionTicket:
+        """
+        Let a request in, or turn it away if the server is full.
+
+        Args:
+            size: Raw payload size of the request in bytes
+            lane: CONTROL_LANE or TOOLS_LANE, see `lane_for`
+            key: Client the request belongs to, used for fair turns
+
+        Returns:
+            Ticket to enter once the request is ready to run
+
+        Raises:
+            Overloaded: If the lane's queue or the byte budget is exhausted
+        """
+        scheduled = self.lanes[lane]
+        if self.buffered_bytes + size > self.max_buffered_bytes:
+            self._reject(scheduled, "bytes")
+            raise Overloaded("Request byte budget exhausted")
+        if scheduled.full:
+            self._reject(scheduled, "queue_full")
+            raise Overloaded("Request queue is full")
+
+        self.metrics.increment("requests_admitted")
+        self.metrics.increment(f"lane_{lane}_admitted")
+        scheduled.admitted += 1
+        self.buffered_bytes += size
+        return AdmissionTicket(self, scheduled, key, size)
+
+    def _reject(self, lane: Lane, reason: str) -> None:
+        self.metrics.increment("requests_rejected")
+        self.metrics.increment(f"requests_rejected_{reason}")
+        self.metrics.increment(f"lane_{lane.name}_rejected")
@@ -0,0 +1,345 @@
+"""
+Worker pools that run tool calls off the event loop.
+"""
+
+import asyncio
+import contextvars
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Type, Union
+
+from metrics import Metrics
+from plugins import build_tool
+from tools import MCPTool
+
+# str and bytes values at least this large cross the process boundary
+# through shared memory instead of being pickled
+SHARED_MEMORY_THRESHOLD = 1024 * 1024
+
+
+class BlockingPool:
+    """
+    Bounded thread pool for tools that make blocking system calls.
+
+    Keeps blocking I/O off the event loop, so framing and control messages
+    keep flowing while tools wait on the filesystem, and lets several such
+    tools overlap. The caller's context variables (the current tool
+    context in particular) are carried over to the worker thread.
+    """
+
+    def __init__(self, metrics: Metrics, max_workers: int = 8):
+        """
+        Args:
+            metrics: Where queue depth and wait times are reported
+            max_workers: Number of worker threads
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+
+        self.metrics = metrics
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="mcp-tool")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+
+        metrics.gauge("tool_pool_size", lambda: self.max_workers)
+        metrics.gauge("tool_pool_queued", lambda: self._queued)
+        metrics.gauge("tool_pool_active", lambda: self._active)
+
+    @property
+    def busy(self) -> int:
+        """Number of calls queued or running"""
+        with self._lock:
+            return self._queued + self._active
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        Run `fn(*args)` on a worker thread and wait for its result.
+
+        Args:
+            fn: Blocking callable
+            *args: Arguments for `fn`
+
+        Returns:
+            Whatever `fn` returns
+        """
+        context = contextvars.copy_context()
+        submitted = time.monotonic()
+        with self._lock:
+            self._queued += 1
+
+        def job() -> Any:
+            waited = time.monotonic() - submitted
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+            self.metrics.increment("tool_pool_tasks")
+            self.metrics.increment("tool_pool_wait_seconds", waited)
+            try:
+                return context.run(fn, *args)
+            finally:
+                with self._lock:
+                    self._active -= 1
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, job)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop the worker threads once queued work is done.
+
+        Args:
+            wait: Block until the workers have exited
+        """
+        self._executor.shutdown(wait=wait)
+
+
+class SharedPayload:
+    """
+    Stand-in for a large str or bytes value parked in shared memory.
+    """
+
+    __slots__ = ("name", "size", "text")
+
+    def __init__(self, name: str, size: int, text: bool):
+        self.name = name
+        self.size = size
+        self.text = text
+
+    def __getstate__(self):
+        return (self.name, self.size, self.text)
+
+    def __setstate__(self, state):
+        self.name, self.size, self.text = state
+
+
+def share_payloads(value: Any, segments: List[SharedMemory]) -> Any:
+    """
+    Move large str and bytes values inside `value` into shared memory
+
+    Args:
+        value: Arguments or response of a tool call
+        segments: Collects the shared memory blocks that were created
+
+    Returns:
+        `value` with large payloads replaced by SharedPayload handles
+    """
+    if isinstance(value, dict):
+        return {key: share_payloads(item, segments) for key, item in value.items()}
+    if isinstance(value, list):
+        return [share_payloads(item, segments) for item in value]
+    if isinstance(value, (str, bytes)) and len(value) >= SHARED_MEMORY_THRESHOLD:
+        data = value.encode() if isinstance(value, str) else value
+        segment = SharedMemory(create=True, size=max(len(data), 1))
+        segment.buf[:len(data)] = data
+        segments.append(segment)
+        return SharedPayload(segment.name, len(data), isinstance(value, str))
+    return value
+
+
+def load_payloads(value: Any, unlink: bool) -> Any:
+    """
+    Replace SharedPayload handles inside `value` with the values they hold
+
+    Args:
+        value: Value produced by `share_payloads`
+        unlink: Free the shared memory once it has been read
+
+    Returns:
+        `value` with every payload copied back out of shared memory
+    """
+    if isinstance(value, dict):
+        return {key: load_payloads(item, unlink) for key, item in value.items()}
+    if isinstance(value, list):
+        return [load_payloads(item, unlink) for item in value]
+    if isinstance(value, SharedPayload):
+        segment = SharedMemory(name=value.name)
+        try:
+            data = bytes(segment.buf[:value.size])
+        finally:
+            segment.close()
+            if unlink:
+                segment.unlink()
+        return data.decode() if value.text else data
+    return value
+
+
+def free_payloads(value: Any) -> None:
+    """
+    Free the shared memory behind the SharedPayload handles inside `value`
+    without reading it, for results nobody is waiting for any more
+    """
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        for item in value:
+            free_payloads(item)
+    elif isinstance(value, SharedPayload):
+        try:
+            segment = SharedMemory(name=value.name)
+        except FileNotFoundError:
+            return
+        segment.close()
+        segment.unlink()
+
+
+def _discard_result(future: Future) -> None:
+    if not future.cancelled() and future.exception() is None:
+        free_payloads(future.result())
+
+
+# Tool instances built inside a worker process, by `MCPTool.worker_target`
+_worker_tools: Dict[Union[Type[MCPTool], str], MCPTool] = {}
+
+
+def _warm_worker() -> None:
+    pass
+
+
+def _call_in_worker(target: Union[Type[MCPTool], str], arguments: Any, formatted: bool) -> Any:
+    tool = _worker_tools.get(target)
+    if tool is None:
+        tool = _worker_tools[target] = build_tool(target) if isinstance(target, str) else target()
+
+    response = tool.call(load_payloads(arguments, unlink=False))
+    if formatted:
+        text = tool.format_text(response)
+        if text is not None:
+            response = {"content": [{"type": "text", "text": text}], "isError": False}
+        else:
+            response = tool.format_result(response).model_dump(mode="json", exclude_none=True)
+
+    segments: List[SharedMemory] = []
+    shared = share_payloads(response, segments)
+    for segment in segments:
+        # The parent unlinks the block after copying the data out
+        segment.close()
+    return shared
+
+
+class ProcessPool:
+    """
+    Pool of worker processes for CPU-bound tools.
+
+    Runs `call()` outside the server process so CPU-heavy tools scale across
+    cores instead of contending for the GIL. Workers are started ahead of
+    the first call, and again whenever the pool is replaced. Large str and
+    bytes values travel through shared memory. A crashed worker breaks the
+    whole pool, failing every call in it at the time, and the pool is
+    replaced once. Workers are recycled after `max_tasks_per_worker` calls
+    each to bound leaks in tool code.
+
+    Tools are rebuilt inside each worker, so CPU-bound tools must be
+    constructible without arguments. Cancellation and timeouts stop waiting
+    for the result but cannot interrupt the worker.
+    """
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        max_workers: Optional[int] = None,
+        max_tasks_per_worker: int = 1000,
+    ):
+        """
+        Args:
+            metrics: Where task, restart and recycle counts are reported
+            max_workers: Number of worker processes; defaults to the CPU count
+            max_tasks_per_worker: Calls per worker before the pool is replaced
+        """
+        if max_tasks_per_worker < 1:
+            raise ValueError("max_tasks_per_worker must be at least 1")
+
+        self.metrics = metrics
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self._context = multiprocessing.get_context("spawn")
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._warming: List[Future] = []
+        self._submitted = 0
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        """
+        Start a new pool, its workers spawning in the background
+        """
+        self._submitted = 0
+        executor = ProcessPoolExecutor(self.max_workers, mp_context=self._context)
+        self._warming = [executor.submit(_warm_worker) for _ in range(self.max_workers)]
+        return executor
+
+    def warm(self) -> None:
+        """
+        Start every worker process now rather than on the first call.
+        """
+        if self._executor is None:
+            self._executor = self._new_executor()
+        for future in self._warming:
+            future.result()
+
+    async def run(self, tool: MCPTool, arguments: Any, formatted: bool = False) -> Any:
+        """
+        Call `tool` with `arguments` in a worker process.
+
+        Args:
+            tool: CPU-bound tool to call
+            arguments: Arguments for the tool
+            formatted: Have the worker format the response as well, so the
+                tool's implementation never needs to be loaded here
+
+        Returns:
+            The tool's response, or when `formatted` the CallToolResult it
+            formats to, serialized
+
+        Raises:
+            ValueError: If the tool rejected its input or the worker crashed
+        """
+        if self._executor is None:
+            self._executor = self._new_executor()
+        elif self._submitted >= self.max_tasks_per_worker * self.max_workers:
+            self._executor.shutdown(wait=False)
+            self._executor = self._new_executor()
+            self.metrics.increment("process_pool_recycles")
+
+        executor = self._executor
+        segments: List[SharedMemory] = []
+        shared = share_payloads(arguments, segments)
+        self._submitted += 1
+        self.metrics.increment("process_pool_tasks")
+        try:
+            future = executor.submit(_call_in_worker, tool.worker_target(), shared, formatted)
+            try:
+                response = await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                # Nobody will read the result; free its shared memory once
+                # the worker is done with it
+                future.add_done_callback(_discard_result)
+                raise
+        except BrokenProcessPool:
+            # Every call in the pool fails together; only the first to
+            # notice replaces it
+            if self._executor is executor:
+                self.metrics.increment("process_pool_restarts")
+                executor.shutdown(wait=False)
+                self._executor = self._new_executor()
+            raise ValueError(f"Worker process for tool '{tool.name}' crashed")
+        finally:
+            for segment in segments:
+                segment.close()
+                segment.unlink()
+
+        return load_payloads(response, unlink=True)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop the worker processes.
+
+        Args:
+            wait: Block until the workers have exited
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -0,0 +1,156 @@
+"""
+In-process cache of file contents for repeated reads.
+
+Clients tend to read the same few files over and over. Small files are kept
+in memory, with their decoded text, and served again as long as one
+`os.stat` shows the file unchanged. Writes through the server drop the
+cached copy straight away.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from line_index import FileKey, file_key
+from metrics import Metrics
+
+
+class CachedFile:
+    """
+    Contents of one version of a file.
+    """
+
+    __slots__ = ("key", "stat", "data", "text", "size")
+
+    def __init__(self, stat: os.stat_result, data: bytes, text: Optional[str]):
+        """
+        Args:
+            stat: Result of `os.fstat` taken before the file was read
+            data: Whole contents of the file
+            text: Contents decoded as UTF-8, or None for binary files
+        """
+        self.key: FileKey = file_key(stat)
+        self.stat = stat
+        self.data = data
+        self.text = text
+        # Memory charged against the cache budget
+        self.size = len(data) + (len(text) if text is not None else 0)
+
+
+class FileCache:
+    """
+    Byte-budgeted cache of file contents, least recently used dropped first.
+
+    Entries are keyed by absolute path and checked against the file's
+    current (device, inode, size, mtime_ns) on every lookup. Shared by the
+    threads running tools.
+    """
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_file_bytes: Optional[int] = None,
+    ):
+        """
+        Args:
+            metrics: Where hits, misses, evictions and invalidations are counted
+            max_bytes: Total memory the cached contents may use
+            max_file_bytes: Largest file worth caching; defaults to an
+                eighth of `max_bytes`
+        """
+        self.metrics = metrics
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_bytes // 8 if max_file_bytes is None else max_file_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, CachedFile]" = OrderedDict()
+        self._lock = threading.Lock()
+        metrics.gauge("file_cache_bytes", lambda: self.size)
+        metrics.gauge("file_cache_entries", lambda: len(self._entries))
+
+    def accepts(self, size: int) -> bool:
+        """
+        Returns:
+            Whether a file of `size` bytes would be cached
+        """
+        return size <= self.max_file_bytes
+
+    def lookup(self, path: str) -> Optional[CachedFile]:
+        """
+        Find the cached contents of a file, if still current
+
+        Args:
+            path: Path of the file
+
+        Returns:
+            The cached contents, or None if there are none or the file
+            changed since they were read
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None:
+            try:
+                current = file_key(os.stat(path))
+            except OSError:
+                current = None
+            if current == entry.key:
+                with self._lock:
+                    if path in self._entries:
+                        self._entries.move_to_end(path)
+                self.metrics.increment("file_cache_hits")
+                return entry
+            self._discard(path, entry)
+        self.metrics.increment("file_cache_misses")
+        return None
+
+    def store(self, path: str, entry: CachedFile) -> None:
+        """
+        Cache the contents of a file, evicting older files to make room
+
+        Args:
+            path: Path of the file
+            entry: Its contents
+        """
+        if entry.size > self.max_bytes:
+            return
+
+        path = os.path.abspath(path)
+        evicted = 0
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            if previous is not None:
+                self.size -= previous.size
+            self._entries[path] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, oldest = self._entries.popitem(last=False)
+                self.size -= oldest.size
+                evicted += 1
+        if evicted:
+            self.metrics.increment("file_cache_evictions", evicted)
+
+    def invalidate(self, path: str) -> None:
+        """
+        Drop a file's cached contents, after the server wrote to it
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self.size -= entry.size
+        if entry is not None:
+            self.metrics.increment("file_cache_invalidations")
+
+    def _discard(self, path: str, entry: CachedFile) -> None:
+        """
+        Drop a stale entry, unless another thread already replaced it
+        """
+        with self._lock:
+            if self._entries.get(path) is entry:
+                del self._entries[path]
+                self.size -= entry.size
+
+    def __len__(self) -> int:
+        return len(self._entries)
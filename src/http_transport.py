@@ -0,0 +1,425 @@
+"""
+Streamable HTTP transport for the MCP server.
+
+Follows the MCP streamable HTTP transport: clients POST JSON-RPC messages to
+a single endpoint and may open a GET event stream for messages the server
+sends on its own. Sessions are identified by the Mcp-Session-Id header that
+is handed out with the initialize response.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import signal
+import socket
+import time
+import uuid
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+import uvicorn
+from sse_starlette import EventSourceResponse
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from dispatch import Overloaded, lane_for
+from jsonrpc import encode_message, parse_error
+from session import Session
+
+if TYPE_CHECKING:
+    from mcp_server import MCPServer
+
+SESSION_HEADER = "Mcp-Session-Id"
+
+# Browser origins allowed by default: pages served from this machine. An
+# origin without a port allows every port.
+DEFAULT_ALLOWED_ORIGINS = (
+    "http://localhost",
+    "http://127.0.0.1",
+    "http://[::1]",
+    "https://localhost",
+    "https://127.0.0.1",
+    "https://[::1]",
+)
+
+
+class EventStream:
+    """
+    Outbox holding server-initiated messages for a session's GET stream.
+
+    Messages sent while no stream is open are kept until one connects, up to
+    `max_pending`; after that the oldest are dropped. Transient messages
+    such as progress are only sent while a stream is open, so clients that
+    never open one don't fill the buffer with them.
+    """
+
+    def __init__(self, max_pending: int = 256):
+        self._queue: asyncio.Queue = asyncio.Queue(max_pending)
+        # GET streams reading the outbox
+        self.listeners = 0
+
+    @property
+    def listening(self) -> bool:
+        return self.listeners > 0
+
+    async def write(self, data: bytes) -> None:
+        await self._queue.put(data)
+
+    def write_nowait(self, data: bytes) -> None:
+        if self._queue.full():
+            logging.warning("Event stream buffer full, dropping oldest message")
+            self._queue.get_nowait()
+        self._queue.put_nowait(data)
+
+    async def get(self) -> bytes:
+        return await self._queue.get()
+
+
+class HTTPTransport:
+    """
+    Serves one MCPServer to many HTTP clients, each with its own session.
+
+    Clients that vanish without a DELETE leave their session behind, so
+    sessions with no requests and no open event stream for `session_ttl`
+    seconds are closed, and past `max_sessions` the least recently used
+    session is closed to make room for a new one.
+
+    Requests from browser pages whose Origin is not allowed are refused
+    with 403, so a page that a DNS-rebinding attack points at this host
+    can't call tools on it.
+    """
+
+    def __init__(
+        self,
+        server: "MCPServer",
+        path: str = "/mcp",
+        keepalive: int = 15,
+        session_ttl: float = 600,
+        max_sessions: int = 1024,
+        allowed_origins: Iterable[str] = DEFAULT_ALLOWED_ORIGINS,
+    ):
+        """
+        Args:
+            server: Server shared by every session
+            path: Endpoint clients POST to and GET events from
+            keepalive: Seconds between keep-alive pings on event streams
+            session_ttl: Seconds an idle session is kept
+            max_sessions: Most sessions kept at once
+            allowed_origins: Origins browser pages may call from, like
+                "https://app.example.com"; one without a port allows any port
+        """
+        if max_sessions < 1:
+            raise ValueError("max_sessions must be at least 1")
+
+        self.server = server
+        self.path = path
+        self.keepalive = keepalive
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self.allowed_origins = frozenset(origin.rstrip("/") for origin in allowed_origins)
+        # Least recently active first
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._last_active: Dict[str, float] = {}
+        # Event streams open per session; such sessions are never idle
+        self._streams: Dict[str, int] = {}
+        server.metrics.gauge("http_sessions", lambda: len(self.sessions))
+
+    def create_app(self) -> Starlette:
+        """
+        Returns:
+            ASGI application serving the MCP endpoint
+        """
+        return Starlette(
+            routes=[
+                Route(
+                    self.path,
+                    self.handle,
+                    methods=["GET", "POST", "DELETE"],
+                ),
+                Route("/metrics", self.handle_metrics, methods=["GET"]),
+            ]
+        )
+
+    async def handle(self, request: Request) -> Response:
+        if not self.origin_allowed(request.headers.get("origin")):
+            return self.forbidden_origin(request)
+        self.expire_sessions()
+        if request.method == "POST":
+            return await self.handle_post(request)
+        if request.method == "GET":
+            return await self.handle_get(request)
+        return await self.handle_delete(request)
+
+    def origin_allowed(self, origin: Optional[str]) -> bool:
+        """
+        Args:
+            origin: Origin header of a request, if any
+
+        Returns:
+            Whether the request may be served; clients other than browsers
+            send no Origin and are always served
+        """
+        if origin is None or origin in self.allowed_origins:
+            return True
+        try:
+            port = urlsplit(origin).port
+        except ValueError:
+            return False
+        return port is not None and origin.rsplit(":", 1)[0] in self.allowed_origins
+
+    def forbidden_origin(self, request: Request) -> Response:
+        origin = request.headers.get("origin")
+        logging.warning(f"Refusing request from origin {origin}")
+        self.server.metrics.increment("http_origin_rejected")
+        return Response(f"Origin {origin} is not allowed", status_code=403)
+
+    async def handle_metrics(self, request: Request) -> Response:
+        """
+        Report the server's metrics as JSON
+        """
+        return JSONResponse(self.server.metrics.snapshot())
+
+    def new_session_id(self) -> str:
+        """
+        Returns:
+            Id for a new session, unguessable by other clients
+        """
+        return uuid.uuid4().hex
+
+    def lookup_session(self, request: Request) -> Optional[Session]:
+        session_id = request.headers.get(SESSION_HEADER)
+        if session_id is None:
+            return None
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.touch(session_id)
+        return session
+
+    def touch(self, session_id: str) -> None:
+        """
+        Record activity on a session
+        """
+        self._last_active[session_id] = time.monotonic()
+        self.sessions.move_to_end(session_id)
+
+    def add_session(self, session: Session) -> None:
+        """
+        Start serving a session, closing the least recently used one if
+        there are already `max_sessions`
+        """
+        while len(self.sessions) >= self.max_sessions:
+            session_id = next(iter(self.sessions))
+            logging.warning(f"Too many sessions, closing least recently used session {session_id}")
+            self.server.metrics.increment("http_sessions_evicted")
+            self.end_session(session_id)
+
+        self.sessions[session.session_id] = session
+        self.touch(session.session_id)
+        self.server.open_session(session)
+
+    def end_session(self, session_id: str) -> None:
+        """
+        Stop serving a session
+        """
+        session = self.sessions.pop(session_id)
+        self._last_active.pop(session_id, None)
+        self._streams.pop(session_id, None)
+        self.server.close_session(session)
+
+    def expire_sessions(self) -> None:
+        """
+        Close sessions idle for longer than `session_ttl`
+        """
+        cutoff = time.monotonic() - self.session_ttl
+        for session_id in list(self.sessions):
+            if self._last_active[session_id] > cutoff:
+                # Sessions are kept in order of activity
+                break
+            if self._streams.get(session_id):
+                self.touch(session_id)
+                continue
+            logging.info(f"Closing idle session {session_id}")
+            self.server.metrics.increment("http_sessions_expired")
+            self.end_session(session_id)
+
+    async def handle_post(self, request: Request) -> Response:
+        """
+        Handle a JSON-RPC message or batch sent by the client
+        """
+        body = await request.body()
+        try:
+            message = json.loads(body)
+        except json.JSONDecodeError as e:
+            return JSONResponse(parse_error(e), status_code=400)
+
+        is_initialize = isinstance(message, dict) and message.get("method") == "initialize"
+        if is_initialize:
+            session = Session(EventStream(), session_id=self.new_session_id())
+        elif SESSION_HEADER not in request.headers:
+            return Response(f"Missing {SESSION_HEADER} header", status_code=400)
+        else:
+            session = self.lookup_session(request)
+            if session is None:
+                return Response("Unknown session", status_code=404)
+
+        try:
+            if isinstance(message, list) and message:
+                # Members are admitted one by one
+                response = await self.server.handle_batch(message, session, len(body))
+            else:
+                try:
+                    ticket = self.server.admission.admit(len(body), lane_for(message), session)
+                except Overloaded as e:
+                    rejection = self.server.reject(message, e)
+                    if rejection is None:
+                        return Response(status_code=503)
+                    return Response(encode_message(rejection), status_code=503, media_type="application/json")
+
+                response = await self.server.handle_admitted(message, ticket, session)
+        except asyncio.CancelledError:
+            # uvicorn cancels requests still running when the grace period ends
+            if self.server.draining:
+                self.server.metrics.increment("shutdown_dropped_requests")
+            raise
+        if self.server.draining:
+            self.server.metrics.increment("shutdown_drained_requests")
+
+        if is_initialize:
+            if not session.initialized:
+                return Response(encode_message(response), status_code=400, media_type="application/json")
+            self.add_session(session)
+
+        headers = {SESSION_HEADER: session.session_id}
+        if response is None:
+            return Response(status_code=202, headers=headers)
+        return Response(encode_message(response), media_type="application/json", headers=headers)
+
+    async def handle_get(self, request: Request) -> Response:
+        """
+        Open the event stream for server-initiated messages
+        """
+        if "text/event-stream" not in request.headers.get("accept", ""):
+            return Response("GET requires Accept: text/event-stream", status_code=405)
+
+        session = self.lookup_session(request)
+        if session is None:
+            return Response("Unknown session", status_code=404)
+
+        session_id = session.session_id
+        self._streams[session_id] = self._streams.get(session_id, 0) + 1
+
+        async def events():
+            session.outbox.listeners += 1
+            try:
+                while True:
+                    data = await session.outbox.get()
+                    yield {"event": "message", "data": data.decode()}
+            finally:
+                session.outbox.listeners -= 1
+                if session_id in self._streams:
+                    self._streams[session_id] -= 1
+                    self.touch(session_id)
+
+        return EventSourceResponse(
+            events(),
+            ping=self.keepalive,
+            headers={SESSION_HEADER: session.session_id},
+        )
+
+    async def handle_delete(self, request: Request) -> Response:
+        """
+        End a session at the client's request
+        """
+        session = self.lookup_session(request)
+        if session is None:
+            return Response("Unknown session", status_code=404)
+
+        self.end_session(session.session_id)
+        return Response(status_code=204)
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    uvicorn server that puts the MCP server into shutdown along with it,
+    so requests finished or dropped during the grace period are counted
+    in the exit summary
+    """
+
+    def __init__(self, config: uvicorn.Config, server: "MCPServer"):
+        super().__init__(config)
+        self.mcp_server = server
+
+    @contextlib.contextmanager
+    def capture_signals(self) -> Iterator[None]:
+        # uvicorn re-raises the signal once it has shut down, which would
+        # kill the process before the exit summary is logged
+        loop = asyncio.get_running_loop()
+        handled = []
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, self.handle_exit, signum, None)
+                handled.append(signum)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Not the main thread, or no signal support on this platform
+                pass
+        try:
+            yield
+        finally:
+            for signum in handled:
+                loop.remove_signal_handler(signum)
+
+    async def shutdown(self, sockets: Optional[List[socket.socket]] = None) -> None:
+        self.mcp_server.request_shutdown()
+        await super().shutdown(sockets=sockets)
+
+
+def run_http(
+    server: "MCPServer",
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    path: str = "/mcp",
+    keepalive: int = 15,
+    session_ttl: float = 600,
+    max_sessions: int = 1024,
+    allowed_origins: Iterable[str] = DEFAULT_ALLOWED_ORIGINS,
+) -> None:
+    """
+    Serve the MCP server over streamable HTTP until interrupted
+
+    On SIGTERM or SIGINT the server stops accepting connections and gives
+    in-flight requests the server's `shutdown_grace` seconds to finish.
+
+    Args:
+        server: Server to expose
+        host: Interface to listen on
+        port: Port to listen on
+        path: MCP endpoint path
+        keepalive: Seconds idle connections and event streams are kept alive
+        session_ttl: Seconds an idle session is kept
+        max_sessions: Most sessions kept at once
+        allowed_origins: Origins browser pages may call from
+    """
+    transport = HTTPTransport(
+        server,
+        path=path,
+        keepalive=keepalive,
+        session_ttl=session_ttl,
+        max_sessions=max_sessions,
+        allowed_origins=allowed_origins,
+    )
+    config = uvicorn.Config(
+        transport.create_app(),
+        host=host,
+        port=port,
+        timeout_keep_alive=keepalive,
+        timeout_graceful_shutdown=server.shutdown_grace,
+        log_level="warning",
+    )
+    try:
+        DrainingServer(config, server).run()
+    finally:
+        server.close()
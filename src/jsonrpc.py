@@ -0,0 +1,77 @@
+"""
+JSON-RPC message helpers shared by the server and its transports.
+"""
+
+import json
+from typing import Any, Dict, List, Union
+
+# A single JSON-RPC message, or the array of replies to a batch
+Message = Union[Dict[str, Any], List[Dict[str, Any]]]
+
+# Server error codes, from the range JSON-RPC reserves for implementations
+REQUEST_TIMEOUT = -32001
+SERVER_OVERLOADED = -32002
+
+
+class EncodedResult:
+    """
+    A JSON-RPC result that has already been serialized to JSON bytes.
+
+    Responses carrying one are spliced together by `encode_message` instead
+    of being run through json.dumps again.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+def encode_message(message: Message) -> bytes:
+    """
+    Serialize a JSON-RPC message to bytes
+
+    Args:
+        message: JSON-RPC message or batch of messages
+
+    Returns:
+        JSON encoding of the message, without a trailing newline
+    """
+    if isinstance(message, list):
+        return b"[" + b",".join(encode_message(item) for item in message) + b"]"
+
+    result = message.get("result")
+    if isinstance(result, EncodedResult):
+        request_id = json.dumps(message["id"]).encode()
+        return b'{"jsonrpc":"2.0","id":' + request_id + b',"result":' + result.data + b"}"
+    return json.dumps(message, separators=(",", ":")).encode()
+
+
+def parse_error(error: json.JSONDecodeError) -> Dict[str, Any]:
+    """
+    Returns:
+        Error response for a message that is not valid JSON
+    """
+    return {
+        "jsonrpc": "2.0",
+        "id": None,
+        "error": {
+            "code": -32700,  # Parse error
+            "message": f"Error parsing message: {error}",
+        },
+    }
+
+
+def invalid_request() -> Dict[str, Any]:
+    """
+    Returns:
+        Error response for a message that is not a JSON-RPC request object
+    """
+    return {
+        "jsonrpc": "2.0",
+        "id": None,
+        "error": {
+            "code": -32600,  # Invalid request
+            "message": "Invalid request",
+        },
+    }
@@ -0,0 +1,203 @@
+"""
+Line-start indexes that let line-range reads seek straight to a line.
+
+Finding line N otherwise means scanning the file from the start for N-1
+newlines, on every read. Line-addressed reads of a file record where each
+line they scanned past starts, and later reads of the same, unchanged file
+look the offset up instead. An index only ever covers the file up to the
+furthest line asked for so far, so reading the head of a huge log stays
+cheap.
+"""
+
+import operator
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from itertools import accumulate, islice, repeat
+from typing import TYPE_CHECKING, BinaryIO, Tuple
+
+if TYPE_CHECKING:
+    from tools import ToolContext
+
+# Bytes scanned for newlines between cancellation checks
+INDEX_CHUNK_SIZE = 1024 * 1024
+
+# Identifies one version of a file: (device, inode, size, mtime_ns)
+FileKey = Tuple[int, int, int, int]
+
+
+def file_key(stat: os.stat_result) -> FileKey:
+    """
+    Key that changes whenever the file is replaced or modified
+    """
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class LineIndex:
+    """
+    Byte offset at which each line of a file starts, as far as the file
+    has been scanned.
+
+    Offsets are kept in an `array('Q')`, eight bytes per line. Safe to
+    share between threads; scans of one index take turns.
+    """
+
+    def __init__(self, size: int):
+        """
+        Args:
+            size: Size of the file the index covers
+        """
+        self.starts = array("Q", [0])
+        self.size = size
+        # Bytes scanned for newlines so far
+        self.scanned = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, file: BinaryIO, size: int, context: "ToolContext") -> "LineIndex":
+        """
+        Index a whole file
+
+        Args:
+            file: File open in binary mode; its position is moved
+            size: Size of the file
+            context: Checked for cancellation between chunks, and told the
+                scan's progress
+
+        Returns:
+            Index of the file
+        """
+        index = cls(size)
+        index.scan(file, size + 1, context)
+        return index
+
+    @property
+    def complete(self) -> bool:
+        return self.scanned >= self.size
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory held by the offsets
+        """
+        return len(self.starts) * self.starts.itemsize
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def scan(self, file: BinaryIO, line: int, context: "ToolContext") -> None:
+        """
+        Scan on until the start of `line` is known or the file ends
+
+        Args:
+            file: The indexed file, open in binary mode; its position is moved
+            line: Line number, counting from 1
+            context: Checked for cancellation between chunks, and told the
+                scan's progress
+        """
+        with self._lock:
+            starts = self.starts
+            file.seek(self.scanned)
+            while len(starts) < line and not self.complete:
+                chunk = file.read(min(INDEX_CHUNK_SIZE, self.size - self.scanned))
+                if not chunk:
+                    # Shorter than when it was indexed; treat as the end
+                    self.size = self.scanned
+                    break
+                # Line lengths plus their newline, summed from the chunk's
+                # offset, give the starts of the lines after each newline.
+                # The last piece has no newline after it, so its end is
+                # dropped.
+                pieces = chunk.split(b"\n")
+                ends = accumulate(map(operator.add, map(len, pieces), repeat(1)), initial=self.scanned)
+                starts.extend(islice(ends, 1, len(pieces)))
+                self.scanned += len(chunk)
+                context.check()
+                context.report_progress(self.scanned, self.size)
+
+    def line_start(self, line: int) -> int:
+        """
+        Args:
+            line: Line number, counting from 1; the index must have been
+                scanned that far
+
+        Returns:
+            Offset of the line, or the file size if the file has fewer lines
+        """
+        if line > len(self.starts):
+            return self.size
+        return self.starts[line - 1]
+
+
+class LineIndexCache:
+    """
+    Line indexes of recently read files, least recently used dropped first.
+
+    Entries are keyed by `file_key`, so an index is never used for a file
+    that changed after it was built. Indexes grow as later reads go further
+    into their files, so the cache is held to `max_bytes` of offsets after
+    every lookup. Shared by the threads running tools.
+    """
+
+    def __init__(self, max_entries: int = 32, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            max_entries: Most files to keep indexes for
+            max_bytes: Most memory the kept offsets may use, at eight bytes
+                per line
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._indexes: "OrderedDict[FileKey, LineIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def line_start(self, file: BinaryIO, stat: os.stat_result, line: int, context: "ToolContext") -> int:
+        """
+        Find where a line of an open file starts, scanning only as far as
+        no earlier read has
+
+        Args:
+            file: File open in binary mode; scanning moves its position
+            stat: Result of `os.fstat` on the file
+            line: Line number, counting from 1
+            context: Passed on to `LineIndex.scan`
+
+        Returns:
+            Offset of the line, or the file size if the file has fewer lines
+        """
+        key = file_key(stat)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = self._indexes[key] = LineIndex(stat.st_size)
+            self._indexes.move_to_end(key)
+
+        # Scanned outside the lock so a long scan doesn't hold up other files
+        try:
+            if len(index) < line and not index.complete:
+                index.scan(file, line, context)
+        finally:
+            self.trim()
+        return index.line_start(line)
+
+    def trim(self) -> None:
+        """
+        Drop the least recently used indexes until the cache fits its limits
+        """
+        with self._lock:
+            total = sum(index.nbytes for index in self._indexes.values())
+            while self._indexes and (len(self._indexes) > self.max_entries or total > self.max_bytes):
+                _, oldest = self._indexes.popitem(last=False)
+                total -= oldest.nbytes
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory held by the cached offsets
+        """
+        with self._lock:
+            return sum(index.nbytes for index in self._indexes.values())
+
+    def __len__(self) -> int:
+        return len(self._indexes)
@@ -4,16 +4,26 @@ Barebones MCP Server Implementation
 Using official MCP types for client-server initialization
 """
 
+import argparse
+import asyncio
+import base64
+import binascii
+import contextlib
+import errno
 import json
+import os
+import signal
+import socket
+import stat
 import sys
-from typing import Dict, Any, Optional
+import threading
+from typing import Dict, Any, List, Optional, Set, Union
+from pydantic import ValidationError
 from mcp.types import (
     InitializeRequest,
     InitializeResult,
     Implementation,
     ServerCapabilities,
-    JSONRPCError,
-    ErrorData,
     PromptsCapability,
     ResourcesCapability,
     ToolsCapability,
@@ -22,10 +32,147 @@ from mcp.types import (
     CallToolRequest,
     CallToolResult,
     TextContent,
+    CancelledNotification,
 )
-from tools import Greeting, ReadFileTool, WriteFileTool, CreateDirectoryTool, ListDirectoryTool
+from dispatch import AdmissionControl, AdmissionTicket, Overloaded, lane_for
+from executors import BlockingPool, ProcessPool
+from jsonrpc import (
+    REQUEST_TIMEOUT,
+    SERVER_OVERLOADED,
+    EncodedResult,
+    Message,
+    invalid_request,
+    parse_error,
+)
+from file_cache import FileCache
+from metrics import Metrics
+from plugins import ENTRY_POINT_GROUP, discover_tools
+from registry import CallResult, ToolRegistry
+from session import Session
+from tools import (
+    READ_RESPONSE_LIMIT,
+    Greeting,
+    ReadFileTool,
+    ReadFilesTool,
+    WriteFileTool,
+    CreateDirectoryTool,
+    ListDirectoryTool,
+    ToolCancelled,
+    ToolContext,
+    ToolTimeout,
+)
+from writer import MessageWriter
 import logging
 
+# Largest single JSON-RPC line we are willing to buffer from the client
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+def encode_cursor(name: str) -> str:
+    """
+    Build the opaque tools/list cursor that resumes after the given tool
+    """
+    return base64.urlsafe_b64encode(name.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> str:
+    """
+    Recover the tool name from a tools/list cursor
+
+    Raises:
+        ValueError: If the cursor was not issued by this server
+    """
+    try:
+        name = base64.b64decode(cursor, altchars=b"-_", validate=True).decode()
+    except (binascii.Error, UnicodeError):
+        name = ""
+    if not name:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return name
+
+
+class ToolCall:
+    """
+    The parts of a tools/call request the server acts on.
+    """
+
+    __slots__ = ("name", "arguments", "progress_token", "timeout_ms")
+
+    def __init__(
+        self,
+        name: str,
+        arguments: Optional[Dict[str, Any]] = None,
+        progress_token: Optional[Any] = None,
+        timeout_ms: Optional[Any] = None,
+    ):
+        self.name = name
+        self.arguments = arguments
+        self.progress_token = progress_token
+        self.timeout_ms = timeout_ms
+
+    @classmethod
+    def from_request(cls, request: CallToolRequest) -> "ToolCall":
+        """
+        Take a tool call from a fully validated request
+        """
+        meta = request.params.meta
+        return cls(
+            request.params.name,
+            request.params.arguments,
+            meta.progressToken if meta else None,
+            getattr(meta, "timeoutMs", None) if meta else None,
+        )
+
+    @classmethod
+    def from_params(cls, params: Any) -> "ToolCall":
+        """
+        Take a tool call from raw params, checking only the fields the
+        server reads instead of validating the whole CallToolRequest
+
+        Raises:
+            ValueError: If one of those fields has the wrong type
+        """
+        if not isinstance(params, dict):
+            raise ValueError("params must be an object")
+        name = params.get("name")
+        if not isinstance(name, str):
+            raise ValueError("params.name must be a string")
+        arguments = params.get("arguments")
+        if arguments is not None and not isinstance(arguments, dict):
+            raise ValueError("params.arguments must be an object")
+
+        meta = params.get("_meta")
+        if meta is None:
+            return cls(name, arguments)
+        if not isinstance(meta, dict):
+            raise ValueError("params._meta must be an object")
+        token = meta.get("progressToken")
+        if token is not None and (isinstance(token, bool) or not isinstance(token, (str, int))):
+            raise ValueError("params._meta.progressToken must be a string or integer")
+        return cls(name, arguments, token, meta.get("timeoutMs"))
+
+
+def dump_call_result(result: CallToolResult) -> Dict[str, Any]:
+    """
+    Serialize a CallToolResult like `model_dump(mode="json", exclude_none=True)`
+
+    Results holding only plain text are written out directly; anything else
+    falls back to pydantic.
+    """
+    if result.meta is not None or result.structuredContent is not None or result.model_extra:
+        return result.model_dump(mode="json", exclude_none=True)
+
+    content = []
+    for item in result.content:
+        if (
+            type(item) is not TextContent
+            or item.annotations is not None
+            or item.meta is not None
+            or item.model_extra
+        ):
+            return result.model_dump(mode="json", exclude_none=True)
+        content.append({"type": "text", "text": item.text})
+    return {"content": content, "isError": result.isError}
+
 
 class MCPServer:
     """
@@ -33,7 +180,24 @@ class MCPServer:
     """
 
     def __init__(
-        self, server_name: str = "Barebones MCP Server", server_version: str = "1.0.0"
+        self,
+        server_name: str = "Barebones MCP Server",
+        server_version: str = "1.0.0",
+        max_concurrent_requests: int = 16,
+        max_queued_requests: int = 64,
+        max_buffered_bytes: int = 256 * 1024 * 1024,
+        batch_concurrency: int = 8,
+        registry: Optional[ToolRegistry] = None,
+        tools_page_size: Optional[int] = None,
+        tool_timeout: Optional[float] = None,
+        tool_threads: int = 8,
+        tool_processes: Optional[int] = None,
+        tool_process_tasks: int = 1000,
+        shutdown_grace: float = 10,
+        strict_validation: bool = False,
+        read_limit: int = READ_RESPONSE_LIMIT,
+        file_cache_bytes: int = 64 * 1024 * 1024,
+        read_threads: int = 4,
     ):
         """
         Initialize the MCP Server
@@ -41,11 +205,88 @@ class MCPServer:
         Args:
             server_name: Name of this server
             server_version: Version of this server
+            max_concurrent_requests: Maximum number of requests handled at once
+            max_queued_requests: Maximum number of requests waiting to run;
+                past that new requests are rejected
+            max_buffered_bytes: Maximum raw payload bytes held by waiting and
+                running requests; past that new requests are rejected
+            batch_concurrency: Maximum members of one batch handled at once
+            registry: Tools to expose; defaults to the built-in tools
+            tools_page_size: Maximum tools per tools/list page, or None to
+                return every tool in one response
+            tool_timeout: Seconds any tool call may run, or None for no limit
+            tool_threads: Size of the thread pool that runs blocking tools
+            tool_processes: Size of the process pool that runs CPU-bound
+                tools; defaults to the CPU count
+            tool_process_tasks: Calls each worker process handles before
+                it is replaced
+            shutdown_grace: Seconds in-flight requests get to finish once
+                the server starts shutting down
+            strict_validation: Validate tools/call requests and results
+                with the full pydantic models instead of the fast path
+            read_limit: Most bytes of file content one read_file or
+                read_files call returns; longer reads continue through a
+                cursor
+            file_cache_bytes: Memory for caching the contents of files
+                read_file reads, or 0 to read from disk every time
+            read_threads: Size of the thread pool read_files reads files on,
+                on top of `tool_threads`
         """
+        if batch_concurrency < 1:
+            raise ValueError("batch_concurrency must be at least 1")
+        if tools_page_size is not None and tools_page_size < 1:
+            raise ValueError("tools_page_size must be at least 1")
+
         self.server_name = server_name
         self.server_version = server_version
+        self.max_concurrent_requests = max_concurrent_requests
+        self.batch_concurrency = batch_concurrency
+        self.tools_page_size = tools_page_size
+        self.tool_timeout = tool_timeout
+        self.shutdown_grace = shutdown_grace
+        self.strict_validation = strict_validation
         self.protocol_version = "2024-11-05"  # Current MCP protocol version
-        self.initialized = False
+        self.metrics = Metrics()
+        self.admission = AdmissionControl(
+            self.metrics,
+            max_in_flight=max_concurrent_requests,
+            max_queued=max_queued_requests,
+            max_buffered_bytes=max_buffered_bytes,
+        )
+        self.blocking_pool = BlockingPool(self.metrics, max_workers=tool_threads)
+        self.process_pool = ProcessPool(
+            self.metrics,
+            max_workers=tool_processes,
+            max_tasks_per_worker=tool_process_tasks,
+        )
+        self.file_cache = FileCache(self.metrics, max_bytes=file_cache_bytes) if file_cache_bytes else None
+
+        # Shutdown state: set once the server stops taking new work
+        self.draining = False
+        self._drain_deadline: Optional[float] = None
+        self._stopped: Optional[asyncio.Event] = None
+        self._read_loops: Set[asyncio.Task] = set()
+
+        # Session used by stdio and by callers that don't pass their own
+        self.default_session = Session()
+        self.sessions = {self.default_session}
+
+        if registry is None:
+            registry = ToolRegistry()
+            reader = ReadFileTool(max_bytes=read_limit, file_cache=self.file_cache)
+            for tool in (
+                Greeting(),
+                reader,
+                ReadFilesTool(reader, max_bytes=read_limit, max_workers=read_threads, metrics=self.metrics),
+                WriteFileTool(file_cache=self.file_cache),
+                CreateDirectoryTool(),
+                ListDirectoryTool(),
+            ):
+                registry.register(tool)
+        self.registry = registry
+        self.registry.add_listener(self.handle_tools_changed)
+        self._tools_list_pages: Dict[Optional[str], EncodedResult] = {}
+        self._issued_cursors: set = set()
 
         self.server_info = Implementation(
             name=self.server_name,
@@ -57,10 +298,30 @@ class MCPServer:
             logging=LoggingCapability(),
             prompts=PromptsCapability(listChanged=False),
             resources=ResourcesCapability(listChanged=False, subscribe=False),
-            tools=ToolsCapability(listChanged=False),
+            tools=ToolsCapability(listChanged=True),
         )
 
-    def handle_initialize(self, request: InitializeRequest) -> InitializeResult:
+    def open_session(self, session: Session) -> None:
+        """
+        Start tracking a client so it receives server-wide notifications
+
+        Args:
+            session: Newly connected client
+        """
+        self.sessions.add(session)
+
+    def close_session(self, session: Session) -> None:
+        """
+        Stop tracking a client that has gone away
+
+        Args:
+            session: Disconnected client
+        """
+        self.sessions.discard(session)
+
+    def handle_initialize(
+        self, request: InitializeRequest, session: Session
+    ) -> InitializeResult:
         """
         Handle the MCP initialize request from client
 
@@ -69,13 +330,14 @@ class MCPServer:
 
         Args:
             request: Initialize request from client
+            session: Client the request came from
 
         Returns:
             Initialize result with our server info and capabilities
         """
-        self.client_info = request.params.clientInfo if request.params else None
+        session.client_info = request.params.clientInfo if request.params else None
 
-        self.initialized = True
+        session.initialized = True
 
         return InitializeResult(
             protocolVersion=self.protocol_version,
@@ -86,122 +348,212 @@ class MCPServer:
     def handle_notifications_initialized(self) -> None:
         logging.info("Server fully initialized and ready!")
 
-    def handle_list_tools(self) -> ListToolsResult:
+    def handle_list_tools(self, cursor: Optional[str] = None) -> ListToolsResult:
         """
         Handle the tools/list request to return available tools
 
+        Args:
+            cursor: Cursor from a previous page, or None for the first page
+
+        Returns:
+            ListToolsResult containing one page of registered tools
+        """
+        if self.tools_page_size is None:
+            return ListToolsResult(tools=self.registry.list_tools())
+
+        after = decode_cursor(cursor) if cursor is not None else None
+        tools, last = self.registry.list_tools_page(after, self.tools_page_size)
+        return ListToolsResult(
+            tools=tools,
+            nextCursor=encode_cursor(last) if last is not None else None,
+        )
+
+    def encoded_tools_list(self, cursor: Optional[str] = None) -> EncodedResult:
+        """
+        Return a serialized tools/list page, building it on first use
+
+        Pages only change when the registry does, so they are kept until
+        `handle_tools_changed` throws them away. Only the first page and
+        cursors we handed out are cached.
+
+        Args:
+            cursor: Cursor from a previous page, or None for the first page
+
         Returns:
-            ListToolsResult containing all registered tools
+            Encoded ListToolsResult
+        """
+        page = self._tools_list_pages.get(cursor)
+        if page is None:
+            result = self.handle_list_tools(cursor)
+            page = EncodedResult(result.model_dump_json(exclude_none=True).encode())
+            if cursor is None or cursor in self._issued_cursors:
+                self._tools_list_pages[cursor] = page
+            if result.nextCursor is not None:
+                self._issued_cursors.add(result.nextCursor)
+        return page
+
+    def handle_tools_changed(self) -> None:
         """
-        tools = [
-            Greeting().to_tool(),
-            ReadFileTool().to_tool(),
-            WriteFileTool().to_tool(),
-            CreateDirectoryTool().to_tool(),
-            ListDirectoryTool().to_tool(),
-        ]
+        Called by the registry when a tool is added or removed
 
-        return ListToolsResult(tools=tools)
+        Drops the cached tools/list pages and tells every initialized
+        client to fetch the list again.
+        """
+        self._tools_list_pages.clear()
+        self._issued_cursors.clear()
+        for session in self.sessions:
+            if session.initialized:
+                session.send_notification("notifications/tools/list_changed")
 
-    def handle_call_tool(self, request: CallToolRequest) -> CallToolResult:
+    def handle_call_tool(
+        self, call: ToolCall, context: Optional[ToolContext] = None, plain: bool = False
+    ) -> CallResult:
         """
         Handle a tool call request
 
         Args:
-            request: CallToolRequest containing tool name and arguments
+            call: Tool name and arguments
+            context: Context the tool can use to notice cancellation
+            plain: Return plain text results as the dictionary they
+                serialize to, skipping the pydantic models
 
         Returns:
             Result of the tool call
         """
-        name = request.params.name
-        arguments = request.params.arguments
+        return self.registry.call(call.name, call.arguments, context, plain)
 
-        if name == "greeting":
-            tool = Greeting()
-            try:
-                response = tool.call(arguments)
-                return CallToolResult(
-                    content=[TextContent(type="text", text=response["message"])]
-                )
-            except ValueError as e:
-                logging.error(f"Error calling tool '{name}': {str(e)}\n")
-                return CallToolResult(
-                    content=[TextContent(type="text", text=str(e))],
-                    isError=True,
-                )
-        elif name == "read_file":
-            tool = ReadFileTool()
-            try:
-                response = tool.call(arguments)
-                return CallToolResult(
-                    content=[TextContent(type="text", text=response["content"])]
-                )
-            except ValueError as e:
-                logging.error(f"Error calling tool '{name}': {str(e)}\n")
-                return CallToolResult(
-                    content=[TextContent(type="text", text=str(e))],
-                    isError=True,
-                )
-        elif name == "write_file":
-            tool = WriteFileTool()
-            try:
-                response = tool.call(arguments)
-                return CallToolResult(
-                    content=[TextContent(type="text", text=response["message"])]
-                )
-            except ValueError as e:
-                logging.error(f"Error calling tool '{name}': {str(e)}\n")
-                return CallToolResult(
-                    content=[TextContent(type="text", text=str(e))],
-                    isError=True,
-                )
-        elif name == "create_directory":
-            tool = CreateDirectoryTool()
-            try:
-                response = tool.call(arguments)
-                return CallToolResult(
-                    content=[TextContent(type="text", text=response["message"])]
-                )
-            except ValueError as e:
-                logging.error(f"Error calling tool '{name}': {str(e)}\n")
-                return CallToolResult(
-                    content=[TextContent(type="text", text=str(e))],
-                    isError=True,
-                )
-        elif name == "list_directory":
-            tool = ListDirectoryTool()
+    def call_timeout(self, call: ToolCall) -> Optional[float]:
+        """
+        Work out how long a tool call may run
+
+        The shortest of the server-wide limit, the tool's own `timeout`, and
+        the client's `_meta.timeoutMs` wins.
+
+        Args:
+            call: Tool name and request metadata
+
+        Returns:
+            Timeout in seconds, or None if nothing limits the call
+        """
+        limits = [self.tool_timeout]
+        tool = self.registry.get(call.name)
+        if tool is not None:
+            limits.append(tool.timeout)
+        client_timeout = call.timeout_ms
+        if isinstance(client_timeout, (int, float)) and client_timeout > 0:
+            limits.append(client_timeout / 1000)
+
+        limits = [limit for limit in limits if limit is not None]
+        return min(limits) if limits else None
+
+    async def run_tool_call(
+        self, call: ToolCall, request_id: Any, session: Session
+    ) -> Optional[CallResult]:
+        """
+        Run a tool call, tracked so it can be cancelled
+
+        Tools that declare themselves `cpu_bound` run in the process pool,
+        `blocking` ones on the blocking pool, and the rest directly on the
+        event loop.
+
+        If the request carries `_meta.progressToken`, progress reported by
+        the tool is sent to the client as notifications/progress. Calls that
+        outlive `call_timeout` are stopped at the tool's next check.
+
+        Args:
+            call: Tool name, arguments and request metadata
+            request_id: JSON-RPC id of the request
+            session: Client the request came from
+
+        Unless `strict_validation` is set, plain text results come back as
+        the dictionary they serialize to.
+
+        Returns:
+            Result of the tool call, or None if the client cancelled it
+
+        Raises:
+            ToolTimeout: If the call ran past its deadline
+        """
+        loop = asyncio.get_running_loop()
+
+        def on_progress(params: Dict[str, Any]) -> None:
+            loop.call_soon_threadsafe(
+                session.send_notification, "notifications/progress", params, True
+            )
+
+        timeout = self.call_timeout(call)
+        context = ToolContext(
+            progress_token=call.progress_token,
+            on_progress=on_progress,
+            timeout=timeout,
+        )
+        plain = not self.strict_validation
+        tool = self.registry.get(call.name)
+        if tool is not None and not tool.loaded and not tool.cpu_bound:
+            # Import plugin implementations off the loop; a failure is
+            # reported by the call itself
             try:
-                response = tool.call(arguments)
-                formatted_response = f"Directory: {response['directory']}\n\n"
-                formatted_response += f"Files ({response['total_files']}):\n"
-                for file in response['files']:
-                    formatted_response += f"  {file}\n"
-                formatted_response += f"\nDirectories ({response['total_directories']}):\n"
-                for directory in response['directories']:
-                    formatted_response += f"  {directory}/\n"
-                return CallToolResult(
-                    content=[TextContent(type="text", text=formatted_response)]
-                )
-            except ValueError as e:
-                logging.error(f"Error calling tool '{name}': {str(e)}\n")
-                return CallToolResult(
-                    content=[TextContent(type="text", text=str(e))],
-                    isError=True,
-                )
-        else:
-            return CallToolResult(
-                content=[
-                    TextContent(type="text", text=str(f"Tool '{name}' not found"))
-                ],
-                isError=True,
+                await self.blocking_pool.run(tool.resolve)
+            except ValueError:
+                pass
+        if tool is not None and tool.cpu_bound:
+            future = asyncio.ensure_future(
+                self.registry.call_with(call.name, call.arguments, self.process_pool.run, plain)
             )
+        elif tool is not None and tool.blocking:
+            future = asyncio.ensure_future(
+                self.blocking_pool.run(self.handle_call_tool, call, context, plain)
+            )
+        else:
+            # Nothing else runs on the loop while an inline tool does, so it
+            # can neither be cancelled nor time out part way except through
+            # its own context checks; skip the task and call it directly
+            return self.handle_call_tool(call, context, plain)
+        session.in_flight[request_id] = (context, future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            context.cancel()
+            raise ToolTimeout(timeout)
+        except ToolTimeout:
+            raise
+        except (asyncio.CancelledError, ToolCancelled):
+            if context.cancelled:
+                return None
+            # Our own task is being torn down; stop the tool as well
+            context.cancel()
+            raise
+        finally:
+            if session.in_flight.get(request_id, (None,))[0] is context:
+                del session.in_flight[request_id]
 
-    def handle_request(self, raw_request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    def handle_cancelled(self, notification: CancelledNotification, session: Session) -> None:
+        """
+        Handle notifications/cancelled from the client
+
+        The tool is asked to stop at its next check and no response is sent
+        for the request. Unknown or already finished ids are ignored.
+
+        Args:
+            notification: Cancellation sent by the client
+            session: Client the notification came from
+        """
+        request_id = notification.params.requestId
+        if session.cancel(request_id):
+            logging.info(f"Cancelled request {request_id}: {notification.params.reason}")
+
+    async def handle_request(
+        self, raw_request: Dict[str, Any], session: Optional[Session] = None
+    ) -> Optional[Dict[str, Any]]:
         """
         Main request handler - routes JSON-RPC requests to appropriate methods
 
+        Blocking tool calls run on a worker thread so a slow tool never
+        holds up the event loop that is reading the next request.
+
         Args:
             raw_request: Raw JSON-RPC request
+            session: Client the request came from; defaults to the stdio client
 
         Returns:
             JSON-RPC response or None for notifications
@@ -209,12 +561,14 @@ class MCPServer:
         method = raw_request.get("method")
         params = raw_request.get("params", {})
         request_id = raw_request.get("id")
+        if session is None:
+            session = self.default_session
 
         try:
             if method == "initialize":
                 init_request = InitializeRequest(method="initialize", params=params)
 
-                result = self.handle_initialize(init_request)
+                result = self.handle_initialize(init_request, session)
                 serialized = result.model_dump(
                     exclude_none=True,
                 )
@@ -229,29 +583,85 @@ class MCPServer:
                 self.handle_notifications_initialized()
                 return None
 
+            elif method == "notifications/cancelled":
+                try:
+                    notification = CancelledNotification(method="notifications/cancelled", params=params)
+                except ValidationError as e:
+                    # Notifications never get a reply, even when malformed
+                    logging.error(f"Ignoring malformed cancellation: {e}")
+                    return None
+                self.handle_cancelled(notification, session)
+                return None
+
+            elif method == "ping":
+                return {
+                    "jsonrpc": "2.0",
+                    "id": request_id,
+                    "result": {},
+                }
+
             elif method == "tools/list":
-                tools = self.handle_list_tools()
-                serialized = tools.model_dump(
-                    exclude_none=True,
-                )
+                try:
+                    if params is None:
+                        params = {}
+                    if not isinstance(params, dict):
+                        raise ValueError("Invalid params: expected an object")
+                    cursor = params.get("cursor")
+                    if cursor is not None and not isinstance(cursor, str):
+                        raise ValueError("Invalid params: cursor must be a string")
+                    result = self.encoded_tools_list(cursor)
+                except ValueError as e:
+                    return {
+                        "jsonrpc": "2.0",
+                        "id": request_id,
+                        "error": {
+                            "code": -32602,  # Invalid params
+                            "message": str(e),
+                        },
+                    }
                 return {
                     "jsonrpc": "2.0",
                     "id": request_id,
-                    "result": serialized,
+                    "result": result,
                 }
 
             elif method == "tools/call":
-                call_request = CallToolRequest(method="tools/call", params=params)
-                result = self.handle_call_tool(call_request)
-                serialized = result.model_dump(
-                    exclude_none=True,
-                )
+                try:
+                    if self.strict_validation:
+                        call = ToolCall.from_request(
+                            CallToolRequest(method="tools/call", params=params)
+                        )
+                    else:
+                        call = ToolCall.from_params(params)
+                except ValueError as e:
+                    return {
+                        "jsonrpc": "2.0",
+                        "id": request_id,
+                        "error": {
+                            "code": -32602,  # Invalid params
+                            "message": f"Invalid params: {e}",
+                        },
+                    }
+
+                result = await self.run_tool_call(call, request_id, session)
+                if result is None:
+                    return None
+                if isinstance(result, dict):
+                    serialized = result
+                elif self.strict_validation:
+                    serialized = result.model_dump(mode="json", exclude_none=True)
+                else:
+                    serialized = dump_call_result(result)
                 return {
                     "jsonrpc": "2.0",
                     "id": request_id,
                     "result": serialized,
                 }
 
+            elif "id" not in raw_request:
+                # Notifications never get a response, even unknown ones
+                return None
+
             else:
                 return {
                     "jsonrpc": "2.0",
@@ -262,6 +672,17 @@ class MCPServer:
                     },
                 }
 
+        except ToolTimeout as e:
+            return {
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "error": {
+                    "code": REQUEST_TIMEOUT,
+                    "message": str(e),
+                    "data": {"tool": params.get("name"), "timeout": e.timeout},
+                },
+            }
+
         except Exception as e:
             return {
                 "jsonrpc": "2.0",
@@ -272,47 +693,712 @@ class MCPServer:
                 },
             }
 
-    def run(self):
+    async def handle_batch(
+        self, batch: List[Any], session: Optional[Session] = None, size: int = 0
+    ) -> Optional[List[Dict[str, Any]]]:
         """
-        Main server loop - reads JSON-RPC messages from stdin
+        Handle a JSON-RPC batch
+
+        Every member is admitted on its own, so a batch takes as many
+        request slots as it has members and cannot get past the in-flight
+        and queue limits; members the server has no room for are rejected
+        individually. Admitted members are handled concurrently, at most
+        `batch_concurrency` at a time. Replies keep the order of the batch
+        and leave out notifications.
+
+        Args:
+            batch: Non-empty list of JSON-RPC requests
+            session: Client the batch came from
+            size: Raw payload size of the batch in bytes, shared between
+                the members for the byte budget
+
+        Returns:
+            List of responses, or None if the batch was all notifications
         """
+        slots = asyncio.Semaphore(self.batch_concurrency)
+        share = size // len(batch)
+
+        def admit(member: Any) -> Union[AdmissionTicket, Dict[str, Any], None]:
+            if not isinstance(member, dict):
+                return invalid_request()
+            try:
+                return self.admission.admit(share, lane_for(member), session)
+            except Overloaded as e:
+                return self.reject(member, e)
+
+        async def handle_member(
+            member: Any, ticket: Union[AdmissionTicket, Dict[str, Any], None]
+        ) -> Optional[Dict[str, Any]]:
+            if not isinstance(ticket, AdmissionTicket):
+                return ticket
+            return await self.handle_admitted(member, ticket, session, slots)
+
+        # Admit every member before any of them runs
+        tickets = [admit(member) for member in batch]
+        responses = await asyncio.gather(*map(handle_member, batch, tickets))
+        replies = [response for response in responses if response is not None]
+        return replies or None
+
+    async def handle_admitted(
+        self,
+        message: Any,
+        ticket: AdmissionTicket,
+        session: Optional[Session] = None,
+        slots: Optional[asyncio.Semaphore] = None,
+    ) -> Optional[Message]:
+        """
+        Wait for an admitted request's turn, then handle it
+
+        The request can be cancelled from the moment it is admitted, so a
+        client can withdraw a request still waiting in the queue; it is then
+        dropped without a reply. Once a tool call is running, its own entry
+        in `session.in_flight` takes over.
+
+        Args:
+            message: Decoded JSON value sent by the client
+            ticket: Admission of the message
+            session: Client the message came from
+            slots: Further limit to wait on, such as a batch's own
+
+        Returns:
+            As for `handle_message`
+        """
+        request_id = message.get("id") if isinstance(message, dict) else None
+        waiting = ToolContext()
+        if session is not None and request_id is not None:
+            session.in_flight[request_id] = (waiting, asyncio.current_task())
         try:
-            for line in sys.stdin:
-                line = line.strip()
-                if not line:
-                    continue
+            async with slots or contextlib.nullcontext(), ticket:
+                return await self.handle_message(message, session)
+        except asyncio.CancelledError:
+            if not waiting.cancelled:
+                raise
+            asyncio.current_task().uncancel()
+            logging.info(f"Dropped request {request_id}, cancelled before it ran")
+            return None
+        finally:
+            if session is not None and session.in_flight.get(request_id, (None,))[0] is waiting:
+                del session.in_flight[request_id]
+
+    async def handle_message(
+        self, message: Any, session: Optional[Session] = None
+    ) -> Optional[Message]:
+        """
+        Handle a decoded JSON-RPC message or batch
 
+        Args:
+            message: Decoded JSON value sent by the client
+            session: Client the message came from
+
+        Returns:
+            JSON-RPC response, list of responses for a batch, or None for
+            notifications
+        """
+        if isinstance(message, list) and message:
+            return await self.handle_batch(message, session)
+        if not isinstance(message, dict):
+            return invalid_request()
+        return await self.handle_request(message, session)
+
+    def reject(self, message: Any, error: Overloaded) -> Optional[Message]:
+        """
+        Build the error replies for a message the server had no room for
+
+        Args:
+            message: Decoded JSON value sent by the client
+            error: Why the message was turned away
+
+        Returns:
+            Error response for each request in the message, or None if it
+            held only notifications
+        """
+
+        def rejection(request: Any) -> Optional[Dict[str, Any]]:
+            if isinstance(request, dict) and "id" not in request:
+                return None
+            return {
+                "jsonrpc": "2.0",
+                "id": request.get("id") if isinstance(request, dict) else None,
+                "error": {
+                    "code": SERVER_OVERLOADED,
+                    "message": f"Server overloaded: {error}",
+                },
+            }
+
+        if isinstance(message, list) and message:
+            replies = [reply for reply in map(rejection, message) if reply is not None]
+            return replies or None
+        return rejection(message)
+
+    async def serve_stream(
+        self, reader: asyncio.StreamReader, session: Session
+    ) -> None:
+        """
+        Concurrent loop serving one newline-delimited JSON-RPC stream
+
+        Every request is handled in its own task and its response is written
+        as soon as it is ready, so responses can go out in a different order
+        than the requests came in. Clients match them up by JSON-RPC id. At
+        most `max_concurrent_requests` tool calls run at once across the
+        whole server and a bounded number wait behind them, taking turns
+        between clients; control-plane messages use separate slots so they
+        never wait behind tool calls. Requests arriving while the server is
+        full are rejected with SERVER_OVERLOADED.
+
+        Reading stops at EOF or when the server shuts down; requests still
+        running then get `shutdown_grace` seconds to finish before they are
+        dropped.
+
+        Args:
+            reader: Stream of messages from the client
+            session: Client on the other end of the stream
+        """
+        in_flight: Set[asyncio.Task] = set()
+        read_loop = asyncio.create_task(self.read_stream(reader, session, in_flight))
+        self._read_loops.add(read_loop)
+        try:
+            await read_loop
+        except asyncio.CancelledError:
+            if not self.draining:
+                raise
+        finally:
+            self._read_loops.discard(read_loop)
+
+        await self.drain(in_flight, session)
+
+    async def read_stream(
+        self, reader: asyncio.StreamReader, session: Session, in_flight: Set[asyncio.Task]
+    ) -> None:
+        """
+        Read messages from a stream and start a task for each one
+
+        Args:
+            reader: Stream of messages from the client
+            session: Client on the other end of the stream
+            in_flight: Collects the tasks handling the messages
+        """
+        async def process(message: Any, ticket: AdmissionTicket) -> None:
+            response = await self.handle_admitted(message, ticket, session)
+            if response is not None:
+                await session.send_message(response)
+
+        async def process_batch(batch: List[Any], size: int) -> None:
+            response = await self.handle_batch(batch, session, size)
+            if response is not None:
+                await session.send_message(response)
+
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError as e:
+                logging.error(f"Dropping oversized message: {e}")
+                continue
+
+            if not line:
+                break
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError as e:
+                logging.error(f"Error parsing message: {e}")
+                await session.send_message(parse_error(e))
+                continue
+
+            if isinstance(message, list) and message:
+                # Members are admitted one by one
+                task = asyncio.create_task(process_batch(message, len(line)))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+                continue
+
+            try:
+                ticket = self.admission.admit(len(line), lane_for(message), session)
+            except Overloaded as e:
+                response = self.reject(message, e)
+                if response is not None:
+                    await session.send_message(response)
+                continue
+
+            task = asyncio.create_task(process(message, ticket))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+    async def drain(self, in_flight: Set[asyncio.Task], session: Session) -> None:
+        """
+        Wait for a stream's running requests, dropping those still running
+        when the grace period ends
+
+        Args:
+            in_flight: Tasks handling the stream's requests
+            session: Client the requests came from
+        """
+        if not in_flight:
+            return
+
+        timeout = self.drain_timeout()
+        done, pending = await asyncio.wait(set(in_flight), timeout=timeout)
+        if self.draining:
+            self.metrics.increment("shutdown_drained_requests", len(done))
+        if not pending:
+            return
+
+        logging.warning(f"Dropping {len(pending)} requests still running after {timeout:.1f}s")
+        self.metrics.increment("shutdown_dropped_requests", len(pending))
+        for request_id in list(session.in_flight):
+            session.cancel(request_id)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def drain_timeout(self) -> float:
+        """
+        Returns:
+            Seconds left for in-flight requests: until the shared deadline
+            once the server is shutting down, or a full grace period after a
+            single stream ends
+        """
+        if self._drain_deadline is None:
+            return self.shutdown_grace
+        return max(0.0, self._drain_deadline - asyncio.get_running_loop().time())
+
+    def request_shutdown(self) -> None:
+        """
+        Stop taking new work: stop accepting connections and reading
+        requests, and give in-flight requests `shutdown_grace` seconds
+        """
+        if self.draining:
+            return
+        logging.info(f"Shutting down, waiting up to {self.shutdown_grace}s for in-flight requests")
+        self.draining = True
+        self._drain_deadline = asyncio.get_running_loop().time() + self.shutdown_grace
+        for read_loop in self._read_loops:
+            read_loop.cancel()
+        if self._stopped is not None:
+            self._stopped.set()
+
+    def handle_signals(self) -> None:
+        """
+        Shut down gracefully on SIGTERM and SIGINT
+        """
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, self.request_shutdown)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Not the main thread, or no signal support on this platform
+                pass
+
+    async def flush(self, writer: MessageWriter) -> None:
+        """
+        Write out everything still buffered, within what is left of the
+        grace period
+
+        Args:
+            writer: Writer to flush and close
+        """
+        try:
+            await asyncio.wait_for(writer.close(), max(self.drain_timeout(), 1.0))
+        except asyncio.TimeoutError:
+            logging.warning(f"Client stopped reading, {writer.pending} messages were not sent")
+            self.metrics.increment("shutdown_unsent_messages", writer.pending)
+
+    def close(self) -> None:
+        """
+        Stop the worker pools and log what shutdown left undone
+        """
+        self.blocking_pool.shutdown(wait=False)
+        self.process_pool.shutdown(wait=False)
+        for tool in self.registry:
+            tool.close()
+
+        snapshot = self.metrics.snapshot()
+        lost = snapshot.get("shutdown_dropped_requests", 0) + snapshot.get("shutdown_unsent_messages", 0)
+        logging.log(
+            logging.WARNING if lost else logging.INFO,
+            "Server stopped: "
+            f"{snapshot.get('shutdown_drained_requests', 0):.0f} requests finished during shutdown, "
+            f"{snapshot.get('shutdown_dropped_requests', 0):.0f} dropped, "
+            f"{snapshot.get('shutdown_unsent_messages', 0):.0f} messages not sent"
+        )
+
+    def start_workers(self) -> None:
+        """
+        Start the worker processes up front if any tool needs them, so the
+        first CPU-bound call doesn't pay for process startup
+        """
+        if any(tool.cpu_bound for tool in self.registry):
+            self.process_pool.warm()
+
+    async def serve_stdio(self) -> None:
+        """
+        Serve the default session over stdin and stdout
+        """
+        self.handle_signals()
+        reader = await open_stdin_reader()
+        writer = MessageWriter(write_stdout)
+        writer.start()
+        self.default_session.outbox = writer
+        try:
+            await self.serve_stream(reader, self.default_session)
+        finally:
+            await self.flush(writer)
+
+    async def serve_unix(self, path: str) -> None:
+        """
+        Serve many clients over a Unix domain socket
+
+        Every connection speaks newline-delimited JSON-RPC and gets its own
+        session, while the registry and caches are shared by all of them.
+
+        Args:
+            path: Filesystem path of the socket to listen on
+
+        Raises:
+            OSError: If another server is already listening at `path`
+        """
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            # A socket nobody answers on was left behind by a server that
+            # died; one that answers belongs to a server still running
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
                 try:
-                    request = json.loads(line)
+                    probe.connect(path)
+                except ConnectionRefusedError:
+                    os.unlink(path)
+                else:
+                    raise OSError(errno.EADDRINUSE, os.strerror(errno.EADDRINUSE), path)
 
-                    response = self.handle_request(request)
+        async def handle_connection(
+            reader: asyncio.StreamReader, stream: asyncio.StreamWriter
+        ) -> None:
+            async def sink(data: bytes) -> None:
+                stream.write(data)
+                await stream.drain()
 
-                    if response is not None:
-                        print(json.dumps(response))
-                        sys.stdout.flush()
+            writer = MessageWriter(sink)
+            writer.start()
+            session = Session(writer)
+            self.open_session(session)
+            connections.add(asyncio.current_task())
+            try:
+                await self.serve_stream(reader, session)
+            finally:
+                self.close_session(session)
+                await self.flush(writer)
+                stream.close()
+                connections.discard(asyncio.current_task())
 
-                except json.JSONDecodeError as e:
-                    # Handle parse error
-                    error_response = JSONRPCError(
-                        jsonrpc="2.0",
-                        id="1",
-                        error=ErrorData(code=0, message=f"Error parsing stdin: {e}"),
-                    )
-                    logging.error(json.dumps(error_response))
-                    sys.stdout.flush()
+        connections: Set[asyncio.Task] = set()
+        self._stopped = asyncio.Event()
+        self.handle_signals()
+        unix_server = await asyncio.start_unix_server(
+            handle_connection, path, limit=MAX_MESSAGE_BYTES
+        )
+        logging.info(f"Listening on {path}")
+        try:
+            await self._stopped.wait()
+            unix_server.close()
+            if connections:
+                await asyncio.gather(*connections, return_exceptions=True)
+        finally:
+            unix_server.close()
+            if os.path.exists(path):
+                os.unlink(path)
 
+    def run(self):
+        """
+        Main server loop - serves JSON-RPC messages from stdin until EOF,
+        SIGTERM or SIGINT, then shuts down gracefully
+        """
+        try:
+            asyncio.run(self.serve_stdio())
         except KeyboardInterrupt:
             print("Server shutting down...", file=sys.stderr)
+        finally:
+            self.close()
+
+
+async def write_stdout(data: bytes) -> None:
+    """
+    Write a chunk of encoded messages to stdout and flush it
+
+    The write happens on a worker thread so a client that is slow to read
+    blocks the writer task rather than the event loop.
+
+    Args:
+        data: Bytes to write
+    """
+
+    def write() -> None:
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+    await asyncio.to_thread(write)
+
+
+async def open_stdin_reader() -> asyncio.StreamReader:
+    """
+    Wrap stdin in an asyncio stream reader
+
+    Pipes are watched directly by the event loop. Regular files and
+    terminals cannot be, so for those a background thread feeds the reader.
+
+    Returns:
+        Stream reader producing the raw bytes of stdin
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=MAX_MESSAGE_BYTES)
+
+    try:
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), sys.stdin
+        )
+        return reader
+    except (ValueError, OSError):
+        pass
+
+    def pump() -> None:
+        for line in sys.stdin.buffer:
+            loop.call_soon_threadsafe(reader.feed_data, line)
+        loop.call_soon_threadsafe(reader.feed_eof)
+
+    threading.Thread(target=pump, name="stdin-reader", daemon=True).start()
+    return reader
 
 
 def main():
     """
     Entry point - create and run the server
     """
-    server = MCPServer(server_name="Barebones MCP Server", server_version="1.12.2")
+    parser = argparse.ArgumentParser(description="Barebones MCP Server")
+    parser.add_argument(
+        "--transport",
+        choices=["stdio", "http", "unix"],
+        default="stdio",
+        help="How clients connect to the server",
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Interface the HTTP transport listens on",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="Port the HTTP transport listens on",
+    )
+    parser.add_argument(
+        "--socket-path",
+        default="/tmp/mcp-server.sock",
+        help="Path the Unix socket transport listens on",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=16,
+        help="Maximum number of requests handled at once",
+    )
+    parser.add_argument(
+        "--max-queued",
+        type=int,
+        default=64,
+        help="Maximum number of requests waiting to run before new ones are rejected",
+    )
+    parser.add_argument(
+        "--max-buffered-bytes",
+        type=int,
+        default=256 * 1024 * 1024,
+        help="Maximum request payload bytes held before new requests are rejected",
+    )
+    parser.add_argument(
+        "--batch-concurrency",
+        type=int,
+        default=8,
+        help="Maximum members of one JSON-RPC batch handled at once",
+    )
+    parser.add_argument(
+        "--tools-page-size",
+        type=int,
+        default=None,
+        help="Maximum tools per tools/list page (default: no pagination)",
+    )
+    parser.add_argument(
+        "--tool-timeout",
+        type=float,
+        default=None,
+        help="Seconds any tool call may run (default: no limit)",
+    )
+    parser.add_argument(
+        "--tool-threads",
+        type=int,
+        default=8,
+        help="Size of the thread pool that runs blocking filesystem tools",
+    )
+    parser.add_argument(
+        "--read-threads",
+        type=int,
+        default=4,
+        help="Size of the extra thread pool read_files reads its files on",
+    )
+    parser.add_argument(
+        "--tool-processes",
+        type=int,
+        default=None,
+        help="Size of the process pool that runs CPU-bound tools (default: CPU count)",
+    )
+    parser.add_argument(
+        "--tool-process-tasks",
+        type=int,
+        default=1000,
+        help="Calls each tool worker process handles before it is replaced",
+    )
+    parser.add_argument(
+        "--shutdown-grace",
+        type=float,
+        default=10,
+        help="Seconds in-flight requests get to finish when the server shuts down",
+    )
+    parser.add_argument(
+        "--strict-validation",
+        action="store_true",
+        help="Validate tools/call requests and results with the full pydantic models",
+    )
+    parser.add_argument(
+        "--read-limit",
+        type=int,
+        default=READ_RESPONSE_LIMIT,
+        help="Most bytes of file content one read_file or read_files call returns before continuing with a cursor",
+    )
+    parser.add_argument(
+        "--file-cache-bytes",
+        type=int,
+        default=64 * 1024 * 1024,
+        help="Memory for caching the contents of files read_file reads (0 disables the cache)",
+    )
+    parser.add_argument(
+        "--tool-module",
+        action="append",
+        default=[],
+        help="Manifest module listing plugin tools in TOOLS; may be repeated",
+    )
+    parser.add_argument(
+        "--no-entry-points",
+        action="store_true",
+        help="Don't look for plugin tools in installed packages' entry points",
+    )
+    parser.add_argument(
+        "--session-ttl",
+        type=float,
+        default=600,
+        help="Seconds an HTTP session with no requests and no open event stream is kept",
+    )
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=1024,
+        help="Most HTTP sessions kept at once; the least recently used is closed past that",
+    )
+    parser.add_argument(
+        "--allowed-origin",
+        action="append",
+        default=None,
+        help="Origin browser pages may call the HTTP transport from, like https://app.example.com; "
+        "may be repeated (default: localhost on any port)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes for the HTTP transport, sharing one listening socket",
+    )
+    parser.add_argument(
+        "--reuse-port",
+        action="store_true",
+        help="Give each HTTP worker its own SO_REUSEPORT socket instead of sharing one",
+    )
+    args = parser.parse_args()
+
+    def make_server() -> MCPServer:
+        server = MCPServer(
+            server_name="Barebones MCP Server",
+            server_version="1.12.2",
+            max_concurrent_requests=args.max_concurrency,
+            max_queued_requests=args.max_queued,
+            max_buffered_bytes=args.max_buffered_bytes,
+            batch_concurrency=args.batch_concurrency,
+            tools_page_size=args.tools_page_size,
+            tool_timeout=args.tool_timeout,
+            tool_threads=args.tool_threads,
+            tool_processes=args.tool_processes,
+            tool_process_tasks=args.tool_process_tasks,
+            shutdown_grace=args.shutdown_grace,
+            strict_validation=args.strict_validation,
+            read_limit=args.read_limit,
+            file_cache_bytes=args.file_cache_bytes,
+            read_threads=args.read_threads,
+        )
+        plugins = discover_tools(
+            args.tool_module, group=None if args.no_entry_points else ENTRY_POINT_GROUP
+        )
+        for tool in plugins:
+            try:
+                server.registry.register(tool)
+            except ValueError as e:
+                logging.error(f"Skipping plugin tool: {e}")
+        return server
+
+    http_options = {"session_ttl": args.session_ttl, "max_sessions": args.max_sessions}
+    if args.allowed_origin is not None:
+        http_options["allowed_origins"] = args.allowed_origin
 
     logging.info("Starting MCP Server...")
-    server.run()
+    if args.transport == "http" and (args.workers > 1 or args.reuse_port):
+        from prefork import Supervisor
+
+        Supervisor(
+            make_server,
+            workers=args.workers,
+            host=args.host,
+            port=args.port,
+            reuse_port=args.reuse_port,
+            graceful_timeout=args.shutdown_grace,
+            **http_options,
+        ).run()
+        return
+
+    server = make_server()
+    server.start_workers()
+    if args.transport == "http":
+        from http_transport import run_http
+
+        run_http(
+            server,
+            host=args.host,
+            port=args.port,
+            **http_options,
+        )
+    elif args.transport == "unix":
+        try:
+            asyncio.run(server.serve_unix(args.socket_path))
+        except KeyboardInterrupt:
+            print("Server shutting down...", file=sys.stderr)
+        except OSError as e:
+            logging.error(f"Cannot serve on the Unix socket: {e}")
+            sys.exit(1)
+        finally:
+            server.close()
+    else:
+        server.run()
+
+    if server.blocking_pool.busy:
+        # Threads stuck in system calls would keep the interpreter from exiting
+        logging.warning(f"Exiting with {server.blocking_pool.busy} tool calls still blocked")
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(0)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+"""
+In-process counters and gauges describing what the server is doing.
+"""
+
+import threading
+from collections import defaultdict
+from typing import Callable, Dict
+
+
+class Metrics:
+    """
+    Thread-safe named counters plus gauges read on demand.
+
+    Counters only go up and are bumped from wherever the event happens,
+    including tool worker threads. Gauges are callables sampled when a
+    snapshot is taken, so hot paths never pay for keeping them current.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, Callable[[], float]] = {}
+
+    def increment(self, name: str, amount: float = 1) -> None:
+        """
+        Add to a counter, creating it at zero if needed.
+
+        Args:
+            name: Counter name
+            amount: How much to add
+        """
+        with self._lock:
+            self._counters[name] += amount
+
+    def gauge(self, name: str, read: Callable[[], float]) -> None:
+        """
+        Register a gauge.
+
+        Args:
+            name: Gauge name
+            read: Returns the gauge's current value
+        """
+        self._gauges[name] = read
+
+    def snapshot(self) -> Dict[str, float]:
+        """
+        Returns:
+            Current value of every counter and gauge, by name
+        """
+        with self._lock:
+            values = dict(self._counters)
+        for name, read in self._gauges.items():
+            values[name] = read()
+        return values
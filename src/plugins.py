@@ -0,0 +1,225 @@
+"""
+Discovery of tools shipped outside this repository.
+
+Tool packs describe their tools in a manifest: a light module holding
+`ToolSpec`s (or plain dicts with the same keys) that name the class
+implementing each tool as "module:Class". Manifests are found through the
+`mcp_server.tools` entry point group or a list of module names. Only the
+manifests are imported at startup; each implementation module is imported
+the first time one of its tools is called, so start time does not grow with
+the size of the tool packs.
+
+A pack's entry point names its manifest, for example in pyproject.toml:
+
+    [project.entry-points."mcp_server.tools"]
+    images = "image_tools.manifest:TOOLS"
+"""
+
+import importlib
+import logging
+import threading
+from importlib.metadata import entry_points
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from mcp.types import CallToolResult
+
+from tools import MCPTool
+
+ENTRY_POINT_GROUP = "mcp_server.tools"
+
+# Module attribute holding the specs when a manifest is named by module
+MANIFEST_ATTRIBUTE = "TOOLS"
+
+
+class ToolSpec:
+    """
+    Everything the server needs to know about a tool before it is loaded.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        title: str,
+        description: str,
+        input_schema: Dict[str, Any],
+        target: str,
+        timeout: Optional[float] = None,
+        blocking: bool = False,
+        cpu_bound: bool = False,
+    ):
+        """
+        Args:
+            name: Name of the tool
+            title: Human-readable title
+            description: Description shown to the model
+            input_schema: JSON Schema of the arguments
+            target: Class implementing the tool, as "module:Class"; it must
+                be constructible without arguments
+            timeout: Seconds a call may run, or None for no limit
+            blocking: Whether `call` makes blocking system calls
+            cpu_bound: Whether the tool should run in the process pool
+        """
+        if ":" not in target:
+            raise ValueError(f"Tool '{name}' target must look like 'module:Class', got '{target}'")
+
+        self.name = name
+        self.title = title
+        self.description = description
+        self.input_schema = input_schema
+        self.target = target
+        self.timeout = timeout
+        self.blocking = blocking
+        self.cpu_bound = cpu_bound
+
+    @classmethod
+    def from_manifest(cls, entry: Union["ToolSpec", Dict[str, Any]]) -> "ToolSpec":
+        """
+        Accept either a ToolSpec or a dict of its arguments, so packs can
+        write manifests without importing the server
+        """
+        if isinstance(entry, ToolSpec):
+            return entry
+        if isinstance(entry, dict):
+            return cls(**entry)
+        raise ValueError(f"Manifest entries must be ToolSpec or dict, got {type(entry).__name__}")
+
+
+def build_tool(target: str) -> MCPTool:
+    """
+    Import and build the tool a "module:Class" target names
+
+    Raises:
+        ValueError: If the target cannot be imported or is not a tool
+    """
+    module_name, _, class_name = target.partition(":")
+    try:
+        tool_class = getattr(importlib.import_module(module_name), class_name)
+    except (ImportError, AttributeError) as e:
+        raise ValueError(f"'{target}' could not be loaded: {e}") from e
+
+    tool = tool_class()
+    if not isinstance(tool, MCPTool):
+        raise ValueError(f"'{target}' is not a tool")
+    return tool
+
+
+class LazyTool(MCPTool):
+    """
+    Registered in place of a plugin tool until it is first called.
+
+    Carries the spec's metadata, so listing and validating need no import,
+    and imports and builds the real tool on the first call. CPU-bound
+    plugin tools are only ever imported by the worker processes.
+    """
+
+    def __init__(self, spec: ToolSpec):
+        super().__init__(spec.name, spec.title, spec.description, spec.input_schema)
+        self.spec = spec
+        self.timeout = spec.timeout
+        self.blocking = spec.blocking
+        self.cpu_bound = spec.cpu_bound
+        self._tool: Optional[MCPTool] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._tool is not None
+
+    def resolve(self) -> MCPTool:
+        """
+        Import and build the real tool, once
+
+        Raises:
+            ValueError: If the target cannot be imported or is not a tool
+                with this name
+        """
+        if self._tool is not None:
+            return self._tool
+
+        with self._lock:
+            if self._tool is None:
+                tool = build_tool(self.spec.target)
+                if tool.name != self.name:
+                    raise ValueError(f"'{self.spec.target}' does not implement tool '{self.name}'")
+                logging.info(f"Loaded tool '{self.name}' from {self.spec.target}")
+                self._tool = tool
+        return self._tool
+
+    def worker_target(self) -> str:
+        # Workers import the implementation themselves, so the server
+        # process never has to
+        return self.spec.target
+
+    def call(self, arguments: dict) -> dict:
+        return self.resolve().call(arguments)
+
+    def format_result(self, response: Dict[str, Any]) -> CallToolResult:
+        return self.resolve().format_result(response)
+
+    def format_text(self, response: Dict[str, Any]) -> Optional[str]:
+        return self.resolve().format_text(response)
+
+    def close(self) -> None:
+        if self._tool is not None:
+            self._tool.close()
+
+
+def load_manifest(manifest: Any, source: str) -> List[LazyTool]:
+    """
+    Turn a manifest into lazy tools
+
+    Args:
+        manifest: Iterable of specs, or a callable returning one
+        source: Where the manifest came from, for error messages
+
+    Returns:
+        One LazyTool per valid spec; bad specs are logged and skipped
+    """
+    if callable(manifest):
+        manifest = manifest()
+
+    tools = []
+    for entry in manifest:
+        try:
+            tools.append(LazyTool(ToolSpec.from_manifest(entry)))
+        except (TypeError, ValueError) as e:
+            logging.error(f"Skipping bad tool spec in {source}: {e}")
+    return tools
+
+
+def discover_tools(
+    modules: Iterable[str] = (), group: Optional[str] = ENTRY_POINT_GROUP
+) -> List[LazyTool]:
+    """
+    Collect plugin tools from entry points and manifest modules
+
+    A pack that fails to load is logged and skipped rather than stopping the
+    server.
+
+    Args:
+        modules: Manifest modules to load, each with a `TOOLS` attribute
+        group: Entry point group to search, or None to skip entry points
+
+    Returns:
+        Lazy stand-ins for every tool found
+    """
+    tools: List[LazyTool] = []
+
+    if group is not None:
+        for entry_point in entry_points(group=group):
+            try:
+                manifest = entry_point.load()
+            except Exception as e:
+                logging.error(f"Could not load tool pack '{entry_point.name}': {e}")
+                continue
+            tools.extend(load_manifest(manifest, f"entry point '{entry_point.name}'"))
+
+    for module_name in modules:
+        try:
+            manifest = getattr(importlib.import_module(module_name), MANIFEST_ATTRIBUTE)
+        except (ImportError, AttributeError) as e:
+            logging.error(f"Could not load tool manifest '{module_name}': {e}")
+            continue
+        tools.extend(load_manifest(manifest, f"module '{module_name}'"))
+
+    return tools
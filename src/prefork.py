@@ -0,0 +1,457 @@
+"""
+Pre-fork multi-worker mode for the HTTP transport.
+
+A supervisor process binds the listening socket and forks worker processes
+that accept from it, each running its own MCPServer, so JSON parsing and
+validation spread across cores. With SO_REUSEPORT every worker binds its
+own socket instead and the kernel balances connections between them.
+
+Sessions live in the worker that created them. Session ids start with that
+worker's index, and a request that lands on another worker is forwarded to
+the owner over the owner's private Unix socket.
+"""
+
+import logging
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+import uuid
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional
+
+import httpx
+import uvicorn
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+from http_transport import DEFAULT_ALLOWED_ORIGINS, SESSION_HEADER, DrainingServer, HTTPTransport
+
+if TYPE_CHECKING:
+    from mcp_server import MCPServer
+
+# Marks requests one worker passed to another, so they are never forwarded again
+FORWARDED_HEADER = "X-Mcp-Forwarded"
+
+# Headers that describe one connection and must not be copied across a hop
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "content-length",
+    "host",
+    "keep-alive",
+    "transfer-encoding",
+    "upgrade",
+}
+
+
+def session_owner(session_id: Optional[str]) -> Optional[int]:
+    """
+    Find the worker that owns a session
+
+    Args:
+        session_id: Value of the Mcp-Session-Id header
+
+    Returns:
+        Index of the owning worker, or None if the id names none
+    """
+    if not session_id:
+        return None
+    index, sep, _ = session_id.partition("-")
+    if not sep or not index.isdigit():
+        return None
+    return int(index)
+
+
+def merge_snapshots(snapshots: Iterable[Dict[str, float]]) -> Dict[str, float]:
+    """
+    Add up metrics snapshots from several workers
+
+    Args:
+        snapshots: One snapshot per worker
+
+    Returns:
+        Sum of every metric across the snapshots
+    """
+    total: Dict[str, float] = {}
+    for snapshot in snapshots:
+        for name, value in snapshot.items():
+            total[name] = total.get(name, 0) + value
+    return total
+
+
+class WorkerTransport(HTTPTransport):
+    """
+    HTTP transport for one worker of a pre-fork group.
+
+    Hands out session ids naming this worker, forwards requests for other
+    workers' sessions to them, and reports metrics for the whole group.
+    """
+
+    def __init__(
+        self,
+        server: "MCPServer",
+        index: int,
+        worker_sockets: List[str],
+        path: str = "/mcp",
+        keepalive: int = 15,
+        session_ttl: float = 600,
+        max_sessions: int = 1024,
+        allowed_origins: Iterable[str] = DEFAULT_ALLOWED_ORIGINS,
+    ):
+        """
+        Args:
+            server: Server owned by this worker
+            index: Position of this worker in the group
+            worker_sockets: Private Unix socket path of every worker, by index
+            path: Endpoint clients POST to and GET events from
+            keepalive: Seconds between keep-alive pings on event streams
+            session_ttl: Seconds an idle session is kept
+            max_sessions: Most sessions this worker keeps at once
+            allowed_origins: Origins browser pages may call from
+        """
+        super().__init__(
+            server,
+            path=path,
+            keepalive=keepalive,
+            session_ttl=session_ttl,
+            max_sessions=max_sessions,
+            allowed_origins=allowed_origins,
+        )
+        self.index = index
+        self.worker_sockets = worker_sockets
+        self._clients: Dict[int, httpx.AsyncClient] = {}
+
+    def new_session_id(self) -> str:
+        return f"{self.index}-{uuid.uuid4().hex}"
+
+    def client(self, index: int) -> httpx.AsyncClient:
+        """
+        Returns:
+            Client connected to the private socket of worker `index`
+        """
+        client = self._clients.get(index)
+        if client is None:
+            client = httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(uds=self.worker_sockets[index]),
+                base_url="http://worker",
+                timeout=None,
+            )
+            self._clients[index] = client
+        return client
+
+    async def handle(self, request: Request) -> Response:
+        if not self.origin_allowed(request.headers.get("origin")):
+            return self.forbidden_origin(request)
+        owner = session_owner(request.headers.get(SESSION_HEADER))
+        if (
+            owner is not None
+            and owner != self.index
+            and owner < len(self.worker_sockets)
+            and FORWARDED_HEADER not in request.headers
+        ):
+            return await self.forward(request, owner)
+        return await super().handle(request)
+
+    async def forward(self, request: Request, owner: int) -> Response:
+        """
+        Pass a request to the worker that owns its session and relay the
+        response, streaming it so event streams keep working
+
+        Args:
+            request: Request that arrived at this worker
+            owner: Index of the worker owning the session
+
+        Returns:
+            The owner's response, or 404 if the owner is not running
+        """
+        headers = [
+            (name, value)
+            for name, value in request.headers.raw
+            if name.decode("latin-1").lower() not in HOP_BY_HOP_HEADERS
+        ]
+        headers.append((FORWARDED_HEADER.encode(), b"1"))
+
+        client = self.client(owner)
+        upstream = client.build_request(
+            request.method,
+            request.url.path,
+            params=request.query_params,
+            headers=headers,
+            content=await request.body(),
+        )
+        try:
+            response = await client.send(upstream, stream=True)
+        except httpx.TransportError:
+            # The owner restarted, and its sessions went with it
+            return Response("Unknown session", status_code=404)
+
+        async def body():
+            try:
+                async for chunk in response.aiter_raw():
+                    yield chunk
+            finally:
+                await response.aclose()
+
+        return StreamingResponse(
+            body(),
+            status_code=response.status_code,
+            headers={
+                name: value
+                for name, value in response.headers.items()
+                if name.lower() not in HOP_BY_HOP_HEADERS
+            },
+        )
+
+    async def handle_metrics(self, request: Request) -> Response:
+        """
+        Report metrics summed over every worker, with each worker's own
+        figures under "workers"
+        """
+        local = self.server.metrics.snapshot()
+        if FORWARDED_HEADER in request.headers:
+            return JSONResponse(local)
+
+        workers = {str(self.index): local}
+        for index in range(len(self.worker_sockets)):
+            if index == self.index:
+                continue
+            try:
+                response = await self.client(index).get(
+                    "/metrics", headers={FORWARDED_HEADER: "1"}
+                )
+                workers[str(index)] = response.json()
+            except httpx.TransportError:
+                logging.warning(f"Worker {index} did not report metrics")
+
+        snapshot: Dict[str, object] = dict(merge_snapshots(workers.values()))
+        snapshot["workers"] = workers
+        return JSONResponse(snapshot)
+
+
+def bind_tcp(host: str, port: int, reuse_port: bool = False) -> socket.socket:
+    """
+    Open a listening TCP socket
+
+    Args:
+        host: Interface to listen on
+        port: Port to listen on
+        reuse_port: Set SO_REUSEPORT so several processes can bind the port
+
+    Returns:
+        The listening socket
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    return sock
+
+
+def bind_unix(path: str) -> socket.socket:
+    """
+    Open a listening Unix socket, replacing a stale one at `path`
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(2048)
+    return sock
+
+
+class Supervisor:
+    """
+    Forks and watches the workers of a pre-fork HTTP server.
+
+    Workers that die are replaced. SIGHUP restarts the workers one at a
+    time, each finishing its in-flight requests first, so the group keeps
+    serving throughout. SIGTERM and SIGINT stop every worker the same way
+    and then exit.
+    """
+
+    def __init__(
+        self,
+        make_server: Callable[[], "MCPServer"],
+        workers: int = 2,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        path: str = "/mcp",
+        keepalive: int = 15,
+        reuse_port: bool = False,
+        graceful_timeout: float = 30,
+        session_ttl: float = 600,
+        max_sessions: int = 1024,
+        allowed_origins: Iterable[str] = DEFAULT_ALLOWED_ORIGINS,
+    ):
+        """
+        Args:
+            make_server: Builds the MCPServer for a worker, called in the worker
+            workers: Number of worker processes
+            host: Interface to listen on
+            port: Port to listen on
+            path: MCP endpoint path
+            keepalive: Seconds idle connections and event streams are kept alive
+            reuse_port: Give each worker its own SO_REUSEPORT socket
+            graceful_timeout: Seconds a stopping worker gets to finish its
+                requests before it is killed
+            session_ttl: Seconds an idle session is kept
+            max_sessions: Most sessions each worker keeps at once
+            allowed_origins: Origins browser pages may call from
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+
+        self.make_server = make_server
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.path = path
+        self.keepalive = keepalive
+        self.reuse_port = reuse_port
+        self.graceful_timeout = graceful_timeout
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self.allowed_origins = tuple(allowed_origins)
+        self.pids: Dict[int, int] = {}
+        self.worker_sockets: List[str] = []
+        self._listener: Optional[socket.socket] = None
+        self._stopping = False
+        self._restart = False
+
+    def spawn(self, index: int) -> None:
+        """
+        Fork worker `index`
+        """
+        pid = os.fork()
+        if pid:
+            self.pids[index] = pid
+            return
+
+        status = 0
+        try:
+            self.run_worker(index)
+        except BaseException:
+            logging.exception(f"Worker {index} failed")
+            status = 1
+        finally:
+            os._exit(status)
+
+    def run_worker(self, index: int) -> None:
+        """
+        Serve requests in a freshly forked worker until told to stop
+        """
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        listener = self._listener or bind_tcp(self.host, self.port, reuse_port=True)
+        private = bind_unix(self.worker_sockets[index])
+
+        server = self.make_server()
+        server.start_workers()
+        transport = WorkerTransport(
+            server,
+            index,
+            self.worker_sockets,
+            path=self.path,
+            keepalive=self.keepalive,
+            session_ttl=self.session_ttl,
+            max_sessions=self.max_sessions,
+            allowed_origins=self.allowed_origins,
+        )
+        config = uvicorn.Config(
+            transport.create_app(),
+            timeout_keep_alive=self.keepalive,
+            timeout_graceful_shutdown=self.graceful_timeout,
+            log_level="warning",
+        )
+        try:
+            DrainingServer(config, server).run(sockets=[listener, private])
+        finally:
+            server.close()
+
+    def stop_worker(self, index: int) -> None:
+        """
+        Ask worker `index` to finish up and wait for it, killing it if it
+        outlives the grace period
+        """
+        pid = self.pids.pop(index)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+
+        deadline = time.monotonic() + self.graceful_timeout
+        while os.waitpid(pid, os.WNOHANG) == (0, 0):
+            if time.monotonic() > deadline:
+                logging.warning(f"Worker {index} did not stop in time, killing it")
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                return
+            time.sleep(0.05)
+
+    def reap(self) -> None:
+        """
+        Replace workers that exited on their own
+        """
+        while self.pids:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            for index, worker_pid in list(self.pids.items()):
+                if worker_pid == pid:
+                    logging.warning(f"Worker {index} exited with status {status}, restarting it")
+                    del self.pids[index]
+                    self.spawn(index)
+
+    def restart(self) -> None:
+        """
+        Replace every worker, one at a time
+        """
+        for index in range(self.workers):
+            self.stop_worker(index)
+            self.spawn(index)
+        logging.info("Restarted all workers")
+
+    def run(self) -> None:
+        """
+        Start the workers and supervise them until SIGTERM or SIGINT
+        """
+        runtime_dir = tempfile.mkdtemp(prefix="mcp-workers-")
+        self.worker_sockets = [
+            os.path.join(runtime_dir, f"worker-{index}.sock") for index in range(self.workers)
+        ]
+        if not self.reuse_port:
+            self._listener = bind_tcp(self.host, self.port)
+
+        def stop(signum, frame):
+            self._stopping = True
+
+        def restart(signum, frame):
+            self._restart = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGHUP, restart)
+
+        for index in range(self.workers):
+            self.spawn(index)
+        logging.info(f"Serving on {self.host}:{self.port} with {self.workers} workers")
+
+        try:
+            while not self._stopping:
+                self.reap()
+                if self._restart:
+                    self._restart = False
+                    self.restart()
+                time.sleep(0.1)
+        finally:
+            for index in list(self.pids):
+                self.stop_worker(index)
+            if self._listener is not None:
+                self._listener.close()
+            shutil.rmtree(runtime_dir, ignore_errors=True)
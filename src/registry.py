@@ -0,0 +1,435 @@
+"""
+Registry of the tools exposed by the MCP server.
+"""
+
+from mcp.types import (
+    CallToolResult,
+    TextContent,
+    Tool,
+)
+
+import bisect
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from jsonschema import Draft202012Validator, SchemaError
+from jsonschema.protocols import Validator
+from jsonschema.validators import extend, validator_for
+
+from tools import MCPTool, ToolContext, use_context
+
+ResultFormatter = Callable[[Dict[str, Any]], CallToolResult]
+TextFormatter = Callable[[Dict[str, Any]], Optional[str]]
+
+# What a call returns: a CallToolResult, or for plain text results when the
+# caller asked for `plain`, the dictionary it would serialize to
+CallResult = Union[CallToolResult, Dict[str, Any]]
+
+# Python types matching each JSON Schema type, for the quick check below
+_JSON_TYPES: Dict[str, Tuple[type, ...]] = {
+    "string": (str,),
+    "boolean": (bool,),
+    "integer": (int,),
+    "number": (int, float),
+    "object": (dict,),
+    "array": (list,),
+    "null": (type(None),),
+}
+_ANNOTATIONS = {"title", "description", "default", "examples", "$schema", "$id", "$comment"}
+
+# Validator classes with the strict integer check below, by draft
+_strict_validators: Dict[type, type] = {}
+
+
+def _is_integer(checker: Any, instance: Any) -> bool:
+    # JSON Schema counts 1.0 as an integer, but tools index and slice with
+    # their integer arguments, so only real ints pass
+    return isinstance(instance, int) and not isinstance(instance, bool)
+
+
+def strict_validator_for(schema: Dict[str, Any]) -> type:
+    """
+    Returns:
+        The validator class for the schema's draft, changed to accept only
+        Python ints as "integer", like the quick check does
+    """
+    base = validator_for(schema, default=Draft202012Validator)
+    strict = _strict_validators.get(base)
+    if strict is None:
+        strict = _strict_validators[base] = extend(
+            base, type_checker=base.TYPE_CHECKER.redefine("integer", _is_integer)
+        )
+    return strict
+
+
+def compile_quick_check(schema: Dict[str, Any]) -> Optional[Callable[[Dict[str, Any]], bool]]:
+    """
+    Compile a flat object schema into a fast validity check.
+
+    Handles the common shape of tool schemas: an object with `required`
+    keys and properties of a single primitive type, optionally with numeric
+    bounds. The check only answers True when the full validator would accept
+    the arguments, so a False just means the full validator has to look.
+
+    Args:
+        schema: Tool input schema
+
+    Returns:
+        The check, or None if the schema uses anything beyond that shape
+    """
+    if schema.get("type") != "object" or set(schema) - _ANNOTATIONS - {
+        "type", "properties", "required", "additionalProperties"
+    }:
+        return None
+
+    types: Dict[str, Tuple[type, ...]] = {}
+    bounds: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+    for field, field_schema in schema.get("properties", {}).items():
+        if not isinstance(field_schema, dict) or set(field_schema) - _ANNOTATIONS - {
+            "type", "minimum", "maximum"
+        }:
+            return None
+        json_type = field_schema.get("type")
+        if json_type is None:
+            if "minimum" in field_schema or "maximum" in field_schema:
+                return None
+            continue
+        if json_type not in _JSON_TYPES:
+            return None
+        types[field] = _JSON_TYPES[json_type]
+        if "minimum" in field_schema or "maximum" in field_schema:
+            if json_type not in ("integer", "number"):
+                return None
+            bounds[field] = (field_schema.get("minimum"), field_schema.get("maximum"))
+
+    required = tuple(schema.get("required", ()))
+    additional = schema.get("additionalProperties", True)
+    if not isinstance(additional, bool):
+        return None
+    known = set(schema.get("properties", {}))
+
+    def check(arguments: Dict[str, Any]) -> bool:
+        for field in required:
+            if field not in arguments:
+                return False
+        for field, value in arguments.items():
+            expected = types.get(field)
+            if expected is not None:
+                # bool is an int in Python but not in JSON
+                if type(value) is bool and bool not in expected:
+                    return False
+                if not isinstance(value, expected):
+                    return False
+                if field in bounds:
+                    low, high = bounds[field]
+                    if (low is not None and value < low) or (high is not None and value > high):
+                        return False
+            elif not additional and field not in known:
+                return False
+        return True
+
+    return check
+
+
+class ToolRegistry:
+    """
+    Name-keyed registry of tool instances.
+
+    Each tool is built once and reused for every call, so dispatching a call
+    is a single dict lookup no matter how many tools are registered. Each
+    tool's `input_schema` is likewise compiled once, and arguments that
+    don't match it are rejected before the tool runs.
+    """
+
+    def __init__(self):
+        self._tools: Dict[str, MCPTool] = {}
+        self._formatters: Dict[str, ResultFormatter] = {}
+        self._text_formatters: Dict[str, Optional[TextFormatter]] = {}
+        self._definitions: Dict[str, Tool] = {}
+        self._validators: Dict[str, Validator] = {}
+        self._quick_checks: Dict[str, Optional[Callable[[Dict[str, Any]], bool]]] = {}
+        self._listeners: List[Callable[[], None]] = []
+        self._sorted_names: Optional[List[str]] = None
+        self.version = 0
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    def __len__(self) -> int:
+        return len(self._tools)
+
+    def __iter__(self) -> Iterator[MCPTool]:
+        return iter(self._tools.values())
+
+    def register(
+        self, tool: MCPTool, formatter: Optional[ResultFormatter] = None
+    ) -> None:
+        """
+        Add a tool to the registry.
+
+        Args:
+            tool: Tool instance to expose
+            formatter: Turns the tool's response into a CallToolResult.
+                Defaults to the tool's own `format_result`.
+        """
+        if tool.name in self._tools:
+            raise ValueError(f"Tool '{tool.name}' is already registered")
+
+        validator_class = strict_validator_for(tool.input_schema)
+        try:
+            validator_class.check_schema(tool.input_schema)
+        except SchemaError as e:
+            raise ValueError(f"Tool '{tool.name}' has an invalid input schema: {e.message}") from e
+
+        self._validators[tool.name] = validator_class(tool.input_schema)
+        self._quick_checks[tool.name] = compile_quick_check(tool.input_schema)
+        self._tools[tool.name] = tool
+        self._formatters[tool.name] = formatter or tool.format_result
+        self._text_formatters[tool.name] = None if formatter else tool.format_text
+        self._definitions[tool.name] = tool.to_tool()
+        self._changed()
+
+    def unregister(self, name: str) -> None:
+        """
+        Remove a tool from the registry.
+
+        Args:
+            name: Name of the tool to remove
+        """
+        if name not in self._tools:
+            raise KeyError(f"Tool '{name}' is not registered")
+
+        del self._tools[name]
+        del self._formatters[name]
+        del self._text_formatters[name]
+        del self._validators[name]
+        del self._quick_checks[name]
+        del self._definitions[name]
+        self._changed()
+
+    def list_tools_page(
+        self, after: Optional[str], limit: int
+    ) -> Tuple[List[Tool], Optional[str]]:
+        """
+        Return one page of tool definitions ordered by name.
+
+        Pages are keyed by the last name already seen rather than a position,
+        so adding or removing tools never shifts a page the client is about
+        to ask for.
+
+        Args:
+            after: Name of the last tool on the previous page, or None for
+                the first page
+            limit: Maximum number of tools on the page
+
+        Returns:
+            The tools on the page and the name to resume after, or None if
+            this is the last page
+        """
+        if self._sorted_names is None:
+            self._sorted_names = sorted(self._definitions)
+
+        start = 0 if after is None else bisect.bisect_right(self._sorted_names, after)
+        names = self._sorted_names[start:start + limit]
+        more = start + limit < len(self._sorted_names)
+        return [self._definitions[name] for name in names], names[-1] if more else None
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        """
+        Register a callback run whenever a tool is added or removed.
+
+        Args:
+            listener: Callable taking no arguments
+        """
+        self._listeners.append(listener)
+
+    def _changed(self) -> None:
+        self.version += 1
+        self._sorted_names = None
+        for listener in self._listeners:
+            listener()
+
+    def get(self, name: str) -> Optional[MCPTool]:
+        """
+        Look up a tool by name.
+
+        Args:
+            name: Name of the tool
+
+        Returns:
+            The registered tool, or None if there is no such tool
+        """
+        return self._tools.get(name)
+
+    def list_tools(self) -> List[Tool]:
+        """
+        Returns:
+            Tool definitions for every registered tool, in registration order
+        """
+        return list(self._definitions.values())
+
+    def call(
+        self,
+        name: str,
+        arguments: Optional[Dict[str, Any]],
+        context: Optional[ToolContext] = None,
+        plain: bool = False,
+    ) -> CallResult:
+        """
+        Call a tool and format its response.
+
+        Arguments that don't match the tool's input schema, and any
+        ValueError the tool raises, are turned into an error result rather
+        than a JSON-RPC error so the model can see it.
+
+        Args:
+            name: Name of the tool to call
+            arguments: Arguments for the tool
+            context: Context the tool sees through `current_context`
+            plain: Return results that are only plain text as the
+                dictionary they serialize to, without building the models
+
+        Returns:
+            Result of the tool call
+        """
+        tool = self._tools.get(name)
+        if tool is None:
+            return self._not_found(name)
+        invalid = self.check_arguments(name, arguments)
+        if invalid is not None:
+            return invalid
+
+        try:
+            with use_context(context or ToolContext()):
+                response = tool.call(arguments)
+        except ValueError as e:
+            return self._tool_error(name, e)
+
+        return self.format_response(name, response, plain)
+
+    async def call_with(
+        self,
+        name: str,
+        arguments: Optional[Dict[str, Any]],
+        invoke: Callable[[MCPTool, Optional[Dict[str, Any]], bool], Awaitable[Any]],
+        plain: bool = False,
+    ) -> CallResult:
+        """
+        Call a tool through `invoke` and format its response.
+
+        Like `call`, but leaves running the tool to `invoke`, for example
+        to run it in another process.
+
+        Args:
+            name: Name of the tool to call
+            arguments: Arguments for the tool
+            invoke: Coroutine function taking the tool, its arguments and
+                whether to format the response, and returning the tool's
+                response, or the serialized CallToolResult when formatting
+            plain: As for `call`
+
+        Returns:
+            Result of the tool call
+        """
+        tool = self._tools.get(name)
+        if tool is None:
+            return self._not_found(name)
+        invalid = self.check_arguments(name, arguments)
+        if invalid is not None:
+            return invalid
+
+        # Without a custom formatter the response is formatted where it was
+        # made, so tools run elsewhere need not be loaded here
+        formatted = self._text_formatters[name] is not None
+        try:
+            response = await invoke(tool, arguments, formatted)
+        except ValueError as e:
+            return self._tool_error(name, e)
+
+        if not formatted:
+            return self.format_response(name, response, plain)
+        return response if plain else CallToolResult.model_validate(response)
+
+    def format_response(self, name: str, response: Dict[str, Any], plain: bool = False) -> CallResult:
+        """
+        Format a tool's response with its registered formatter.
+
+        Args:
+            name: Name of the tool
+            response: Dictionary returned by the tool's `call`
+            plain: As for `call`
+
+        Returns:
+            Result of the tool call
+        """
+        if plain:
+            text_formatter = self._text_formatters[name]
+            text = text_formatter(response) if text_formatter is not None else None
+            if text is not None:
+                return {"content": [{"type": "text", "text": text}], "isError": False}
+        return self._formatters[name](response)
+
+    def check_arguments(
+        self, name: str, arguments: Optional[Dict[str, Any]]
+    ) -> Optional[CallToolResult]:
+        """
+        Check arguments against a registered tool's input schema.
+
+        Args:
+            name: Name of the tool
+            arguments: Arguments for the tool; None is checked as {}
+
+        Returns:
+            None if the arguments are valid, otherwise an error result
+            listing every problem, with the same list in `structuredContent`
+        """
+        instance = {} if arguments is None else arguments
+        quick_check = self._quick_checks[name]
+        if quick_check is not None and quick_check(instance):
+            return None
+
+        errors = list(self._validators[name].iter_errors(instance))
+        if not errors:
+            return None
+
+        problems = []
+        for error in sorted(errors, key=lambda e: list(e.absolute_path)):
+            if error.validator == "required":
+                for field in error.validator_value:
+                    if isinstance(error.instance, dict) and field not in error.instance:
+                        problem = {
+                            "path": f"{error.json_path}.{field}",
+                            "keyword": "required",
+                            "message": f"Missing '{field}' argument",
+                        }
+                        if problem not in problems:
+                            problems.append(problem)
+            else:
+                problems.append({
+                    "path": error.json_path,
+                    "keyword": error.validator,
+                    "message": f"Invalid argument at {error.json_path}: {error.message}",
+                })
+
+        text = "\n".join(problem["message"] for problem in problems)
+        logging.error(f"Invalid arguments for tool '{name}': {text}\n")
+        return CallToolResult(
+            content=[TextContent(type="text", text=text)],
+            structuredContent={"errors": problems},
+            isError=True,
+        )
+
+    @staticmethod
+    def _not_found(name: str) -> CallToolResult:
+        return CallToolResult(
+            content=[TextContent(type="text", text=f"Tool '{name}' not found")],
+            isError=True,
+        )
+
+    @staticmethod
+    def _tool_error(name: str, error: ValueError) -> CallToolResult:
+        logging.error(f"Error calling tool '{name}': {str(error)}\n")
+        return CallToolResult(
+            content=[TextContent(type="text", text=str(error))],
+            isError=True,
+        )
@@ -0,0 +1,105 @@
+"""
+Per-client protocol state shared by the server transports.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Dict, Optional, Protocol, Tuple, Union
+
+from jsonrpc import Message, encode_message
+from tools import ToolContext
+
+RequestId = Union[str, int]
+
+
+class Outbox(Protocol):
+    """
+    Where a transport delivers the encoded messages for one client.
+    """
+
+    # Whether the client is reading the outbox right now
+    listening: bool
+
+    def write(self, data: bytes) -> Awaitable[None]: ...
+
+    def write_nowait(self, data: bytes) -> None: ...
+
+
+class Session:
+    """
+    State for one connected client.
+
+    The server itself is shared between every client of a transport; the
+    handshake state and the way back to the client live here instead.
+    """
+
+    def __init__(self, outbox: Optional[Outbox] = None, session_id: Optional[str] = None):
+        """
+        Args:
+            outbox: Where messages for this client are written
+            session_id: Transport-level session identifier, if any
+        """
+        self.outbox = outbox
+        self.session_id = session_id
+        self.initialized = False
+        self.client_info = None
+        # Requests waiting for their turn and tool calls still running, by
+        # JSON-RPC id, so they can be cancelled
+        self.in_flight: Dict[RequestId, Tuple[ToolContext, asyncio.Future]] = {}
+
+    def cancel(self, request_id: RequestId) -> bool:
+        """
+        Cancel a waiting request or an in-flight tool call
+
+        Args:
+            request_id: JSON-RPC id of the request
+
+        Returns:
+            True if the request was still waiting or running
+        """
+        entry = self.in_flight.get(request_id)
+        if entry is None:
+            return False
+        context, call = entry
+        context.cancel()
+        call.cancel()
+        return True
+
+    async def send_message(self, message: Message) -> None:
+        """
+        Send a JSON-RPC response, waiting if the client is reading slowly
+
+        Args:
+            message: JSON-RPC message or batch reply to send to the client
+        """
+        if self.outbox is not None:
+            await self.outbox.write(encode_message(message))
+
+    def write_message(self, message: Message) -> None:
+        """
+        Send a JSON-RPC message without waiting for buffer space
+
+        Args:
+            message: JSON-RPC message to send to the client
+        """
+        if self.outbox is not None:
+            self.outbox.write_nowait(encode_message(message))
+
+    def send_notification(
+        self, method: str, params: Optional[Dict[str, Any]] = None, transient: bool = False
+    ) -> None:
+        """
+        Send a JSON-RPC notification to the client
+
+        Args:
+            method: Notification method
+            params: Notification parameters, if any
+            transient: Drop the notification instead of keeping it for
+                later if the client isn't listening now, as for progress
+                that is stale by the time anyone reads it
+        """
+        if transient and self.outbox is not None and not self.outbox.listening:
+            return
+        message: Dict[str, Any] = {"jsonrpc": "2.0", "method": method}
+        if params is not None:
+            message["params"] = params
+        self.write_message(message)
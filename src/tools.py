@@ -3,11 +3,212 @@ Defines the tools available in the MCP server.
 """
 
 from mcp.types import (
+    BlobResourceContents,
+    CallToolResult,
+    EmbeddedResource,
+    TextContent,
+    TextResourceContents,
     Tool,
 )
 
+import base64
+import binascii
+import codecs
+import io
+import json
+import mimetypes
+import mmap
 import os
-from typing import Dict, Any, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from stat import S_ISREG
+from typing import BinaryIO, Callable, Dict, Any, Iterator, Optional, Tuple, Type, Union
+
+from file_cache import CachedFile, FileCache
+from line_index import LineIndexCache
+from metrics import Metrics
+
+# Bytes read from a file between cancellation checks
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Most bytes of file content read_file returns in one call
+READ_RESPONSE_LIMIT = 1024 * 1024
+
+# Bytes at the start of a file looked at to tell binary from text
+SNIFF_SIZE = 8192
+
+# Most files one read_files call may ask for
+MAX_BATCH_FILES = 100
+
+# Minimum seconds between two progress notifications for the same call
+PROGRESS_INTERVAL = 0.1
+
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+
+class ToolCancelled(BaseException):
+    """
+    Raised inside a tool when the client has cancelled the call.
+
+    Like asyncio.CancelledError this is not an Exception, so the broad
+    `except Exception` handlers in tools don't turn it into a tool error.
+    """
+
+
+class ToolTimeout(ToolCancelled):
+    """
+    Raised when a tool call runs past its deadline.
+    """
+
+    def __init__(self, timeout: float):
+        super().__init__(f"Tool call timed out after {timeout:g}s")
+        self.timeout = timeout
+
+
+class ToolContext:
+    """
+    State of one in-flight tool call, visible to the tool while it runs.
+
+    Long-running tools should call `check` between chunks of work so a
+    cancelled or timed out call stops promptly instead of running to
+    completion, and `report_progress` so the client can tell a slow call
+    from a hung one.
+    """
+
+    def __init__(
+        self,
+        progress_token: Optional[Union[str, int]] = None,
+        on_progress: Optional[ProgressCallback] = None,
+        progress_interval: float = PROGRESS_INTERVAL,
+        timeout: Optional[float] = None,
+    ):
+        """
+        Args:
+            progress_token: Token the client asked progress to be reported
+                under, or None if it didn't ask for progress
+            on_progress: Called with the params of each progress
+                notification; must be safe to call from any thread
+            progress_interval: Minimum seconds between notifications
+            timeout: Seconds the call may run, or None for no limit
+        """
+        # A plain flag is enough: it is only ever set, and reads of it are
+        # atomic, so the tool's thread sees the change at its next check
+        self._cancelled = False
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.progress_token = progress_token
+        self._on_progress = on_progress
+        self._progress_interval = progress_interval
+        self._last_progress: Optional[float] = None
+        self._last_progress_at = 0.0
+        self._parent: Optional[ToolContext] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled or (self._parent is not None and self._parent.cancelled)
+
+    def child(self) -> "ToolContext":
+        """
+        Context for part of this call's work running on another thread.
+
+        It is cancelled and times out along with this call, but reports no
+        progress, so parts finishing out of order don't confuse the client.
+        """
+        child = ToolContext()
+        child._parent = self
+        child.timeout = self.timeout
+        child.deadline = self.deadline
+        return child
+
+    def cancel(self) -> None:
+        """
+        Ask the tool to stop at its next check.
+        """
+        self._cancelled = True
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def check(self) -> None:
+        """
+        Raises:
+            ToolCancelled: If the call has been cancelled
+            ToolTimeout: If the call has run past its deadline
+        """
+        if self.cancelled:
+            raise ToolCancelled()
+        if self.expired:
+            raise ToolTimeout(self.timeout)
+
+    def report_progress(
+        self,
+        progress: float,
+        total: Optional[float] = None,
+        message: Optional[str] = None,
+    ) -> None:
+        """
+        Report how far along the call is.
+
+        Cheap enough to call on every unit of work: notifications are only
+        sent when the client asked for them, at most once per
+        `progress_interval`, and only when progress has moved forward. The
+        final update (progress == total) is always sent.
+
+        Args:
+            progress: Work done so far
+            total: Total work, if known
+            message: Human-readable description of the current step
+        """
+        if self.progress_token is None or self._on_progress is None:
+            return
+        if self._last_progress is not None and progress <= self._last_progress:
+            return
+
+        now = time.monotonic()
+        finished = total is not None and progress >= total
+        if not finished and now - self._last_progress_at < self._progress_interval:
+            return
+
+        self._last_progress = progress
+        self._last_progress_at = now
+        params: Dict[str, Any] = {"progressToken": self.progress_token, "progress": progress}
+        if total is not None:
+            params["total"] = total
+        if message is not None:
+            params["message"] = message
+        self._on_progress(params)
+
+
+_current_context: ContextVar[Optional[ToolContext]] = ContextVar(
+    "tool_context", default=None
+)
+
+
+def current_context() -> ToolContext:
+    """
+    Returns:
+        Context of the tool call running in this thread, or a fresh context
+        that is never cancelled when a tool is called directly
+    """
+    context = _current_context.get()
+    return context if context is not None else ToolContext()
+
+
+@contextmanager
+def use_context(context: ToolContext) -> Iterator[ToolContext]:
+    """
+    Make `context` the current tool context for the duration of the block.
+    """
+    token = _current_context.set(context)
+    try:
+        yield context
+    finally:
+        _current_context.reset(token)
 
 
 class MCPTool:
@@ -16,6 +217,20 @@ class MCPTool:
     Each tool should implement the `call` method.
     """
 
+    # Seconds a call may run before it is stopped, or None for no limit
+    timeout: Optional[float] = None
+
+    # Set by tools whose `call` makes blocking system calls; the server then
+    # runs them on its worker thread pool instead of the event loop
+    blocking: bool = False
+
+    # Set by CPU-heavy tools; the server then runs them in its worker process
+    # pool. Such tools must be constructible without arguments.
+    cpu_bound: bool = False
+
+    # False for stand-ins whose implementation is imported on first use
+    loaded: bool = True
+
     def __init__(self, name: str, title: str, description, input_schema):
         self.name = name
         self.title = title
@@ -34,6 +249,58 @@ class MCPTool:
         """
         raise NotImplementedError("Subclasses must implement this method")
 
+    def format_result(self, response: Dict[str, Any]) -> CallToolResult:
+        """
+        Format the response of `call` for the client.
+
+        Args:
+            response: Dictionary returned by `call`
+
+        Returns:
+            CallToolResult with the response's message as text
+        """
+        return CallToolResult(
+            content=[TextContent(type="text", text=response["message"])]
+        )
+
+    def format_text(self, response: Dict[str, Any]) -> Optional[str]:
+        """
+        Format a response that is a single block of plain text, so the
+        server can write the result without building a CallToolResult.
+
+        Args:
+            response: Dictionary returned by `call`
+
+        Returns:
+            The text `format_result` would return, or None if the tool
+            formats its responses some other way
+        """
+        if type(self).format_result is not MCPTool.format_result:
+            return None
+        return response["message"]
+
+    def resolve(self) -> "MCPTool":
+        """
+        Returns:
+            The tool that implements `call`; stand-ins for tools that are
+            loaded later return the real tool here
+        """
+        return self
+
+    def worker_target(self) -> Union[Type["MCPTool"], str]:
+        """
+        Returns:
+            What a worker process builds its own copy of the tool from: the
+            tool's class, or a "module:Class" path for the worker to import
+        """
+        return type(self)
+
+    def close(self) -> None:
+        """
+        Release whatever the tool holds, such as worker threads; called
+        when the server stops
+        """
+
     def to_tool(self) -> Tool:
         """
         Convert the tool to a Tool object.
@@ -84,54 +351,602 @@ class Greeting(MCPTool):
         return {"message": f"Hello from the MCP Server {arguments['name']}!"}
 
 
+def encode_read_cursor(state: Dict[str, Any]) -> str:
+    """
+    Build the opaque cursor that continues a truncated read
+    """
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode()
+
+
+def decode_read_cursor(cursor: str) -> Dict[str, Any]:
+    """
+    Recover the read state from a cursor
+
+    Raises:
+        ValueError: If the cursor was not issued by read_file
+    """
+    try:
+        state = json.loads(base64.b64decode(cursor, altchars=b"-_", validate=True))
+    except (binascii.Error, ValueError):
+        state = None
+    if not isinstance(state, dict) or not isinstance(state.get("offset"), int):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return state
+
+
+def is_binary(data: Union[mmap.mmap, bytes]) -> bool:
+    """
+    Guess from the first SNIFF_SIZE bytes whether a file is binary: it is
+    if they hold a NUL byte or aren't valid UTF-8
+    """
+    if data.find(b"\0", 0, SNIFF_SIZE) >= 0:
+        return True
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(data[:SNIFF_SIZE])
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def utf8_width(lead: int) -> int:
+    """
+    Returns:
+        Bytes in the UTF-8 character that starts with byte `lead`
+    """
+    return 1 if lead < 0xC0 else 2 if lead < 0xE0 else 3 if lead < 0xF0 else 4
+
+
+def encode_window(window: Union[memoryview, bytes], binary: bool) -> Tuple[Optional[str], Optional[str], int]:
+    """
+    Turn a window of a file into text, or base64 if it isn't text
+
+    A character cut in two at the end of a text window is left out, so
+    where a range or the size cap happens to end never turns text into a
+    blob.
+
+    Args:
+        window: Bytes of the window
+        binary: Whether the file looked binary
+
+    Returns:
+        The text or None, the base64 blob or None, and the number of
+        bytes of the window used
+    """
+    if not binary:
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        try:
+            text = decoder.decode(window)
+        except UnicodeDecodeError:
+            pass
+        else:
+            return text, None, len(window) - len(decoder.getstate()[0])
+    return None, base64.b64encode(window).decode("ascii"), len(window)
+
+
 class ReadFileTool(MCPTool):
     """
     A tool that reads the contents of a file.
+
+    A read can be limited to a byte range (`offset`/`length`) or a line
+    range (`start_line`/`end_line`). Files are memory-mapped and only that
+    window is decoded; line offsets come from a cached index built on the
+    first line read. Binary files come back as base64 blobs. Responses are
+    capped at `max_bytes`; a window longer than that comes back in pieces,
+    each ending with a cursor for the next.
     """
 
-    def __init__(self):
+    blocking = True
+
+    def __init__(
+        self,
+        max_bytes: int = READ_RESPONSE_LIMIT,
+        line_indexes: Optional[LineIndexCache] = None,
+        file_cache: Optional[FileCache] = None,
+    ):
+        """
+        Args:
+            max_bytes: Most bytes of file content returned by one call
+            line_indexes: Where line-range reads find line offsets;
+                defaults to a cache of this tool's own
+            file_cache: Cache of small files' contents, or None to always
+                read from disk
+        """
         input_schema = {
             "type": "object",
             "properties": {
-                "file_path": {"type": "string", "description": "Path to the file"}
+                "file_path": {"type": "string", "description": "Path to the file"},
+                "offset": {"type": "integer", "minimum": 0, "description": "Byte offset to start reading at"},
+                "length": {"type": "integer", "minimum": 1, "description": "Maximum number of bytes to read"},
+                "start_line": {"type": "integer", "minimum": 1, "description": "First line to read, counting from 1"},
+                "end_line": {"type": "integer", "minimum": 1, "description": "Last line to read, inclusive"},
+                "cursor": {"type": "string", "description": "Cursor returned by a truncated read, to continue it"},
             },
             "required": ["file_path"],
         }
         super().__init__(
             name="read_file",
             title="Read File Tool",
-            description="Reads the contents of a specified file.",
+            description="Reads the contents of a specified file, optionally only a range of bytes or lines. "
+            "Long reads are returned in pieces; pass the returned cursor to get the next one.",
             input_schema=input_schema,
         )
+        self.max_bytes = max_bytes
+        self.line_indexes = line_indexes if line_indexes is not None else LineIndexCache()
+        self.file_cache = file_cache
 
-    def call(self, arguments: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    def call(self, arguments: Optional[Dict[str, Any]]) -> Dict[str, Any]:
         """
         Reads the contents of a file.
 
         Args:
-            arguments: Dictionary containing the file path
+            arguments: Dictionary containing the file path and optional range
 
         Returns:
-            Dictionary with the file contents
+            Dictionary with the text read (or a base64 blob for binary
+            files), the byte range it came from, the file size, and a
+            cursor if the read was cut short
         """
         if not arguments or "file_path" not in arguments:
             raise ValueError("Missing 'file_path' argument in tool call")
+        return self.read(arguments, self.max_bytes, current_context())
+
+    def read(self, arguments: Dict[str, Any], max_bytes: int, context: ToolContext) -> Dict[str, Any]:
+        """
+        Read one file, as `call` does, returning at most `max_bytes`
+
+        Args:
+            arguments: File path and optional range, as for `call`
+            max_bytes: Most bytes of file content to return
+            context: Checked for cancellation and told the read's progress
 
+        Returns:
+            Dictionary returned by `call`
+        """
         file_path = arguments["file_path"]
+        ranges = [
+            "offset" in arguments or "length" in arguments,
+            "start_line" in arguments or "end_line" in arguments,
+            "cursor" in arguments,
+        ]
+        if sum(ranges) > 1:
+            raise ValueError("Use only one of offset/length, start_line/end_line or cursor")
+
         try:
-            with open(file_path, "r") as file:
-                content = file.read()
-            return {"content": content}
+            cached = self.file_cache.lookup(file_path) if self.file_cache is not None else None
+            if cached is not None:
+                response = self.read_mapped(
+                    cached.data, io.BytesIO(cached.data), cached.stat, arguments, max_bytes, context, cached
+                )
+            else:
+                with open(file_path, "rb") as file:
+                    stat = os.fstat(file.fileno())
+                    if not S_ISREG(stat.st_mode):
+                        if any(ranges):
+                            raise ValueError("Ranges and cursors need a regular file")
+                        response = self.read_stream(file, max_bytes, context)
+                    elif self.file_cache is not None and self.file_cache.accepts(stat.st_size):
+                        cached = self.cache_file(file_path, file, stat)
+                        response = self.read_mapped(
+                            cached.data, file, stat, arguments, max_bytes, context, cached
+                        )
+                    elif stat.st_size:
+                        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                            response = self.read_mapped(mapped, file, stat, arguments, max_bytes, context)
+                    else:
+                        response = self.read_mapped(b"", file, stat, arguments, max_bytes, context)
         except Exception as e:
             raise ValueError(f"Error reading file '{file_path}': {str(e)}")
 
+        if response["blob"] is not None:
+            response["uri"] = Path(file_path).resolve().as_uri()
+            response["mime_type"] = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        return response
+
+    def read_mapped(
+        self,
+        mapped: Union[mmap.mmap, bytes],
+        file: BinaryIO,
+        stat: os.stat_result,
+        arguments: Dict[str, Any],
+        max_bytes: int,
+        context: ToolContext,
+        cached: Optional[CachedFile] = None,
+    ) -> Dict[str, Any]:
+        """
+        Read the window described by `arguments` from a mapped regular file,
+        or from its cached contents
+
+        Only the window is decoded or base64-encoded, straight from the
+        mapping, so the file is never copied as a whole. A whole cached
+        text file is not decoded at all.
+        """
+        size = stat.st_size
+        binary = cached.text is None if cached is not None else is_binary(mapped)
+        by_lines = False
+
+        if "cursor" in arguments:
+            state = decode_read_cursor(arguments["cursor"])
+            if state.get("mtime") != stat.st_mtime_ns or state.get("size") != size:
+                raise ValueError("File changed since the cursor was issued; start the read again")
+            start, end, by_lines = state["offset"], state.get("end", size), bool(state.get("lines"))
+        elif "start_line" in arguments or "end_line" in arguments:
+            first = arguments.get("start_line", 1)
+            last = arguments.get("end_line")
+            if last is not None and last < first:
+                raise ValueError("end_line is before start_line")
+            start = self.line_indexes.line_start(file, stat, first, context)
+            end = size if last is None else self.line_indexes.line_start(file, stat, last + 1, context)
+            by_lines = True
+        else:
+            start = min(arguments.get("offset", 0), size)
+            length = arguments.get("length")
+            end = size if length is None else min(size, start + length)
+
+        if not binary:
+            # Don't start a text window inside a character
+            while start < end and mapped[start] & 0xC0 == 0x80:
+                start += 1
+
+        stop = min(end, start + max_bytes)
+        if stop < end and by_lines:
+            # End on a whole line so the next piece starts on one
+            newline = mapped.rfind(b"\n", start, stop)
+            if newline >= 0:
+                stop = newline + 1
+        if not binary and start < stop < end:
+            # A cap smaller than the first character still takes all of
+            # it, so every piece moves the read on
+            stop = max(stop, min(end, start + utf8_width(mapped[start])))
+
+        context.check()
+        if cached is not None and cached.text is not None and start == 0 and stop == size:
+            text, blob, used = cached.text, None, size
+        else:
+            with memoryview(mapped) as view, view[start:stop] as window:
+                text, blob, used = encode_window(window, binary)
+        if stop == end:
+            # The range itself ended inside a character
+            end = start + used
+        stop = start + used
+        if size:
+            context.report_progress(stop, size)
+
+        cursor = None
+        if stop < end:
+            cursor = encode_read_cursor({
+                "offset": stop,
+                "end": end,
+                "lines": by_lines,
+                "mtime": stat.st_mtime_ns,
+                "size": size,
+            })
+
+        return {
+            "content": text,
+            "blob": blob,
+            "offset": start,
+            "end": stop,
+            "size": size,
+            "truncated": stop < end,
+            "next_cursor": cursor,
+        }
+
+    def cache_file(self, file_path: str, file: BinaryIO, stat: os.stat_result) -> CachedFile:
+        """
+        Read a whole file, decoding it unless it is binary, and cache it
+        """
+        data = file.read()
+        text = None
+        if not is_binary(data):
+            try:
+                text = data.decode()
+            except UnicodeDecodeError:
+                pass
+        cached = CachedFile(stat, data, text)
+        self.file_cache.store(file_path, cached)
+        return cached
+
+    def read_stream(self, file: BinaryIO, max_bytes: int, context: ToolContext) -> Dict[str, Any]:
+        """
+        Read from a pipe or device that can't be mapped, up to `max_bytes`
+        """
+        chunks = []
+        total = 0
+        complete = False
+        while total < max_bytes:
+            chunk = file.read(min(READ_CHUNK_SIZE, max_bytes - total))
+            if not chunk:
+                complete = True
+                break
+            chunks.append(chunk)
+            total += len(chunk)
+            context.check()
+
+        data = b"".join(chunks)
+        text, blob, used = encode_window(data, is_binary(data))
+        return {
+            "content": text,
+            "blob": blob,
+            "offset": 0,
+            "end": used,
+            "size": used,
+            "truncated": not complete,
+            "next_cursor": None,
+        }
+
+    def format_result(self, response: Dict[str, Any]) -> CallToolResult:
+        """
+        Format the file contents for the client.
+
+        Args:
+            response: Dictionary returned by `call`
+
+        Returns:
+            CallToolResult with the file contents as text, or as an embedded
+            blob resource for binary files, followed by a note on how to
+            continue if the read was cut short
+        """
+        content: list = []
+        if response["blob"] is not None:
+            resource = BlobResourceContents(
+                uri=response["uri"], mimeType=response["mime_type"], blob=response["blob"]
+            )
+            content.append(EmbeddedResource(type="resource", resource=resource))
+        else:
+            content.append(TextContent(type="text", text=response["content"]))
+        if response["truncated"]:
+            note = f"[Read stopped at byte {response['end']} of {response['size']}."
+            if response["next_cursor"]:
+                note += f" Call read_file with cursor \"{response['next_cursor']}\" to continue."
+            content.append(TextContent(type="text", text=note + "]"))
+        return CallToolResult(content=content)
+
+
+def join_reads(first: Dict[str, Any], more: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Extend a truncated read with the read that continued from its cursor
+    """
+    if first["blob"] is not None:
+        first["blob"] = base64.b64encode(base64.b64decode(first["blob"]) + base64.b64decode(more["blob"])).decode("ascii")
+    else:
+        first["content"] += more["content"]
+    first["end"] = more["end"]
+    first["truncated"] = more["truncated"]
+    first["next_cursor"] = more["next_cursor"]
+    return first
+
+
+class ReadFilesTool(MCPTool):
+    """
+    A tool that reads several files in one call.
+
+    Files are read concurrently on a small thread pool of the tool's own,
+    each through a ReadFileTool, so ranges, caching and binary files work
+    as they do there. The pool is separate from the server's blocking pool,
+    whose threads would otherwise wait on themselves, and is stopped by
+    `close`. Results come back in request order, and a file that can't be
+    read gets an error without failing the others. The total content
+    returned is capped at `max_bytes`: every file first gets an equal
+    share, and what the smaller files leave over goes to the files that
+    were cut short, in request order, continuing where their first read
+    stopped.
+    """
+
+    blocking = True
+
+    def __init__(
+        self,
+        reader: Optional[ReadFileTool] = None,
+        max_bytes: int = READ_RESPONSE_LIMIT,
+        max_workers: int = 4,
+        metrics: Optional[Metrics] = None,
+    ):
+        """
+        Args:
+            reader: Tool each file is read with; defaults to a new ReadFileTool
+            max_bytes: Most bytes of file content returned by one call, over
+                all files
+            max_workers: Number of files read at once
+            metrics: Where the read pool's size, queue depth and tasks are
+                reported
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+
+        self.reader = reader if reader is not None else ReadFileTool()
+        file_schema = {
+            "type": "object",
+            "properties": dict(self.reader.input_schema["properties"]),
+            "required": ["file_path"],
+        }
+        input_schema = {
+            "type": "object",
+            "properties": {
+                "files": {
+                    "type": "array",
+                    "items": {"anyOf": [{"type": "string"}, file_schema]},
+                    "minItems": 1,
+                    "maxItems": MAX_BATCH_FILES,
+                    "description": "Files to read: paths, or objects with a file_path and an optional range as for read_file",
+                },
+            },
+            "required": ["files"],
+        }
+        super().__init__(
+            name="read_files",
+            title="Read Files Tool",
+            description="Reads several files in one call, each optionally limited to a range of bytes or lines "
+            "as in read_file. Results come back in the order the files were given.",
+            input_schema=input_schema,
+        )
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+
+        self.metrics.gauge("read_pool_size", lambda: self.max_workers)
+        self.metrics.gauge("read_pool_queued", lambda: self._queued)
+        self.metrics.gauge("read_pool_active", lambda: self._active)
+
+    def executor(self) -> ThreadPoolExecutor:
+        """
+        Returns:
+            The pool files are read on, started on first use
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="mcp-read")
+            return self._executor
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def call(self, arguments: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Reads the contents of several files.
+
+        Args:
+            arguments: Dictionary containing the list of files
+
+        Returns:
+            Dictionary with one entry per file, in request order: what
+            ReadFileTool returns plus the file's path and URI, or the
+            file's path and an error
+        """
+        if not arguments or "files" not in arguments:
+            raise ValueError("Missing 'files' argument in tool call")
+
+        requests = [
+            {"file_path": entry} if isinstance(entry, str) else entry for entry in arguments["files"]
+        ]
+        if not requests:
+            return {"files": [], "max_bytes": self.max_bytes}
+
+        context = current_context()
+        share = max(self.max_bytes // len(requests), 1)
+
+        def job(request: Dict[str, Any]) -> Dict[str, Any]:
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+            try:
+                return self.read_one(request, share, context)
+            finally:
+                with self._lock:
+                    self._active -= 1
+
+        with self._lock:
+            self._queued += len(requests)
+        self.metrics.increment("read_pool_tasks", len(requests))
+        results = []
+        futures = [self.executor().submit(job, request) for request in requests]
+        try:
+            for done, future in enumerate(futures, 1):
+                results.append(future.result())
+                context.report_progress(done, len(requests))
+        finally:
+            for future in futures:
+                if future.cancel():
+                    with self._lock:
+                        self._queued -= 1
+
+        # Hand what the smaller files left over to the ones cut short
+        spare = self.max_bytes - sum(result["end"] - result["offset"] for result in results if "error" not in result)
+        for position, result in enumerate(results):
+            if spare <= 0:
+                break
+            if "error" in result or not result["next_cursor"]:
+                continue
+            more = self.read_one({"file_path": result["file_path"], "cursor": result["next_cursor"]}, spare, context)
+            if "error" in more or (more["blob"] is None) != (result["blob"] is None):
+                continue
+            spare -= more["end"] - more["offset"]
+            results[position] = join_reads(result, more)
+
+        return {"files": results, "max_bytes": self.max_bytes}
+
+    def read_one(self, request: Dict[str, Any], max_bytes: int, context: ToolContext) -> Dict[str, Any]:
+        """
+        Read one file of the batch, turning failures into an error entry
+        """
+        context.check()
+        file_path = request.get("file_path")
+        if not isinstance(file_path, str):
+            return {"file_path": file_path, "error": "Missing 'file_path' in files entry"}
+        try:
+            response = self.reader.read(request, max_bytes, context.child())
+        except ValueError as e:
+            return {"file_path": file_path, "error": str(e)}
+
+        response["file_path"] = file_path
+        response.setdefault("uri", Path(file_path).resolve().as_uri())
+        return response
+
+    def format_result(self, response: Dict[str, Any]) -> CallToolResult:
+        """
+        Format the files for the client.
+
+        Args:
+            response: Dictionary returned by `call`
+
+        Returns:
+            CallToolResult with one embedded resource per file, or a text
+            error for files that couldn't be read, in request order, then a
+            note listing any files cut short by the size cap
+        """
+        content: list = []
+        cut_short = []
+        for result in response["files"]:
+            if "error" in result:
+                content.append(TextContent(type="text", text=result["error"]))
+                continue
+
+            if result["blob"] is not None:
+                resource: Union[BlobResourceContents, TextResourceContents] = BlobResourceContents(
+                    uri=result["uri"], mimeType=result["mime_type"], blob=result["blob"]
+                )
+            else:
+                resource = TextResourceContents(
+                    uri=result["uri"],
+                    mimeType=mimetypes.guess_type(result["file_path"])[0] or "text/plain",
+                    text=result["content"],
+                )
+            content.append(EmbeddedResource(type="resource", resource=resource))
+
+            if result["truncated"]:
+                note = f"{result['file_path']} stopped at byte {result['end']} of {result['size']}"
+                if result["next_cursor"]:
+                    note += f" (continue with cursor \"{result['next_cursor']}\")"
+                cut_short.append(note)
+
+        if cut_short:
+            content.append(
+                TextContent(
+                    type="text",
+                    text=f"[Output is capped at {response['max_bytes']} bytes: " + "; ".join(cut_short) + "]",
+                )
+            )
+        return CallToolResult(content=content)
+
 
 class WriteFileTool(MCPTool):
     """
     A tool that writes content to a file.
     """
 
-    def __init__(self):
+    blocking = True
+
+    def __init__(self, file_cache: Optional[FileCache] = None):
+        """
+        Args:
+            file_cache: Cache of file contents to drop written files from
+        """
         input_schema = {
             "type": "object",
             "properties": {
@@ -149,6 +964,7 @@ class WriteFileTool(MCPTool):
             description="Writes content to a specified file.",
             input_schema=input_schema,
         )
+        self.file_cache = file_cache
 
     def call(self, arguments: Optional[Dict[str, Any]]) -> Dict[str, str]:
         """
@@ -171,6 +987,9 @@ class WriteFileTool(MCPTool):
             return {"message": f"Content written to {file_path}"}
         except Exception as e:
             raise ValueError(f"Error writing to file '{file_path}': {str(e)}")
+        finally:
+            if self.file_cache is not None:
+                self.file_cache.invalidate(file_path)
 
 
 class CreateDirectoryTool(MCPTool):
@@ -178,6 +997,8 @@ class CreateDirectoryTool(MCPTool):
     A tool that creates a directory.
     """
 
+    blocking = True
+
     def __init__(self):
         input_schema = {
             "type": "object",
@@ -232,6 +1053,8 @@ class ListDirectoryTool(MCPTool):
     A tool that lists files in a directory, filtering out unnecessary files.
     """
 
+    blocking = True
+
     def __init__(self):
         input_schema = {
             "type": "object",
@@ -277,27 +1100,30 @@ class ListDirectoryTool(MCPTool):
         
         skip_extensions = {'.pyc', '.pyo', '.pyd', '.so', '.dll', '.log', '.tmp', '.swp', '.bak'}
 
+        context = current_context()
         try:
-            all_items = os.listdir(directory_path)
             files = []
             directories = []
-            
-            for item in all_items:
-                if item.startswith('.') and item not in {'.gitignore', '.env.example', '.dockerignore'}:
-                    continue
-                if item in skip_patterns:
-                    continue
-                if any(item.endswith(ext) for ext in skip_extensions):
-                    continue
-                if any(pattern.replace('*', '') in item for pattern in skip_patterns if '*' in pattern):
-                    continue
-                
-                item_path = os.path.join(directory_path, item)
-                if os.path.isfile(item_path):
-                    files.append(item)
-                elif os.path.isdir(item_path):
-                    directories.append(item)
-            
+
+            with os.scandir(directory_path) as entries:
+                for scanned, entry in enumerate(entries, 1):
+                    context.check()
+                    context.report_progress(scanned, message=f"Scanned {scanned} entries")
+                    item = entry.name
+                    if item.startswith('.') and item not in {'.gitignore', '.env.example', '.dockerignore'}:
+                        continue
+                    if item in skip_patterns:
+                        continue
+                    if any(item.endswith(ext) for ext in skip_extensions):
+                        continue
+                    if any(pattern.replace('*', '') in item for pattern in skip_patterns if '*' in pattern):
+                        continue
+
+                    if entry.is_file():
+                        files.append(item)
+                    elif entry.is_dir():
+                        directories.append(item)
+
             return {
                 "directory": directory_path,
                 "files": sorted(files),
@@ -307,3 +1133,24 @@ class ListDirectoryTool(MCPTool):
             }
         except Exception as e:
             raise ValueError(f"Error listing directory '{directory_path}': {str(e)}")
+
+    def format_result(self, response: Dict[str, Any]) -> CallToolResult:
+        """
+        Format the directory listing for the client.
+
+        Args:
+            response: Dictionary returned by `call`
+
+        Returns:
+            CallToolResult with the files and directories as text
+        """
+        formatted_response = f"Directory: {response['directory']}\n\n"
+        formatted_response += f"Files ({response['total_files']}):\n"
+        for file in response['files']:
+            formatted_response += f"  {file}\n"
+        formatted_response += f"\nDirectories ({response['total_directories']}):\n"
+        for directory in response['directories']:
+            formatted_response += f"  {directory}/\n"
+        return CallToolResult(
+            content=[TextContent(type="text", text=formatted_response)]
+        )
@@ -0,0 +1,109 @@
+"""
+Outgoing message writer shared by the server transports.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional
+
+Sink = Callable[[bytes], Awaitable[None]]
+
+
+class MessageWriter:
+    """
+    Writes newline-delimited JSON-RPC messages to a stream from one task.
+
+    Messages that are ready at the same time are joined into one write, so
+    a burst of small responses costs one write and one flush instead of one
+    per message. At most `max_pending` messages are buffered; past that,
+    `write` waits until the client has caught up.
+    """
+
+    # The stream is read for as long as the writer exists
+    listening = True
+
+    def __init__(self, sink: Sink, max_pending: int = 256):
+        """
+        Args:
+            sink: Coroutine function that writes and flushes a chunk of bytes
+            max_pending: Number of buffered messages before writers wait
+        """
+        if max_pending < 1:
+            raise ValueError("max_pending must be at least 1")
+
+        self._sink = sink
+        self._max_pending = max_pending
+        self._pending: Deque[bytes] = deque()
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._closing = False
+        self._broken = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        """Number of messages waiting to be written"""
+        return len(self._pending)
+
+    def start(self) -> None:
+        """
+        Start the task that drains the buffer into the sink.
+        """
+        self._task = asyncio.create_task(self._run())
+
+    async def write(self, data: bytes) -> None:
+        """
+        Queue one encoded message, waiting while the buffer is full.
+
+        Args:
+            data: Encoded message, without the trailing newline
+        """
+        while len(self._pending) >= self._max_pending and not self._broken:
+            self._space.clear()
+            await self._space.wait()
+        self.write_nowait(data)
+
+    def write_nowait(self, data: bytes) -> None:
+        """
+        Queue one encoded message without waiting for buffer space.
+
+        Meant for small server-initiated notifications; responses should use
+        `write` so a slow client pushes back on request handling.
+
+        Args:
+            data: Encoded message, without the trailing newline
+        """
+        if self._broken:
+            return
+        self._pending.append(data)
+        self._ready.set()
+
+    async def close(self) -> None:
+        """
+        Flush everything still buffered and stop the writer task.
+        """
+        self._closing = True
+        self._ready.set()
+        if self._task is not None:
+            await self._task
+
+    async def _run(self) -> None:
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+
+            while self._pending and not self._broken:
+                chunk = b"\n".join(self._pending) + b"\n"
+                self._pending.clear()
+                self._space.set()
+                try:
+                    await self._sink(chunk)
+                except OSError as e:
+                    logging.error(f"Client connection lost: {e}")
+                    self._broken = True
+                    self._space.set()
+
+            if self._closing:
+                return